@@ -1,61 +1,330 @@
 #!/usr/bin/env python3
 """
 Ollama 格式的本地 API 服务（无 API Key）
-在独立线程中运行 Flask，提供 /api/chat、/api/tags，与 Ollama 接口一致；
-通过 request_queue 将请求交给 Qt 主线程在 DeepSeek 网页中执行，通过 response_dict + Event 取回回复。
+在独立线程的 asyncio 事件循环中运行 aiohttp，提供 /api/chat、/api/tags，与 Ollama 接口一致；
+通过 request_queue 将请求交给 Qt 主线程在 DeepSeek 网页中执行，Qt 侧写入 response_dict 后调用 event.set()，
+唤醒事件循环中等待的协程。等待中的请求只占用一个协程，不再每个请求阻塞一个线程。
 """
 
+import asyncio
 import json
-import re
 import threading
+import time
+import os
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from queue import Queue
 from datetime import datetime, timezone
 
+import metrics
+from batch_jobs import BatchFormatError, BatchStore, parse_jsonl
+from content_normalizer import StreamingNormalizer, normalize_content
+from request_scheduler import AdmissionController, ClientPolicy, FairScheduler
+from request_trace import RequestTrace, TraceLog
+from response_cache import MemoCache, ResponseCache, cache_key
+from schema_validation import SchemaCache, SchemaError, make_repair
+from session_store import NEW_CONVERSATION, SessionStore, canonical_message, fingerprint, split_turn, turn_text
+from tool_calls import ToolCallStream, extract_tool_calls, iter_argument_fragments, ollama_tool_calls
+
 try:
-    from flask import Flask, request, jsonify, Response
-    HAS_FLASK = True
+    from aiohttp import web
+    HAS_AIOHTTP = True
 except ImportError:
-    HAS_FLASK = False
+    HAS_AIOHTTP = False
+
+REPLY_TIMEOUT = 180.0  # 等待网页回复的最长时间（秒），超时提示与准入预算都用它（原为 120 秒）
+
+
+class LoopEvent:
+    """供 Qt 主线程调用的 Event：set() 线程安全地唤醒事件循环中 await wait() 的协程。"""
+
+    def __init__(self, loop: "asyncio.AbstractEventLoop"):
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def set(self):
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            pass  # 事件循环已关闭（服务退出）
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    async def wait(self, timeout: float) -> bool:
+        """等待 set()；超时返回 False。"""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class StreamChannel:
+    """单个请求的流式通道：Qt 主线程发布网页回复的最新快照，事件循环中的响应协程等待新版本并计算增量。"""
+
+    def __init__(self, loop: "asyncio.AbstractEventLoop"):
+        self._loop = loop
+        self._text = ""
+        self._version = 0
+        self._closed = False
+        self._waiter = None
+        self.created_at = time.monotonic()  # 投递时间：Qt 侧出队时据此记录排队等待直方图
+        self.trace = RequestTrace(self.created_at)  # 阶段打点：Qt 侧在生命周期各节点调用 trace.mark()
+        self.started_at = None  # Qt 侧出队开始执行的时间（time.monotonic），用于统计服务时间
+        self.cancelled = False  # 事件循环侧置位；Qt 侧轮询时发现后点击停止按钮并释放标签页
+        self.repair = None  # json_schema 请求的校验回调：Qt 侧最终抓取后调用，返回修复追问或 None
+        self.repaired = False  # Qt 侧已在同一对话中发送过修复追问
+        self.conversation = None  # 会话复用：发送前要切换到的对话 URL，NEW_CONVERSATION 为新开对话，None 为沿用当前页面
+        self.conversation_url = None  # Qt 侧完成后写回本次回复所在的对话 URL
+        self.completion = None  # Qt 侧判定生成完成的检测器：stop_button / action_bar / stability
+
+    def mark_started(self):
+        """Qt 主线程在标签页开始执行本请求时调用。"""
+        self.started_at = time.monotonic()
+
+    def publish(self, text: str):
+        """Qt 主线程调用：写入当前抓取到的完整回复（快照，非增量）。"""
+        self._call(self._apply, text)
+
+    def close(self):
+        """最终结果已写入 response_dict 后调用，唤醒等待方。"""
+        self._call(self._apply, None)
+
+    def _call(self, fn, *args):
+        try:
+            self._loop.call_soon_threadsafe(fn, *args)
+        except RuntimeError:
+            pass
+
+    def _apply(self, text):
+        if self._closed:
+            return
+        if text is None:
+            self._closed = True
+        elif text == self._text:
+            return
+        else:
+            self._text = text
+            self._version += 1
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+        self._waiter = None
+
+    async def wait(self, version: int, timeout: float):
+        """等待版本号超过 version 或通道关闭；返回 (version, text, closed)。"""
+        if self._version == version and not self._closed:
+            if self._waiter is None:
+                self._waiter = self._loop.create_future()
+            try:
+                await asyncio.wait_for(asyncio.shield(self._waiter), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._version, self._text, self._closed
+
 
+class Flight:
+    """一次浏览器执行（一个 request_queue 条目）；相同请求的并发等待方共享其流式快照与最终结果。"""
 
-def _run_flask(port: int, request_queue: Queue, response_dict: dict, app: "Flask"):
-    """在子线程中运行 Flask（开发模式禁用 reload）。"""
-    app.run(host="127.0.0.1", port=port, threaded=True, use_reloader=False)
+    def __init__(self, request_id: str, event: LoopEvent, channel: StreamChannel):
+        self.request_id = request_id
+        self.event = event
+        self.channel = channel
+        self.result = asyncio.get_running_loop().create_future()  # 规范化后的最终回复
+        self.raw = ""  # Qt 侧写回的原始最终回复（流式响应据此补完增量规范化）
+        self.waiters = 1
+        self.cancelled = False  # 所有等待方都已离开，已从队列移除或已通知 Qt 侧停止生成
+        self.schema_status = None  # json_schema 请求的校验结果（valid / repaired / invalid），完成时写入
 
 
-def create_app(request_queue: Queue, response_dict: dict) -> "Flask":
-    """创建 Flask 应用，Ollama 接口格式，无 API Key。"""
-    app = Flask(__name__)
+class Ticket:
+    """一个等待中的客户端请求（X-Request-Id）；断开连接或 DELETE 时释放对所属 Flight 的占用。"""
 
-    @app.after_request
-    def cors_headers(resp):
+    def __init__(self, request_id: str, flight: Flight):
+        self.request_id = request_id
+        self.flight = flight
+        self.cancelled = False
+        self.released = False
+        self.cancel_future = asyncio.get_running_loop().create_future()
+
+
+class RequestCancelled(Exception):
+    """请求已通过 DELETE /v1/requests/{id} 取消。"""
+
+
+def _json_response(obj, status: int = 200) -> "web.Response":
+    return web.json_response(obj, status=status, dumps=lambda o: json.dumps(o, ensure_ascii=False))
+
+
+def _approx_tokens(text) -> int:
+    if not text:
+        return 0
+    return max(1, (len(text) * 2) // 3)
+
+
+def _prompt_tokens(messages) -> int:
+    """按消息文本长度粗略估算 prompt tokens（网页端拿不到真实用量）。"""
+    total = 0
+    for m in messages or []:
+        c = m.get("content") if isinstance(m, dict) else None
+        if isinstance(c, str):
+            total += _approx_tokens(c)
+        elif isinstance(c, list):
+            for p in c:
+                if isinstance(p, dict) and p.get("type") == "text":
+                    total += _approx_tokens(p.get("text") or "")
+                    break
+    return total
+
+
+async def _read_json(request: "web.Request"):
+    """读取 JSON 请求体；非法 JSON 返回 None。"""
+    try:
+        body = await request.json()
+    except Exception:
+        return None
+    return body if isinstance(body, dict) else {}
+
+
+def create_app(request_queue: Queue, response_dict: dict) -> "web.Application":
+    """创建 aiohttp 应用，Ollama 接口格式，无 API Key。"""
+
+    @web.middleware
+    async def preflight(request, handler):
+        if request.method == "OPTIONS":
+            return web.Response(status=204)
+        # 客户端可自带 X-Request-Id，以便稍后 DELETE /v1/requests/{id} 取消
+        request_id = request.headers.get("X-Request-Id") or str(uuid.uuid4())
+        request["request_id"] = request_id if request_id not in tickets else str(uuid.uuid4())
+        return await handler(request)
+
+    async def cors_headers(request, resp):
+        # on_response_prepare：流式响应在 prepare() 时即发送响应头，因此在此统一补充
         resp.headers["Access-Control-Allow-Origin"] = "*"
-        resp.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
-        resp.headers["Access-Control-Allow-Headers"] = "Content-Type"
+        resp.headers["Access-Control-Allow-Methods"] = "GET, POST, DELETE, OPTIONS"
+        resp.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, X-Api-Key, X-Request-Id, X-Client-Id, X-Priority, X-Request-Timeout"
+        resp.headers["Access-Control-Expose-Headers"] = (
+            "X-Request-Id, X-Cache, X-Queue-Position, X-Queue-ETA, X-Schema-Validation, Server-Timing, Retry-After"
+        )
+        if "request_id" in request:
+            resp.headers.setdefault("X-Request-Id", request["request_id"])
         resp.headers["X-Server"] = "DeepSeek-Qt-Ollama-Local"
-        return resp
 
-    @app.route("/", methods=["GET"])
-    def index():
-        return jsonify({
+    inflight = set()  # 已投递、尚未取回结果的请求 ID（含排队中与执行中）
+    flights = {}  # cache_key -> Flight：在途的浏览器执行，相同请求并发到达时合并到同一执行
+    tickets = {}  # X-Request-Id -> Ticket：等待中的客户端请求，供 DELETE /v1/requests/{id} 取消
+    flight_stats = {"coalesced": 0, "cancelled": 0}
+    admission = AdmissionController(workers=int(os.environ.get("DEEPSEEK_API_TABS", "1")))
+    client_policy = ClientPolicy(ClientPolicy.parse_keys(os.environ.get("DEEPSEEK_CLIENT_KEYS", "")))
+    response_cache = ResponseCache(
+        max_entries=int(os.environ.get("DEEPSEEK_CACHE_SIZE", "256")),
+        ttl=float(os.environ.get("DEEPSEEK_CACHE_TTL", "3600")),
+        disk_path=os.environ.get("DEEPSEEK_CACHE_DB") or None,
+    )
+    schema_cache = SchemaCache(max_entries=int(os.environ.get("DEEPSEEK_SCHEMA_CACHE_SIZE", "128")))
+    instruction_cache = MemoCache(max_entries=int(os.environ.get("DEEPSEEK_PROMPT_CACHE_SIZE", "64")))
+    sessions = SessionStore(
+        max_entries=int(os.environ.get("DEEPSEEK_SESSION_SIZE", "512")),
+        ttl=float(os.environ.get("DEEPSEEK_SESSION_TTL", str(6 * 3600))),
+    )
+    session_reuse = os.environ.get("DEEPSEEK_SESSION_REUSE", "1") != "0"
+    # 批量任务：条目状态持久化到 SQLite，重启后继续执行；DEEPSEEK_BATCH_DB 置空时只保存在内存
+    batch_store = BatchStore(os.environ.get("DEEPSEEK_BATCH_DB", "batches.db") or ":memory:")
+    # SQLite 读写与提交在单独的单线程执行器中进行，不阻塞事件循环；单线程保证各操作按提交顺序执行
+    batch_io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-db")
+    batch_tasks = {}  # batch_id -> asyncio.Task
+    batch_events = {}  # batch_id -> asyncio.Event：有条目完成时唤醒结果流
+    batch_concurrency = int(os.environ.get("DEEPSEEK_BATCH_CONCURRENCY", "0")) or admission.workers + 1
+    schema_stats = {"valid": 0, "repaired": 0, "invalid": 0}
+    # 每次浏览器执行的阶段追踪追加到 JSONL（按大小轮转）；DEEPSEEK_TRACE_LOG 置空时关闭
+    trace_path = os.environ.get("DEEPSEEK_TRACE_LOG", "traces.jsonl")
+    trace_log = TraceLog(
+        trace_path,
+        max_bytes=int(os.environ.get("DEEPSEEK_TRACE_LOG_MB", "16")) * 1024 * 1024,
+        backups=int(os.environ.get("DEEPSEEK_TRACE_LOG_BACKUPS", "5")),
+    ) if trace_path else None
+
+    # 批量上传的 JSONL 可能有数千行，放宽默认 1MB 的请求体上限
+    max_body = int(os.environ.get("DEEPSEEK_MAX_BODY_MB", "64")) * 1024 * 1024
+    app = web.Application(middlewares=[preflight], client_max_size=max_body)
+    app.on_response_prepare.append(cors_headers)
+    routes = web.RouteTableDef()
+    _register_gauges(request_queue, inflight, flight_stats, admission, response_cache, instruction_cache,
+                     schema_stats, sessions if session_reuse else None)
+
+    @routes.get("/")
+    async def index(request):
+        return _json_response({
             "service": "DeepSeek Local API (Ollama + OpenAI 格式)",
             "hint": "无 API Key。支持 system 提示词与 tools 描述，输出贴近 API 便于智能体驱动。",
             "endpoints": [
                 "GET /api/tags",
+                "GET /api/status",
+                "GET /api/cache",
+                "GET /metrics",
                 "POST /api/chat",
                 "POST /v1/chat/completions",
+                "DELETE /v1/requests/{id}",
+                "POST /v1/batches",
+                "GET /v1/batches",
+                "GET /v1/batches/{id}",
+                "GET /v1/batches/{id}/results",
+                "POST /v1/batches/{id}/cancel",
             ],
             "agent": "请求体可含 messages、tools/functions、enable_function_call、tool_choice，会告知 DeepSeek 开启 function call 并注入工具列表。",
         })
 
-    @app.route("/api/tags", methods=["GET", "OPTIONS"])
-    def list_models():
+    @routes.get("/api/status")
+    async def status(request):
+        """负载信息：供浏览器农场的前置路由按队列深度分配请求。"""
+        return _json_response({
+            "queue_depth": request_queue.qsize(),
+            "inflight": len(inflight),
+            "coalesced_total": flight_stats["coalesced"],
+            "cancelled_total": flight_stats["cancelled"],
+            "mean_service_seconds": round(admission.mean_service(), 3),
+            "rejected_total": admission.rejected,
+            "queue_by_client": request_queue.depth_by_client() if isinstance(request_queue, FairScheduler) else {},
+            "sessions": sessions.snapshot() if session_reuse else None,
+        })
+
+    @routes.delete("/v1/requests/{request_id}")
+    async def cancel_request(request):
+        """取消等待中的请求：排队中的直接移除，执行中的在网页点击停止并释放标签页。"""
+        request_id = request.match_info["request_id"]
+        ticket = tickets.get(request_id)
+        if ticket is None:
+            return _json_response({"error": {"message": f"No pending request {request_id}", "type": "not_found"}}, 404)
+        ticket.cancelled = True
+        if not ticket.cancel_future.done():
+            ticket.cancel_future.set_result(None)
+        _release(ticket)
+        return _json_response({
+            "id": request_id,
+            "object": "request.cancelled",
+            "cancelled": True,
+        })
+
+    @routes.get("/api/cache")
+    async def cache_stats(request):
+        """回复缓存命中 / 未命中等统计（含指令块缓存、json_schema 校验器缓存与校验结果）。"""
+        return _json_response({
+            **response_cache.snapshot(),
+            "instruction": instruction_cache.snapshot(),
+            "schema": {**schema_cache.snapshot(), **schema_stats},
+        })
+
+    @routes.get("/metrics")
+    async def prometheus_metrics(request):
+        """Prometheus 文本格式：浏览器侧各阶段耗时直方图、超时计数，以及队列与缓存等仪表。"""
+        return web.Response(body=metrics.REGISTRY.render().encode("utf-8"),
+                            headers={"Content-Type": metrics.CONTENT_TYPE})
+
+    @routes.get("/api/tags")
+    async def list_models(request):
         """Ollama: 列出模型。"""
-        if request.method == "OPTIONS":
-            return "", 204
         now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
-        return jsonify({
+        return _json_response({
             "models": [
                 {
                     "name": "deepseek-chat",
@@ -133,140 +402,17 @@ def create_app(request_queue: Queue, response_dict: dict) -> "Flask":
         "- 对于复杂项目使用多个<create_file>标签\n"
     )
 
-    def _normalize_content(raw: str, want_json_only: bool = False) -> str:
-        """优化的内容规范化处理 - 保留更多有用信息，确保与Claude等智能体兼容"""
-        if not raw or not isinstance(raw, str):
-            return raw or ""
-        
-        s = raw.strip()
-        
-        # 保留Cline/Aline的关键格式标签
-        if "<create_file>" in s or "<file_path>" in s or "<file_content>" in s:
-            # 这是文件创建格式，要特别小心处理
-            return s  # 直接返回，不做过多清理
-        
-        # 移除系统指令和UI标签
-        ui_tags = ["[系统指令]", "[用户输入]", "[约束]", "[问题]", "系统指令", "用户输入"]
-        for tag in ui_tags:
-            s = s.replace(tag, "").strip()
-        
-        # 移除Cline相关的配置信息（仅当不是代码块时）
-        if "You are Cline" in s and "GLOBAL RULES" in s and "```" not in s:
-            # 这是Cline的系统配置，应该移除
-            lines = s.split("\n")
-            filtered_lines = []
-            skip_cline_config = False
-            
-            for line in lines:
-                if "You are Cline" in line:
-                    skip_cline_config = True
-                    continue
-                elif skip_cline_config and (line.startswith("##") or "MODES" in line or "EXECUTION FLOW" in line):
-                    # 跳过Cline配置部分
-                    if "<task>" in line:
-                        skip_cline_config = False  # 任务开始，停止跳过
-                        filtered_lines.append(line)
-                    continue
-                elif "<task>" in line:
-                    skip_cline_config = False
-                    filtered_lines.append(line)
-                elif not skip_cline_config:
-                    filtered_lines.append(line)
-            
-            s = "\n".join(filtered_lines).strip()
-        
-        # 保留有价值的分析内容，移除纯占位符
-        if re.search(r"^(Aline\s*有一个问题|Your\s*question\s*here)[:\s]*$", s.strip(), re.IGNORECASE):
-            s = ""
-        
-        # 移除明显无意义的单行内容
-        meaningless_lines = ["复制", "联网搜索", "互联网搜索", "下载"]
-        lines = s.split("\n")
-        filtered_lines = []
-        for line in lines:
-            stripped = line.strip()
-            if stripped not in meaningless_lines:
-                filtered_lines.append(line)
-        s = "\n".join(filtered_lines).strip()
-        
-        # 优化代码块格式转换
-        # 将常见的代码格式转换为标准markdown格式
-        s = re.sub(
-            r"^([a-zA-Z0-9_\.\-]+\.(?:py|js|ts|java|cpp|go|rs))\s*[)：:]?\s*\n\s*(python|javascript|java|cpp|go|rust)\s*\n",
-            r"**\1**\n```\2\n",
-            s,
-            flags=re.MULTILINE | re.IGNORECASE,
-        )
-        
-        # 补全未闭合的代码块
-        code_blocks = re.findall(r"```\w*", s)
-        if len(code_blocks) % 2 == 1:
-            s = s.rstrip() + "\n```"
-        
-        # 适度清理开头的冗余表述，但保留有价值的信息
-        # 只移除非常明确的模板化开场白
-        redundant_openings = [
-            r"^好的[，,]?\s*",
-            r"^收到[，,]?\s*",
-            r"^明白[了]?[，,]?\s*",
-        ]
-        
-        for pattern in redundant_openings:
-            s = re.sub(pattern, "", s, flags=re.IGNORECASE).strip()
-        
-        # 保留有价值的分析性内容
-        # 不要过度清理"根据您的要求"这类有价值的上下文信息
-        
-        # 适度清理结尾，但保留建设性内容
-        constructive_endings = [
-            "希望可以帮到你。", "希望可以帮到你", 
-            "如有疑问欢迎继续提问。", "如有疑问欢迎继续问。"
-        ]
-        
-        lines = s.split("\n")
-        if lines and lines[-1].strip() in constructive_endings:
-            lines.pop()
-            s = "\n".join(lines).strip()
-        
-        # 标准化空白字符
-        s = re.sub(r"\n{3,}", "\n\n", s)
-        lines = [line.rstrip() for line in s.split("\n")]
-        s = "\n".join(lines).strip()
-        
-        # JSON提取逻辑保持不变
-        if want_json_only:
-            for pattern in (r"```(?:json)?\s*([\s\S]*?)\s*```", r"```\s*([\s\S]*?)\s*```"):
-                m = re.search(pattern, s)
-                if m:
-                    try:
-                        obj = json.loads(m.group(1).strip())
-                        return json.dumps(obj, ensure_ascii=False)
-                    except Exception:
-                        pass
-            start = s.find("{")
-            if start >= 0:
-                depth = 0
-                for i in range(start, len(s)):
-                    if s[i] == "{":
-                        depth += 1
-                    elif s[i] == "}":
-                        depth -= 1
-                        if depth == 0:
-                            try:
-                                obj = json.loads(s[start : i + 1])
-                                return json.dumps(obj, ensure_ascii=False)
-                            except Exception:
-                                pass
-                            break
-        
-        return s
+    def _prepare_chat(body):
+        """解析 messages（含 system），可选 tools，拼装发往网页的 payload；返回 (chat, err)。
 
-    def _run_chat(body):
-        """解析 messages（含 system），可选 tools，投递队列，等待回复；返回 (content, model)。"""
+        chat 含 payload、model、want_json 以及由模型、用户问题、指令块哈希与历史前缀指纹计算出的 cache_key。
+        开启会话复用时 chat["session"] 记录历史前缀的指纹与新一轮的文本，投递时若能续写已有的网页对话，
+        payload 只含新一轮的内容。
+        """
         model = body.get("model") or "deepseek-chat"
         messages = body.get("messages") or []
         if not messages:
-            return None, None, "messages is required"
+            return None, "messages is required"
         user_content = ""
         system_content = None
         for m in messages:
@@ -288,14 +434,62 @@ def create_app(request_queue: Queue, response_dict: dict) -> "Flask":
                             user_content = (part.get("text") or "").strip()
                             break
         if not user_content:
-            return None, None, "No user message in messages"
-        system_instruction = system_content if system_content else DEFAULT_SYSTEM
+            return None, "No user message in messages"
         tools = body.get("tools") or body.get("functions")
         tool_choice = body.get("tool_choice")
         enable_function_call = body.get("enable_function_call", False)
         # 仅当客户端明确要求 function call 时才注入工具说明，避免 Aline/Cline 等仅带 tools 列表的请求
         # 被误当成“需要模型输出 tool_calls”，导致智能体去执行占位符 MCP 而非直接展示代码
-        use_function_call = enable_function_call or (tool_choice and str(tool_choice).lower() not in ("none", "null", ""))
+        use_function_call = bool(enable_function_call or (tool_choice and str(tool_choice).lower() not in ("none", "null", "")))
+        rf = body.get("response_format")
+        try:
+            block_key, block, want_json, schema = _instruction_block(system_content, tools, tool_choice, use_function_call, rf)
+        except SchemaError as e:
+            return None, f"Invalid response_format.json_schema: {e}"
+        session = None
+        if session_reuse:
+            history, turn = split_turn(messages)
+            session = {
+                "block_key": block_key,
+                "prefix": fingerprint(block_key, history) if history else None,
+                "turns": history + turn,
+                "text": turn_text(turn),
+            }
+        key = cache_key({
+            "model": model,
+            "user": user_content,
+            "instruction": block_key,
+            "history": session["prefix"] if session else None,
+        })
+        return {
+            "payload": (block + user_content).strip(),
+            "model": model,
+            "want_json": want_json,
+            "function_call": use_function_call,
+            "schema": schema,
+            "session": session,
+            "cache_key": key,
+        }, None
+
+    def _instruction_block(system_content, tools, tool_choice, use_function_call, rf):
+        """拼装用户问题之前的整段指令（[约束] + 系统提示 + 工具列表 + JSON 要求）。
+
+        Cline 等智能体每一轮都带着相同的系统提示与工具列表，按 (system, tools, tool_choice, response_format)
+        的哈希记忆化，命中时不再拼接与序列化。返回 (block_key, block, want_json, schema)；
+        schema 不合法时抛出 SchemaError（不写入缓存）。
+        """
+        want_json = isinstance(rf, dict) and (rf.get("type") == "json_object" or rf.get("type") == "json_schema")
+        block_key = cache_key({
+            "system": system_content,
+            "function_call": use_function_call,
+            "tools": tools if use_function_call else None,
+            "tool_choice": tool_choice if use_function_call else None,
+            "response_format": rf if want_json else None,
+        })
+        cached = instruction_cache.get(block_key)
+        if cached is not None:
+            return cached
+        system_instruction = system_content if system_content else DEFAULT_SYSTEM
         if use_function_call:
             system_instruction = (
                 "【Function Call 已开启】你已启用工具调用能力。"
@@ -303,8 +497,8 @@ def create_app(request_queue: Queue, response_dict: dict) -> "Flask":
                 ' {"tool_calls":[{"id":"call_1","type":"function","function":{"name":"<工具名>","arguments":"<JSON 字符串>"}}]}。'
                 "不需要调用工具时直接回复正常文本。\n\n"
             ) + system_instruction
+        tools_desc = []
         if use_function_call and tools and isinstance(tools, list):
-            tools_desc = []
             for t in tools[:20]:
                 if isinstance(t, dict):
                     name = t.get("function", t).get("name", t.get("name", ""))
@@ -314,152 +508,758 @@ def create_app(request_queue: Queue, response_dict: dict) -> "Flask":
                         tools_desc.append({"name": name, "description": desc or "", "parameters": params})
             if tools_desc:
                 try:
-                    system_instruction += "\n\n可用工具列表（调用时 function.name 必须从下列 name 中选择）：\n" + json.dumps(tools_desc, ensure_ascii=False, indent=2)
+                    # 紧凑编码（无缩进）：工具列表常有数 KB，缩进只增加注入网页的字节数
+                    system_instruction += "\n\n可用工具列表（调用时 function.name 必须从下列 name 中选择）：\n" + json.dumps(
+                        tools_desc, ensure_ascii=False, separators=(",", ":"))
                     system_instruction += '\n\n调用时严格按此 JSON 格式回复，arguments 为 JSON 字符串：{"tool_calls":[{"id":"call_xxx","type":"function","function":{"name":"工具名","arguments":"{\\"key\\":\\"value\\"}"}}]}。'
                 except Exception:
                     pass
-        rf = body.get("response_format")
-        want_json = isinstance(rf, dict) and (rf.get("type") == "json_object" or rf.get("type") == "json_schema")
+        schema = None
         if want_json:
             system_instruction += "\n\n请仅输出合法 JSON，不要外加说明或 markdown 代码块包裹。"
-        # 每次对话都提醒：与官方 API 一致、只输出答案或代码，不输出工具调用
-        payload = (
+            spec = rf.get("json_schema") if rf.get("type") == "json_schema" else None
+            if isinstance(spec, dict) and isinstance(spec.get("schema"), (dict, bool)):
+                # 相同 schema 只编译一次；schema 本身不合法时直接 400，不占用浏览器
+                schema = schema_cache.get(spec["schema"])
+                system_instruction += "\nJSON 必须符合以下 JSON Schema：" + json.dumps(
+                    spec["schema"], ensure_ascii=False, separators=(",", ":"))
+        # 每次对话都提醒：与官方 API 一致、只输出答案或代码；未开启 function call 时不输出工具调用
+        if use_function_call:
+            forbidden = "禁止输出 ask_followup_question、Your question here 等；需要调用工具时只输出 tool_calls JSON，否则直接给出答案或代码。"
+        else:
+            forbidden = "禁止输出 ask_followup_question、tool_calls、Your question here 等；直接给出答案或代码。"
+        block = (
             "[约束]\n"
             "【本次对话】输出=DeepSeek API 的 choices[0].message.content：只输出纯文本或代码，无标签与开场白、一次输出完整。"
-            "禁止输出 ask_followup_question、tool_calls、Your question here 等；直接给出答案或代码。"
+            + forbidden +
             "若有代码：必须用 ```语言\\n代码\\n```，多文件用 **文件名** 或 文件名: 后接代码块。\n\n"
-            + system_instruction + "\n\n[问题]\n" + user_content
+            + system_instruction + "\n\n[问题]\n"
         )
+        entry = (block_key, block, want_json, schema)
+        instruction_cache.put(block_key, entry)
+        return entry
+
+    def _cache_mode(request, body):
+        """单次请求的缓存控制：use（默认）/ refresh（跳过读取、写回新结果）/ bypass（不读不写）。
+
+        可用请求体字段 cache（false / "bypass" / "refresh"）或请求头 Cache-Control（no-store / no-cache）指定。
+        """
+        opt = body.get("cache", True)
+        directives = (request.headers.get("Cache-Control") or "").lower()
+        if opt is False or opt == "bypass" or "no-store" in directives:
+            return "bypass"
+        if opt == "refresh" or "no-cache" in directives:
+            return "refresh"
+        return "use"
+
+    def _lookup(chat, cache_mode):
+        """按缓存模式查缓存；返回 (content 或 None, X-Cache 状态)。"""
+        if cache_mode != "use":
+            response_cache.note_bypass()
+            return None, cache_mode.upper()
+        content = response_cache.get(chat["cache_key"])
+        return content, ("HIT" if content is not None else "MISS")
+
+    def _schedule_opts(request, body):
+        """调度参数：租户与优先级（由 ClientPolicy 按 API Key 决定）、截止时间（客户端给出 timeout 时）。"""
+        client = request.headers.get("X-Client-Id") or request.headers.get("X-Forwarded-For") or request.remote or "default"
+        auth = request.headers.get("Authorization", "")
+        key = auth[7:].strip() if auth[:7].lower() == "bearer " else request.headers.get("X-Api-Key", "")
+        tenant, priority = client_policy.resolve(
+            key, client.split(",")[0].strip(), body.get("priority", request.headers.get("X-Priority", 0)))
+        timeout = body.get("timeout", request.headers.get("X-Request-Timeout"))
+        try:
+            deadline = time.time() + float(timeout) if timeout is not None else None
+        except (TypeError, ValueError):
+            deadline = None
+        return {"client": tenant, "priority": priority, "deadline": deadline}
+
+    def _dispatch(chat):
+        """投递到 Qt 主线程队列（FairScheduler 时按客户端 / 优先级 / 截止时间排队）；返回 (request_id, event, channel)。"""
+        loop = asyncio.get_running_loop()
         request_id = str(uuid.uuid4())
-        event = threading.Event()
-        request_queue.put((request_id, payload.strip(), event))
-        ok = event.wait(timeout=180)  # 增加超时时间从120秒到180秒
-        content = response_dict.pop(request_id, "")
+        event = LoopEvent(loop)
+        inflight.add(request_id)
+        channel = StreamChannel(loop)
+        if chat["schema"] is not None:
+            channel.repair = make_repair(chat["schema"])
+        payload = chat["payload"]
+        session = chat["session"]
+        if session is not None:
+            # 历史与某个网页对话一致时续写该对话，只输入新一轮；首轮或未命中时一律新开对话发送完整指令，
+            # 不能沿用页面当前显示的对话（可能是另一会话的）。页面已是空白新对话时 Qt 侧不会重新加载
+            url = sessions.claim(session["prefix"]) if session["text"] else None
+            channel.conversation = url or NEW_CONVERSATION
+            if url:
+                payload = session["text"]
+        item = (request_id, payload, event, channel)
+        if isinstance(request_queue, FairScheduler):
+            request_queue.put(item, **chat["sched"])
+        else:
+            request_queue.put(item)
+        return request_id, event, channel
+
+    def _collect(request_id):
+        """取走 Qt 侧写回的结果，并从在途请求中移除。"""
+        inflight.discard(request_id)
+        return response_dict.pop(request_id, "")
+
+    def _finish_content(raw, ok, want_json):
+        """规范化最终回复；超时或清理后为空时给出提示文本。"""
+        content = raw
         if not ok:
-            content = content or "Request timeout (no reply within 120s)."
-        content = _normalize_content(content, want_json_only=want_json)
+            content = content or f"Request timeout (no reply within {REPLY_TIMEOUT:.0f}s)."
+        content = normalize_content(content, want_json_only=want_json)
         # 若清理后为空（例如被当作 ask_followup_question 占位符去掉），返回提示避免客户端出现空白或误触发工具
         if not (content or "").strip():
             content = "请直接描述你需要的代码或问题，我将直接给出代码或答案，无需额外确认。"
-        return content, model, None
+        return content
 
-    @app.route("/api/chat", methods=["POST", "OPTIONS"])
-    def chat():
-        """Ollama: 对话接口，无 API Key。"""
-        if request.method == "OPTIONS":
-            return "", 204
+    def _schema_status(chat, content, repaired=False):
+        """json_schema 请求的校验结果：valid / repaired（经会话内追问修复）/ invalid。"""
+        if chat["schema"].validate_reply(content):
+            return "invalid"
+        return "repaired" if repaired else "valid"
+
+    def _join_flight(chat, cache_mode):
+        """取得本请求对应的浏览器执行：已有相同 cache_key 的在途执行时直接加入，否则新建并投递。
+
+        返回 (flight, joined)。cache_mode 为 bypass 的请求总是独立执行，也不供他人加入。
+        """
+        key = chat["cache_key"]
+        flight = flights.get(key) if cache_mode != "bypass" else None
+        if flight is not None:
+            flight.waiters += 1
+            flight_stats["coalesced"] += 1
+            return flight, True
+        _admit(chat)
+        request_id, event, channel = _dispatch(chat)
+        flight = Flight(request_id, event, channel)
+        if cache_mode != "bypass":
+            flights[key] = flight
+        asyncio.ensure_future(_complete_flight(flight, chat, cache_mode))
+        return flight, False
+
+    def _admit(chat):
+        """准入控制：预计完成时间超出请求预算时抛出 429 / 503（带 Retry-After），否则记录排队位置与 ETA。"""
+        sched = chat["sched"]
+        queued = request_queue.qsize()
+        running = max(0, len(inflight) - queued)
+        client_queued = 0
+        if isinstance(request_queue, FairScheduler):
+            client_queued = request_queue.depth_by_client().get(sched["client"], 0)
+        budget = sched["deadline"] - time.time() if sched["deadline"] is not None else REPLY_TIMEOUT
+        status, retry_after, position, eta = admission.decide(queued, running, client_queued, budget)
+        if status is not None:
+            error_type = "rate_limit_exceeded" if status == 429 else "server_overloaded"
+            message = f"预计等待 {eta:.0f}s 超出请求预算 {budget:.1f}s，请 {retry_after}s 后重试"
+            exc = web.HTTPTooManyRequests if status == 429 else web.HTTPServiceUnavailable
+            raise exc(
+                text=json.dumps({"error": {"message": message, "type": error_type}}, ensure_ascii=False),
+                content_type="application/json",
+                headers={"Retry-After": str(retry_after), "X-Queue-ETA": f"{eta:.1f}"},
+            )
+        chat["queue_headers"] = {"X-Queue-Position": str(position), "X-Queue-ETA": f"{eta:.1f}"}
+
+    def _open_ticket(chat, flight):
+        ticket = Ticket(chat["request_id"], flight)
+        tickets[ticket.request_id] = ticket
+        return ticket
+
+    def _close_ticket(ticket):
+        if ticket is not None and tickets.get(ticket.request_id) is ticket:
+            del tickets[ticket.request_id]
+
+    def _release(ticket):
+        """等待方离开（断开连接 / 显式取消）；最后一个等待方离开时取消浏览器执行。"""
+        if ticket is None or ticket.released:
+            return
+        ticket.released = True
+        flight = ticket.flight
+        flight.waiters -= 1
+        if flight.waiters > 0 or flight.result.done():
+            return
+        flight.cancelled = True
+        for key, f in list(flights.items()):
+            if f is flight:
+                del flights[key]
+        flight_stats["cancelled"] += 1
+        if hasattr(request_queue, "remove") and request_queue.remove(flight.request_id):
+            flight.event.set()  # 尚未开始执行：直接从队列移除并结束
+        else:
+            flight.channel.cancelled = True  # 执行中：由 Qt 侧停止生成并释放标签页
+
+    def _remember_session(chat, final, url):
+        """记录 指纹(历史 + 新一轮 + 本次回复) → 对话 URL；回复按客户端回传时的形式（含 tool_calls）规范化。"""
+        reply = {"role": "assistant", "content": final}
+        if chat["function_call"]:
+            text, calls = extract_tool_calls(final)
+            reply = {"role": "assistant", "content": text, "tool_calls": calls}
+        session = chat["session"]
+        sessions.remember(fingerprint(session["block_key"], session["turns"] + [canonical_message(reply)]), url)
+
+    async def _complete_flight(flight, chat, cache_mode):
+        """等待 Qt 侧写回，规范化并写缓存，再把结果交给所有等待方。"""
+        ok = False
+        raw = ""
+        try:
+            ok = await flight.event.wait(timeout=REPLY_TIMEOUT)
+        finally:
+            flight.channel.trace.mark("collected")
+            raw = _collect(flight.request_id)
+            flight.raw = raw if isinstance(raw, str) else ""
+            if flights.get(chat["cache_key"]) is flight:
+                del flights[chat["cache_key"]]
+            final = _finish_content(raw, ok, chat["want_json"])
+            if not ok and not flight.cancelled:
+                metrics.TIMEOUTS.inc("api_wait")
+            outcome = "cancelled" if flight.cancelled else ("completed" if ok else "timeout")
+            ok = ok and not flight.cancelled
+            if ok and flight.channel.started_at is not None:
+                admission.record(time.monotonic() - flight.channel.started_at)
+            if ok and chat["session"] is not None and flight.channel.conversation_url:
+                _remember_session(chat, final, flight.channel.conversation_url)
+            if ok and chat["schema"] is not None:
+                status = flight.schema_status = _schema_status(chat, final, flight.channel.repaired)
+                schema_stats[status] += 1
+                ok = status != "invalid"  # 修复后仍不符合 schema 的回复不写缓存
+            if ok and cache_mode != "bypass":
+                response_cache.put(chat["cache_key"], final)
+            flight.result.set_result(final)
+            if trace_log is not None:
+                _write_trace(flight, chat, outcome, final)
+
+    def _write_trace(flight, chat, outcome, final):
+        """追加一条完整追踪（写文件出错时由 logging 的 handleError 报告，不影响请求）。"""
+        channel = flight.channel
+        conversation = channel.conversation
+        trace_log.write(channel.trace.record(
+            request_id=flight.request_id,
+            client=chat["sched"]["client"],
+            outcome=outcome,
+            waiters=flight.waiters,
+            conversation="new" if conversation == NEW_CONVERSATION else ("reused" if conversation else None),
+            repaired=channel.repaired,
+            completion=channel.completion,
+            payload_chars=len(chat["payload"]),
+            reply_chars=len(final),
+        ))
+
+    async def _run_chat(chat, cache_mode):
+        """查缓存，未命中则加入 / 发起浏览器执行并等待完整回复；返回 (content, X-Cache 状态)。"""
+        cached, cache_status = _lookup(chat, cache_mode)
+        if cached is not None:
+            return cached, cache_status
+        flight, joined = _join_flight(chat, cache_mode)
+        ticket = _open_ticket(chat, flight)
         try:
-            body = request.get_json(force=True, silent=True) or {}
-        except Exception:
-            return jsonify({"error": "Invalid JSON"}), 400
-        content, model, err = _run_chat(body)
+            await asyncio.wait([flight.result, ticket.cancel_future], return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            _release(ticket)  # 客户端断开连接
+            raise
+        finally:
+            _close_ticket(ticket)
+        if ticket.cancelled:
+            raise RequestCancelled()
+        chat["trace"] = flight.channel.trace
+        chat["schema_status"] = flight.schema_status
+        return flight.result.result(), ("COALESCED" if joined else cache_status)
+
+    async def _iter_stream(chat, flight=None, cached=None, ticket=None):
+        """逐步产出 (delta, final)：生成过程中 final 为 None，结束时产出最后一段增量与完整规范化结果。
+
+        cached 非空（缓存命中）时不访问网页，直接一次性产出完整内容；中途加入在途执行的订阅者
+        第一次等待即拿到当前快照，先补发已生成的部分。快照只把新增的后缀喂给增量规范化器，
+        整个回复的规范化开销与长度成线性；快照被网页改写（不再是上一快照的延续）时停止增量输出，
+        结束时按完整规范化结果补发。
+        """
+        if cached is not None:
+            yield cached, cached
+            return
+        normalizer = StreamingNormalizer()
+        fed = ""
+        diverged = chat["want_json"]  # JSON 模式需要完整回复才能提取，不做增量输出
+        version = 0
+        closed = False
+        while not closed and not flight.result.done():
+            version, text, closed = await flight.channel.wait(version, timeout=1.0)
+            if ticket is not None and ticket.cancelled:
+                raise RequestCancelled()
+            if diverged or not text or text == fed:
+                continue
+            if not text.startswith(fed):
+                diverged = True
+                continue
+            delta = normalizer.feed(text[len(fed):])
+            fed = text
+            if delta:
+                yield delta, None
+        final = await asyncio.shield(flight.result)
+        if ticket is not None and ticket.cancelled:
+            raise RequestCancelled()
+        if not diverged and flight.raw.startswith(fed):
+            tail = normalizer.feed(flight.raw[len(fed):]) + normalizer.finish()
+            streamed = normalizer.text
+            if final != streamed and final.startswith(streamed):
+                tail += final[len(streamed):]  # 超时 / 清理后为空时的提示文本
+            yield tail, final
+            return
+        sent = normalizer.text
+        yield (final[len(sent):] if final.startswith(sent) else ""), final
+
+    async def _open_stream_for(request, content_type, chat, cache_mode):
+        """查缓存 / 加入在途执行后开始流式响应；返回 (resp, flight, cached, ticket)。"""
+        cached, cache_status = _lookup(chat, cache_mode)
+        flight = None
+        ticket = None
+        if cached is None:
+            flight, joined = _join_flight(chat, cache_mode)
+            ticket = _open_ticket(chat, flight)
+            if joined:
+                cache_status = "COALESCED"
+        try:
+            resp = await _open_stream(request, content_type, cache_status, chat.get("queue_headers"))
+        except (asyncio.CancelledError, ConnectionResetError):
+            _release(ticket)
+            _close_ticket(ticket)
+            raise
+        return resp, flight, cached, ticket
+
+    async def _open_stream(request, content_type, cache_status, extra_headers=None):
+        """开始一个分块的流式响应（SSE / NDJSON）。"""
+        resp = web.StreamResponse(headers={
+            "Content-Type": content_type,
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Cache": cache_status,
+            "X-Request-Id": request["request_id"],
+            **(extra_headers or {}),
+        })
+        await resp.prepare(request)
+        return resp
+
+    @routes.post("/api/chat")
+    async def chat(request):
+        """Ollama: 对话接口，无 API Key。"""
+        body = await _read_json(request)
+        if body is None:
+            return _json_response({"error": "Invalid JSON"}, 400)
+        # 与 Ollama 一致：未指定 stream 时默认流式（NDJSON，每行一个 JSON 对象）
+        chat, err = _prepare_chat(body)
         if err:
-            return jsonify({"error": err}), 400
+            return _json_response({"error": err}, 400)
+        model = chat["model"]
+        chat["sched"] = _schedule_opts(request, body)
+        chat["request_id"] = request["request_id"]
+        cache_mode = _cache_mode(request, body)
+        if body.get("stream", True):
+            started = time.monotonic_ns()
+
+            def _line(obj):
+                now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+                return (json.dumps({"model": model, "created_at": now, **obj}, ensure_ascii=False) + "\n").encode("utf-8")
+
+            resp, flight, cached, ticket = await _open_stream_for(request, "application/x-ndjson", chat, cache_mode)
+            first_ns = None
+            gate = ToolCallStream() if chat["function_call"] else None
+            try:
+                async for delta, final in _iter_stream(chat, flight, cached, ticket):
+                    calls = []
+                    if gate is not None:
+                        delta, calls = gate.feed(delta)
+                        if final is not None:
+                            rest, _ = gate.finish()
+                            delta += rest
+                    if delta or calls:
+                        if first_ns is None:
+                            first_ns = time.monotonic_ns()
+                        message = {"role": "assistant", "content": delta}
+                        if calls:
+                            message["tool_calls"] = ollama_tool_calls(calls)
+                        await resp.write(_line({"message": message, "done": False}))
+                    if final is not None:
+                        done_ns = time.monotonic_ns()
+                        first_ns = first_ns or done_ns
+                        await resp.write(_line({
+                            "message": {"role": "assistant", "content": ""},
+                            "done": True,
+                            "done_reason": "stop",
+                            "total_duration": done_ns - started,
+                            "load_duration": 0,
+                            "prompt_eval_count": _prompt_tokens(body.get("messages")),
+                            "prompt_eval_duration": first_ns - started,
+                            "eval_count": _approx_tokens(final),
+                            "eval_duration": done_ns - first_ns,
+                        }))
+            except RequestCancelled:
+                await resp.write(_line({"error": "request cancelled", "done": True, "done_reason": "cancelled"}))
+            except (asyncio.CancelledError, ConnectionResetError):
+                _release(ticket)  # 客户端断开连接
+                raise
+            finally:
+                _close_ticket(ticket)
+            await resp.write_eof()
+            return resp
+        started = time.monotonic_ns()
+        try:
+            content, cache_status = await _run_chat(chat, cache_mode)
+        except RequestCancelled:
+            return _json_response({"error": "request cancelled"}, 499)
+        # 用量与 OpenAI usage 同口径估算；耗时取浏览器执行的实测打点（缓存命中时没有生成，只有总耗时）
+        total_ns = time.monotonic_ns() - started
+        trace = chat.get("trace")
+        if trace is not None:
+            total_ns = trace.elapsed_ns("enqueue", "collected") or total_ns
         now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
-        return jsonify({
+        message = {"role": "assistant", "content": content}
+        if chat["function_call"]:
+            text, calls = extract_tool_calls(content)
+            if calls:
+                message = {"role": "assistant", "content": text or "", "tool_calls": ollama_tool_calls(calls)}
+        resp = _json_response({
             "model": model,
             "created_at": now,
-            "message": {"role": "assistant", "content": content},
+            "message": message,
             "done": True,
             "done_reason": "stop",
-            "eval_count": max(0, len(content)),
-            "eval_duration": 0,
+            "total_duration": total_ns,
+            "load_duration": 0,
+            "prompt_eval_count": _prompt_tokens(body.get("messages")),
+            "prompt_eval_duration": (trace.elapsed_ns("sent", "first_content") if trace else None) or 0,
+            "eval_count": _approx_tokens(content),
+            "eval_duration": (trace.elapsed_ns("first_content", "last_change") if trace else None) or 0,
         })
+        resp.headers["X-Cache"] = cache_status
+        resp.headers.update(chat.get("queue_headers") or {})
+        if chat.get("trace") is not None:
+            resp.headers["Server-Timing"] = chat["trace"].server_timing()
+        if chat["schema"] is not None:
+            # 浏览器执行的结果沿用完成时的判定（含 repaired）；缓存命中时重新校验
+            resp.headers["X-Schema-Validation"] = chat.get("schema_status") or _schema_status(chat, content)
+        return resp
 
-    @app.route("/v1/chat/completions", methods=["POST", "OPTIONS"])
-    def chat_completions_deepseek():
-        """DeepSeek/OpenAI 风格：与官方 API 输出格式一致；支持 stream=true 时以单次 SSE 返回，便于 Aline/Cline 对接。"""
-        if request.method == "OPTIONS":
-            return "", 204
-        try:
-            body = request.get_json(force=True, silent=True) or {}
-        except Exception:
-            return jsonify({"error": {"message": "Invalid JSON", "type": "invalid_request_error"}}), 400
-        content, model, err = _run_chat(body)
-        if err:
-            return jsonify({"error": {"message": err, "type": "invalid_request_error"}}), 400
-        cid = "chatcmpl-" + str(uuid.uuid4()).replace("-", "")[:24]
-        created_ts = int(datetime.now(timezone.utc).timestamp())
-
-        def _approx_tokens(text):
-            if not text:
-                return 0
-            return max(1, (len(text) * 2) // 3)
-
-        prompt_tokens = 0
-        for m in body.get("messages") or []:
-            c = m.get("content")
-            if isinstance(c, str):
-                prompt_tokens += _approx_tokens(c)
-            elif isinstance(c, list):
-                for p in c:
-                    if isinstance(p, dict) and p.get("type") == "text":
-                        prompt_tokens += _approx_tokens(p.get("text") or "")
-                        break
+    def _completion_body(chat, content, cid, created_ts, prompt_tokens):
+        """非流式 chat.completion 响应体（function call 模式下把 tool_calls JSON 转为 message.tool_calls）。"""
         completion_tokens = _approx_tokens(content)
-        total_tokens = prompt_tokens + completion_tokens
-
-        if body.get("stream"):
-            # Aline/Cline 可能要求 stream：以单次 SSE 返回完整内容，避免客户端一直等待或超时
-            def gen():
-                chunk = {
-                    "id": cid,
-                    "object": "chat.completion.chunk",
-                    "created": created_ts,
-                    "model": model,
-                    "choices": [
-                        {"index": 0, "delta": {"role": "assistant", "content": content}, "finish_reason": "stop"}
-                    ],
-                    "usage": {
-                        "prompt_tokens": prompt_tokens,
-                        "completion_tokens": completion_tokens,
-                        "total_tokens": total_tokens,
-                    },
-                }
-                yield "data: " + json.dumps(chunk, ensure_ascii=False) + "\n\n"
-                yield "data: [DONE]\n\n"
-
-            return Response(
-                gen(),
-                mimetype="text/event-stream",
-                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
-            )
-
-        return jsonify({
+        message = {"role": "assistant", "content": content}
+        finish_reason = "stop"
+        if chat["function_call"]:
+            text, calls = extract_tool_calls(content)
+            if calls:
+                message = {"role": "assistant", "content": text, "tool_calls": calls}
+                finish_reason = "tool_calls"
+        return {
             "id": cid,
             "object": "chat.completion",
             "created": created_ts,
-            "model": model,
+            "model": chat["model"],
             "choices": [
                 {
                     "index": 0,
-                    "message": {"role": "assistant", "content": content},
-                    "finish_reason": "stop",
+                    "message": message,
+                    "finish_reason": finish_reason,
                 }
             ],
             "usage": {
                 "prompt_tokens": prompt_tokens,
                 "completion_tokens": completion_tokens,
-                "total_tokens": total_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
                 "prompt_cache_hit_tokens": 0,
                 "prompt_cache_miss_tokens": prompt_tokens,
             },
             "system_fingerprint": "local-qt-web-v1",
-        })
+        }
+
+    @routes.post("/v1/chat/completions")
+    async def chat_completions_deepseek(request):
+        """DeepSeek/OpenAI 风格：与官方 API 输出格式一致；stream=true 时按网页生成进度逐段以 SSE 返回 delta，便于 Aline/Cline 对接。"""
+        body = await _read_json(request)
+        if body is None:
+            return _json_response({"error": {"message": "Invalid JSON", "type": "invalid_request_error"}}, 400)
+        chat, err = _prepare_chat(body)
+        if err:
+            return _json_response({"error": {"message": err, "type": "invalid_request_error"}}, 400)
+        model = chat["model"]
+        chat["sched"] = _schedule_opts(request, body)
+        chat["request_id"] = request["request_id"]
+        cache_mode = _cache_mode(request, body)
+        cid = "chatcmpl-" + str(uuid.uuid4()).replace("-", "")[:24]
+        created_ts = int(datetime.now(timezone.utc).timestamp())
+        prompt_tokens = _prompt_tokens(body.get("messages"))
 
+        if body.get("stream"):
+
+            def _chunk(delta, finish_reason=None, usage=None):
+                chunk = {
+                    "id": cid,
+                    "object": "chat.completion.chunk",
+                    "created": created_ts,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+                if usage is not None:
+                    chunk["usage"] = usage
+                return ("data: " + json.dumps(chunk, ensure_ascii=False) + "\n\n").encode("utf-8")
+
+            # 投递后立即发送 role 块，随后把网页中已稳定的新增内容逐段作为 delta.content 推送
+            # function call 模式下经 ToolCallStream 过滤：{"tool_calls": ...} 转为 delta.tool_calls 片段
+            resp, flight, cached, ticket = await _open_stream_for(request, "text/event-stream", chat, cache_mode)
+            gate = ToolCallStream() if chat["function_call"] else None
+            call_index = 0
+            try:
+                await resp.write(_chunk({"role": "assistant", "content": ""}))
+                async for delta, final in _iter_stream(chat, flight, cached, ticket):
+                    calls = []
+                    if gate is not None:
+                        delta, calls = gate.feed(delta)
+                        if final is not None:
+                            rest, _ = gate.finish()
+                            delta += rest
+                    if delta:
+                        await resp.write(_chunk({"content": delta}))
+                    for call in calls:
+                        for fragment in iter_argument_fragments(call):
+                            await resp.write(_chunk({"tool_calls": [{"index": call_index, **fragment}]}))
+                        call_index += 1
+                    if final is not None:
+                        completion_tokens = _approx_tokens(final)
+                        await resp.write(_chunk({}, "tool_calls" if call_index else "stop", {
+                            "prompt_tokens": prompt_tokens,
+                            "completion_tokens": completion_tokens,
+                            "total_tokens": prompt_tokens + completion_tokens,
+                        }))
+            except RequestCancelled:
+                error = {"error": {"message": "Request cancelled", "type": "request_cancelled"}}
+                await resp.write(("data: " + json.dumps(error) + "\n\n").encode("utf-8"))
+            except (asyncio.CancelledError, ConnectionResetError):
+                _release(ticket)  # 客户端断开连接
+                raise
+            finally:
+                _close_ticket(ticket)
+            await resp.write(b"data: [DONE]\n\n")
+            await resp.write_eof()
+            return resp
+
+        try:
+            content, cache_status = await _run_chat(chat, cache_mode)
+        except RequestCancelled:
+            return _json_response({"error": {"message": "Request cancelled", "type": "request_cancelled"}}, 499)
+        resp = _json_response(_completion_body(chat, content, cid, created_ts, prompt_tokens))
+        resp.headers["X-Cache"] = cache_status
+        resp.headers.update(chat.get("queue_headers") or {})
+        if chat.get("trace") is not None:
+            resp.headers["Server-Timing"] = chat["trace"].server_timing()
+        if chat["schema"] is not None:
+            # 浏览器执行的结果沿用完成时的判定（含 repaired）；缓存命中时重新校验
+            resp.headers["X-Schema-Validation"] = chat.get("schema_status") or _schema_status(chat, content)
+        return resp
+
+    def _notify_batch(batch_id):
+        event = batch_events.pop(batch_id, None)
+        if event is not None:
+            event.set()
+
+    async def _batch_db(fn, *args):
+        """在 batch_io 线程中调用 batch_store 的方法。"""
+        return await asyncio.get_running_loop().run_in_executor(batch_io, fn, *args)
+
+    def _start_batch(batch_id):
+        task = asyncio.ensure_future(_run_batch(batch_id))
+        batch_tasks[batch_id] = task
+        task.add_done_callback(lambda _: batch_tasks.pop(batch_id, None))
+
+    async def _run_batch(batch_id):
+        """按上传顺序执行条目：batch_concurrency 个执行者并行，各自经 FairScheduler 排队到空闲的标签页。
+
+        以 "batch:<id>" 客户端、低优先级入队，交互式请求总能插到批量条目之前。
+        """
+        pending = iter(await _batch_db(batch_store.queued, batch_id))
+
+        async def runner():
+            for idx, custom_id, url, body in pending:
+                await _batch_db(batch_store.mark_running, batch_id, idx)
+                result, error = await _run_batch_item(batch_id, idx, url, body)
+                await _batch_db(batch_store.finish_item, batch_id, idx, result, error)
+                _notify_batch(batch_id)
+
+        await asyncio.gather(*(runner() for _ in range(batch_concurrency)))
+        await _batch_db(batch_store.complete, batch_id)
+        _notify_batch(batch_id)
+
+    async def _run_batch_item(batch_id, idx, url, body):
+        """执行单个条目，返回 (result, error)；准入控制拒绝时按 Retry-After 等待后重试。"""
+        if url != "/v1/chat/completions":
+            return None, {"code": "invalid_url", "message": f"Unsupported url {url}; only /v1/chat/completions"}
+        chat, err = _prepare_chat(body)
+        if err:
+            return None, {"code": "invalid_request", "message": err}
+        chat["sched"] = {"client": "batch:" + batch_id, "priority": -1, "deadline": None}
+        chat["request_id"] = f"{batch_id}-{idx}"
+        opt = body.get("cache", True)
+        cache_mode = "bypass" if opt is False or opt == "bypass" else ("refresh" if opt == "refresh" else "use")
+        created_ts = int(datetime.now(timezone.utc).timestamp())
+        while True:
+            try:
+                content, _ = await _run_chat(chat, cache_mode)
+                break
+            except (web.HTTPTooManyRequests, web.HTTPServiceUnavailable) as e:
+                await asyncio.sleep(float(e.headers.get("Retry-After", "5")))
+            except RequestCancelled:
+                return None, {"code": "cancelled", "message": "Request cancelled"}
+        cid = "chatcmpl-" + str(uuid.uuid4()).replace("-", "")[:24]
+        completion = _completion_body(chat, content, cid, created_ts, _prompt_tokens(body.get("messages")))
+        return {"status_code": 200, "request_id": chat["request_id"], "body": completion}, None
+
+    async def _resume_batches(app):
+        """服务启动时继续执行上次未完成的 batch。"""
+        for batch_id in await _batch_db(batch_store.unfinished):
+            _start_batch(batch_id)
+
+    async def _close_batch_io(app):
+        batch_io.shutdown(wait=True)  # 等待已提交的写入落盘
+
+    app.on_startup.append(_resume_batches)
+    app.on_cleanup.append(_close_batch_io)
+
+    async def _stream_batch_results(request, batch_id, after=0, wait=True):
+        """以 JSONL 流式返回条目结果（按完成顺序）；after 为已收到的行数，断线后可据此续传。"""
+        resp = web.StreamResponse(headers={"Content-Type": "application/jsonl; charset=utf-8", "X-Batch-Id": batch_id})
+        await resp.prepare(request)
+        seq = after
+        while True:
+            rows = await _batch_db(batch_store.results_after, batch_id, seq)
+            for seq, line in rows:
+                await resp.write((json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8"))
+            if rows:
+                continue
+            if not wait or (await _batch_db(batch_store.get, batch_id))["status"] != "in_progress":
+                break  # batch 已结束（或只取当前已完成的部分）
+            event = batch_events.setdefault(batch_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), timeout=5.0)
+            except asyncio.TimeoutError:
+                pass
+        await resp.write_eof()
+        return resp
+
+    @routes.post("/v1/batches")
+    async def create_batch(request):
+        """上传 JSONL 创建批量任务；?stream=true 时在同一连接上直接流式返回结果。"""
+        try:
+            items = parse_jsonl(await request.read())
+        except BatchFormatError as e:
+            return _json_response({"error": {"message": str(e), "type": "invalid_request_error"}}, 400)
+        except UnicodeDecodeError:
+            return _json_response({"error": {"message": "Batch input must be UTF-8 JSONL", "type": "invalid_request_error"}}, 400)
+        metadata = {k: v for k, v in request.query.items() if k not in ("stream",)}
+        batch = await _batch_db(batch_store.create, items, metadata)
+        _start_batch(batch["id"])
+        if request.query.get("stream", "").lower() in ("1", "true", "yes"):
+            return await _stream_batch_results(request, batch["id"])
+        return _json_response(batch)
+
+    @routes.get("/v1/batches")
+    async def list_batches(request):
+        try:
+            limit = max(1, min(100, int(request.query.get("limit", "20"))))
+        except ValueError:
+            limit = 20
+        return _json_response({"object": "list", "data": await _batch_db(batch_store.list, limit)})
+
+    @routes.get("/v1/batches/{batch_id}")
+    async def get_batch(request):
+        batch = await _batch_db(batch_store.get, request.match_info["batch_id"])
+        if batch is None:
+            return _json_response({"error": {"message": "No such batch", "type": "not_found"}}, 404)
+        return _json_response(batch)
+
+    @routes.get("/v1/batches/{batch_id}/results")
+    async def batch_results(request):
+        """JSONL 结果流：默认等到 batch 结束；?wait=false 只返回已完成的部分；?after=N 跳过已收到的 N 行。"""
+        batch_id = request.match_info["batch_id"]
+        if await _batch_db(batch_store.get, batch_id) is None:
+            return _json_response({"error": {"message": "No such batch", "type": "not_found"}}, 404)
+        try:
+            after = max(0, int(request.query.get("after", "0")))
+        except ValueError:
+            after = 0
+        wait = request.query.get("wait", "true").lower() not in ("0", "false", "no")
+        return await _stream_batch_results(request, batch_id, after, wait)
+
+    @routes.post("/v1/batches/{batch_id}/cancel")
+    async def cancel_batch(request):
+        """取消 batch：停止派发新条目，执行中的条目停止网页生成，未完成的记为 cancelled。"""
+        batch_id = request.match_info["batch_id"]
+        if await _batch_db(batch_store.get, batch_id) is None:
+            return _json_response({"error": {"message": "No such batch", "type": "not_found"}}, 404)
+        task = batch_tasks.pop(batch_id, None)
+        if task is not None:
+            task.cancel()
+        await _batch_db(batch_store.cancel, batch_id)
+        _notify_batch(batch_id)
+        return _json_response(await _batch_db(batch_store.get, batch_id))
+
+    app.add_routes(routes)
     return app
 
 
+def _register_gauges(request_queue, inflight, flight_stats, admission, response_cache, instruction_cache,
+                     schema_stats, sessions):
+    """把服务侧已有的统计登记为 /metrics 的回调仪表（抓取时读取，不在请求路径上额外计数）。"""
+    metrics.gauge("deepseek_queue_depth", "Requests waiting for a browser tab", request_queue.qsize)
+    metrics.gauge("deepseek_inflight_requests", "Dispatched requests not yet collected (queued + running)",
+                  lambda: len(inflight))
+    metrics.gauge("deepseek_coalesced_total", "Requests joined onto an identical in-flight execution",
+                  lambda: flight_stats["coalesced"], kind="counter")
+    metrics.gauge("deepseek_cancelled_total", "Requests cancelled by clients", lambda: flight_stats["cancelled"],
+                  kind="counter")
+    metrics.gauge("deepseek_admission_rejected_total", "Requests rejected by admission control",
+                  lambda: admission.rejected, kind="counter")
+    metrics.gauge("deepseek_mean_service_seconds", "Moving average of browser service time", admission.mean_service)
+    metrics.gauge("deepseek_cache_events_total", "Response cache lookups and stores by kind",
+                  lambda: {(k,): v for k, v in response_cache.snapshot().items()
+                           if k in ("hits", "disk_hits", "misses", "stores", "bypasses", "evictions")},
+                  labels=("kind",), kind="counter")
+    metrics.gauge("deepseek_cache_hit_ratio", "Response cache hit ratio (memory + disk)",
+                  lambda: response_cache.snapshot()["hit_rate"])
+    metrics.gauge("deepseek_cache_entries", "Response cache entries in memory",
+                  lambda: response_cache.snapshot()["entries"])
+    metrics.gauge("deepseek_instruction_cache_events_total", "Instruction block memo cache events by kind",
+                  lambda: {(k,): v for k, v in instruction_cache.snapshot().items()
+                           if k in ("hits", "misses", "evictions")},
+                  labels=("kind",), kind="counter")
+    metrics.gauge("deepseek_schema_validation_total", "json_schema replies by validation result",
+                  lambda: {(k,): v for k, v in schema_stats.items()}, labels=("result",), kind="counter")
+    if sessions is not None:
+        metrics.gauge("deepseek_session_events_total", "Conversation reuse events by kind",
+                      lambda: {(k,): v for k, v in sessions.snapshot().items()
+                               if k in ("reused", "new", "remembered", "evictions")},
+                      labels=("kind",), kind="counter")
+
+
+def _run_server(port: int, app: "web.Application"):
+    """在子线程中运行 asyncio 事件循环并提供 aiohttp 服务。"""
+    async def serve():
+        # handler_cancellation：客户端断开时取消处理协程，以便释放排队 / 执行中的浏览器请求
+        runner = web.AppRunner(app, handle_signals=False, access_log=None, handler_cancellation=True)
+        await runner.setup()
+        site = web.TCPSite(runner, host="127.0.0.1", port=port, backlog=1024)
+        await site.start()
+        await asyncio.Event().wait()  # 常驻，随守护线程退出
+
+    asyncio.run(serve())
+
+
 def start_api_server(request_queue: Queue, response_dict: dict, port: int = 8765):
     """在后台线程中启动 API 服务。返回线程对象（可设为 daemon）。"""
     import os
-    if not HAS_FLASK:
-        raise RuntimeError("Flask is required. Install with: pip install flask")
+    if not HAS_AIOHTTP:
+        raise RuntimeError("aiohttp is required. Install with: pip install aiohttp")
     app = create_app(request_queue, response_dict)
     port = int(os.environ.get("DEEPSEEK_API_PORT", port))
     thread = threading.Thread(
-        target=_run_flask,
-        args=(port, request_queue, response_dict, app),
+        target=_run_server,
+        args=(port, app),
         daemon=True,
     )
     thread.start()
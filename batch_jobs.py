@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+批量任务的持久化：一次上传的 JSONL 对应一个 batch，每行一个条目，逐条记录状态与结果（SQLite）。
+
+条目格式与 OpenAI Batch API 相同（{"custom_id", "method", "url", "body"}），也接受直接把
+/v1/chat/completions 的请求体写成一行。条目状态：queued → running → completed / failed，
+batch 取消时未完成的条目记为 cancelled。每个完成的条目分配递增的 seq，结果流按 seq 续传，
+服务重启后把 running 的条目退回 queued 继续执行（resume）。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    total INTEGER NOT NULL,
+    metadata TEXT
+);
+CREATE TABLE IF NOT EXISTS batch_items (
+    batch_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    custom_id TEXT,
+    url TEXT,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    seq INTEGER,
+    finished_at REAL,
+    PRIMARY KEY (batch_id, idx)
+);
+CREATE INDEX IF NOT EXISTS batch_items_seq ON batch_items (batch_id, seq);
+"""
+
+
+class BatchFormatError(ValueError):
+    """上传内容不是合法的 JSONL（整批拒绝，返回 400）。"""
+
+
+def parse_jsonl(data: bytes):
+    """解析上传的 JSONL，返回 [(custom_id, url, body)]；空行忽略。"""
+    items = []
+    for lineno, line in enumerate(data.decode("utf-8-sig").splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError as e:
+            raise BatchFormatError(f"line {lineno}: invalid JSON ({e})")
+        if not isinstance(obj, dict):
+            raise BatchFormatError(f"line {lineno}: expected a JSON object")
+        if isinstance(obj.get("body"), dict):
+            custom_id, url, body = obj.get("custom_id"), obj.get("url") or "/v1/chat/completions", obj["body"]
+        else:
+            body = dict(obj)
+            custom_id, url = body.pop("custom_id", None), "/v1/chat/completions"
+        items.append((str(custom_id) if custom_id is not None else f"item-{len(items)}", url, body))
+    if not items:
+        raise BatchFormatError("empty batch")
+    return items
+
+
+class BatchStore:
+    """batch 与条目状态的 SQLite 存储（api_server 经单线程执行器调用，不阻塞事件循环；另加锁防御并发）。"""
+
+    def __init__(self, path: str):
+        if os.path.dirname(os.path.abspath(path)):
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def create(self, items, metadata=None) -> dict:
+        batch_id = "batch_" + uuid.uuid4().hex[:24]
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO batches (id, status, created_at, total, metadata) VALUES (?, 'in_progress', ?, ?, ?)",
+                (batch_id, now, len(items), json.dumps(metadata or {}, ensure_ascii=False)),
+            )
+            self._db.executemany(
+                "INSERT INTO batch_items (batch_id, idx, custom_id, url, body, status) VALUES (?, ?, ?, ?, ?, 'queued')",
+                [(batch_id, i, cid, url, json.dumps(body, ensure_ascii=False)) for i, (cid, url, body) in enumerate(items)],
+            )
+            self._db.commit()
+        return self.get(batch_id)
+
+    def get(self, batch_id: str):
+        """batch 对象（含各状态计数）；不存在返回 None。"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, status, created_at, finished_at, total, metadata FROM batches WHERE id = ?", (batch_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            counts = dict(self._db.execute(
+                "SELECT status, COUNT(*) FROM batch_items WHERE batch_id = ? GROUP BY status", (batch_id,)
+            ).fetchall())
+        return {
+            "id": row[0],
+            "object": "batch",
+            "endpoint": "/v1/chat/completions",
+            "status": row[1],
+            "created_at": int(row[2]),
+            "completed_at": int(row[3]) if row[3] else None,
+            "request_counts": {
+                "total": row[4],
+                "queued": counts.get("queued", 0),
+                "running": counts.get("running", 0),
+                "completed": counts.get("completed", 0),
+                "failed": counts.get("failed", 0),
+                "cancelled": counts.get("cancelled", 0),
+            },
+            "metadata": json.loads(row[5] or "{}"),
+        }
+
+    def list(self, limit: int = 20):
+        with self._lock:
+            ids = [r[0] for r in self._db.execute(
+                "SELECT id FROM batches ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()]
+        return [self.get(i) for i in ids]
+
+    def unfinished(self):
+        """重启恢复：把中断时 running 的条目退回 queued，返回仍在进行中的 batch id。"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE batch_items SET status = 'queued' WHERE status = 'running' AND batch_id IN "
+                "(SELECT id FROM batches WHERE status = 'in_progress')"
+            )
+            self._db.commit()
+            return [r[0] for r in self._db.execute(
+                "SELECT id FROM batches WHERE status = 'in_progress' ORDER BY created_at"
+            ).fetchall()]
+
+    def queued(self, batch_id: str):
+        """尚未执行的条目 [(idx, custom_id, url, body)]，按上传顺序。"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT idx, custom_id, url, body FROM batch_items WHERE batch_id = ? AND status = 'queued' ORDER BY idx",
+                (batch_id,),
+            ).fetchall()
+        return [(idx, cid, url, json.loads(body)) for idx, cid, url, body in rows]
+
+    def mark_running(self, batch_id: str, idx: int):
+        with self._lock:
+            self._db.execute(
+                "UPDATE batch_items SET status = 'running' WHERE batch_id = ? AND idx = ? AND status = 'queued'",
+                (batch_id, idx),
+            )
+            self._db.commit()
+
+    def finish_item(self, batch_id: str, idx: int, result=None, error=None):
+        """记录条目结果（result 与 error 二选一），分配结果流的 seq。"""
+        status = "completed" if error is None else "failed"
+        with self._lock:
+            seq = self._next_seq(batch_id)
+            self._db.execute(
+                "UPDATE batch_items SET status = ?, result = ?, error = ?, seq = ?, finished_at = ? "
+                "WHERE batch_id = ? AND idx = ? AND status IN ('queued', 'running')",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 json.dumps(error, ensure_ascii=False) if error is not None else None, seq, time.time(), batch_id, idx),
+            )
+            self._db.commit()
+
+    def cancel(self, batch_id: str):
+        """取消：未完成的条目记为 cancelled（同样进入结果流）。"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT idx FROM batch_items WHERE batch_id = ? AND status IN ('queued', 'running') ORDER BY idx",
+                (batch_id,),
+            ).fetchall()
+            for (idx,) in rows:
+                self._db.execute(
+                    "UPDATE batch_items SET status = 'cancelled', seq = ?, finished_at = ? WHERE batch_id = ? AND idx = ?",
+                    (self._next_seq(batch_id), time.time(), batch_id, idx),
+                )
+            self._db.execute(
+                "UPDATE batches SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'in_progress'",
+                (time.time(), batch_id),
+            )
+            self._db.commit()
+
+    def complete(self, batch_id: str):
+        with self._lock:
+            self._db.execute(
+                "UPDATE batches SET status = 'completed', finished_at = ? WHERE id = ? AND status = 'in_progress'",
+                (time.time(), batch_id),
+            )
+            self._db.commit()
+
+    def results_after(self, batch_id: str, seq: int, limit: int = 500):
+        """seq 之后完成的条目，按完成顺序；返回 [(seq, 输出行对象)]。"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, idx, custom_id, status, result, error FROM batch_items "
+                "WHERE batch_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (batch_id, seq, limit),
+            ).fetchall()
+        out = []
+        for seq_, idx, cid, status, result, error in rows:
+            if status == "cancelled":
+                error = json.dumps({"code": "batch_cancelled", "message": "Batch was cancelled before this request ran"})
+            out.append((seq_, {
+                "id": f"{batch_id}-{idx}",
+                "custom_id": cid,
+                "response": json.loads(result) if result else None,
+                "error": json.loads(error) if error else None,
+            }))
+        return out
+
+    def _next_seq(self, batch_id: str) -> int:
+        row = self._db.execute("SELECT MAX(seq) FROM batch_items WHERE batch_id = ?", (batch_id,)).fetchone()
+        return (row[0] or 0) + 1
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+浏览器农场：启动 K 个独立的 main.py 浏览器工作进程，并在前面运行一个轻量路由。
+
+每个工作进程拥有独立的 WebEngine profile 目录与本地端口（各自一个 Qt 主线程），
+路由对外暴露与 api_server 相同的接口（/api/chat、/api/tags、/v1/chat/completions 等），
+从而用满多核机器。会话复用、回复缓存与在途合并都是进程内的，因此聊天请求先按对话的亲和键
+（第一条消息的指纹，见 session_store.affinity_key）固定到同一工作进程；该进程不可用或比最空闲的进程
+多排队超过 --affinity-slack 个请求时，才退回按队列深度选最空闲的进程。
+
+各工作进程的 batch 数据库与追踪日志放在自己的 profile 目录下（互不恢复对方的 batch、不争抢日志轮转）；
+/v1/batches* 固定转发给同一个工作进程（--batch-worker），/metrics 汇总各进程的指标并加上 worker 标签。
+
+用法：
+    python browser_farm.py --workers 4 --port 8765
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+from session_store import affinity_key
+from structured_log import get_logger, setup_logging
+
+log = get_logger("farm")
+
+try:
+    from aiohttp import web, ClientSession, ClientTimeout, ClientError
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+
+# 转发时不复制的逐跳头
+_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "content-length", "host", "content-encoding"}
+
+
+def merge_metrics(texts) -> str:
+    """合并各工作进程的 Prometheus 文本：{worker 序号: 文本} → 每个样本加 worker 标签，HELP / TYPE 只保留一份。"""
+    families = {}  # 指标族名 -> [HELP / TYPE 行, 样本行...]，按首次出现的顺序
+    for index, text in sorted(texts.items()):
+        label = f'worker="{index}"'
+        family = None
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            if line.startswith("#"):
+                parts = line.split(None, 3)
+                if len(parts) >= 3 and parts[1] in ("HELP", "TYPE"):
+                    family = families.setdefault(parts[2], [])
+                    if line not in family:
+                        family.append(line)
+                continue
+            name, sep, rest = line.partition("{")
+            if sep:
+                sample = f"{name}{{{label},{rest}" if not rest.startswith("}") else f"{name}{{{label}{rest}"
+            else:
+                name, _, value = line.partition(" ")
+                sample = f"{name}{{{label}}} {value}"
+            (family if family is not None else families.setdefault(name, [])).append(sample)
+    return "\n".join(line for lines in families.values() for line in lines) + "\n"
+
+
+class Backend:
+    """一个浏览器工作进程：子进程句柄、端口与路由视角下的负载。"""
+
+    def __init__(self, index: int, port: int, profile_dir: str):
+        self.index = index
+        self.port = port
+        self.profile_dir = profile_dir
+        self.process = None
+        self.outstanding = 0      # 经由本路由转发、尚未结束的请求数
+        self.reported_depth = 0   # 后端 /api/status 报告的排队 + 在途数
+        self.healthy = False
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def load(self) -> int:
+        return max(self.outstanding, self.reported_depth)
+
+    def spawn(self, tabs: int):
+        """启动（或重启）工作进程。"""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        env = dict(os.environ)
+        env["DEEPSEEK_API_PORT"] = str(self.port)
+        env["DEEPSEEK_PROFILE_DIR"] = self.profile_dir
+        env["DEEPSEEK_API_TABS"] = str(tabs)
+        # 每个进程自己的 batch 库与追踪日志：启动时只恢复自己的 batch，RotatingFileHandler 也不会跨进程轮转
+        env["DEEPSEEK_BATCH_DB"] = os.path.join(self.profile_dir, "batches.db")
+        if os.environ.get("DEEPSEEK_TRACE_LOG", "traces.jsonl"):
+            env["DEEPSEEK_TRACE_LOG"] = os.path.join(self.profile_dir, "traces.jsonl")
+        if os.environ.get("DEEPSEEK_LOG_FILE"):
+            env["DEEPSEEK_LOG_FILE"] = os.path.join(self.profile_dir, os.path.basename(os.environ["DEEPSEEK_LOG_FILE"]))
+        main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+        self.process = subprocess.Popen([sys.executable, main_py], env=env)
+        self.healthy = False
+
+
+class FarmRouter:
+    """前置路由：健康检查、按对话亲和与队列深度选择后端并转发（含流式响应）。"""
+
+    def __init__(self, backends, tabs: int = 1, status_interval: float = 1.0, batch_worker: int = 0,
+                 affinity_slack: int = 4):
+        self.backends = backends
+        self.affinity_slack = affinity_slack  # 亲和进程最多比最空闲进程多排队几个请求
+        self.batch_backend = backends[batch_worker % len(backends)]  # batch 状态只存在于这个进程的数据库中
+        self.tabs = tabs
+        self.status_interval = status_interval
+        self.session = None
+        self.owners = {}  # X-Request-Id -> Backend：进行中的请求所在的工作进程，供 DELETE 取消时定向转发
+
+    def pick(self, key: str = None):
+        """选出转发目标：有亲和键时优先选键对应的后端（最高随机权重哈希，某个进程不可用只影响映射到它的键），
+        该后端负载超出最空闲后端 affinity_slack 以上时改选最空闲的；全部不可用时返回 None。"""
+        candidates = [b for b in self.backends if b.healthy]
+        if not candidates:
+            return None
+        least = min(candidates, key=lambda b: (b.load, b.index))
+        if key:
+            affine = max(candidates, key=lambda b: hashlib.sha256(f"{key}:{b.index}".encode("utf-8")).digest())
+            if affine.load - least.load <= self.affinity_slack:
+                return affine
+        return least
+
+    @staticmethod
+    def _affinity(body: bytes):
+        """聊天请求体的亲和键；不是带 messages 的 JSON 时返回 None（按负载转发）。"""
+        try:
+            data = json.loads(body or b"null")
+        except ValueError:
+            return None
+        return affinity_key(data.get("messages")) if isinstance(data, dict) else None
+
+    async def _refresh_status(self):
+        """定时拉取各后端 /api/status，并重启已退出的工作进程。"""
+        while True:
+            for backend in self.backends:
+                if backend.process is not None and backend.process.poll() is not None:
+                    log.warning("工作进程已退出，正在重启", worker=backend.index, code=backend.process.returncode)
+                    backend.spawn(self.tabs)
+                try:
+                    async with self.session.get(backend.base_url + "/api/status",
+                                                timeout=ClientTimeout(total=2)) as resp:
+                        data = await resp.json()
+                    backend.reported_depth = int(data.get("queue_depth", 0)) + int(data.get("inflight", 0))
+                    backend.healthy = True
+                except (ClientError, asyncio.TimeoutError, ValueError):
+                    backend.healthy = False
+            await asyncio.sleep(self.status_interval)
+
+    async def _on_startup(self, app):
+        self.session = ClientSession(timeout=ClientTimeout(total=None, sock_connect=5))
+        app["status_task"] = asyncio.create_task(self._refresh_status())
+
+    async def _on_cleanup(self, app):
+        app["status_task"].cancel()
+        await self.session.close()
+
+    async def index(self, request):
+        return web.json_response({
+            "service": "DeepSeek Local API 浏览器农场路由",
+            "backends": [
+                {"index": b.index, "port": b.port, "healthy": b.healthy,
+                 "outstanding": b.outstanding, "reported_depth": b.reported_depth}
+                for b in self.backends
+            ],
+        })
+
+    async def proxy(self, request):
+        """把请求原样转发给选出的后端（见 pick），响应按块回传（保持 SSE / NDJSON 流式）。"""
+        body = await request.read()
+        if request.method == "DELETE" and request.path.startswith("/v1/requests/"):
+            backend = self.owners.get(request.path.rsplit("/", 1)[-1])
+            if backend is None:
+                return web.json_response({"error": {"message": "No pending request", "type": "not_found"}}, status=404)
+        elif request.path == "/v1/batches" or request.path.startswith("/v1/batches/"):
+            backend = self.batch_backend if self.batch_backend.healthy else None
+        else:
+            backend = self.pick(self._affinity(body) if request.method == "POST" else None)
+        if backend is None:
+            return web.json_response({"error": "no browser worker available"}, status=503,
+                                     headers={"Retry-After": "5"})
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in _HOP_HEADERS}
+        headers["X-Forwarded-For"] = request.remote or ""
+        request_id = None
+        if request.method == "POST":
+            # 在转发前确定请求 ID 并登记所属进程：非流式请求要等响应头返回后才拿得到上游的 ID，
+            # 那时 DELETE 早已无法定向
+            request_id = request.headers.get("X-Request-Id")
+            if not request_id or request_id in self.owners:
+                request_id = str(uuid.uuid4())
+            headers["X-Request-Id"] = request_id
+            self.owners[request_id] = backend
+        backend.outstanding += 1
+        resp = None
+        try:
+            async with self.session.request(request.method, backend.base_url + request.path_qs,
+                                            data=body, headers=headers) as upstream:
+                resp = web.StreamResponse(status=upstream.status)
+                for k, v in upstream.headers.items():
+                    if k.lower() not in _HOP_HEADERS:
+                        resp.headers[k] = v
+                resp.headers["X-Farm-Worker"] = str(backend.index)
+                await resp.prepare(request)
+                async for chunk in upstream.content.iter_any():
+                    await resp.write(chunk)
+                await resp.write_eof()
+                return resp
+        except ClientError as e:
+            if resp is None:
+                # 连接 / 握手阶段失败（没拿到上游响应头）才说明工作进程不可用
+                backend.healthy = False
+                return web.json_response({"error": f"worker {backend.index} unavailable: {e}"}, status=502)
+            if not resp.prepared:
+                return web.json_response({"error": f"worker {backend.index} failed: {e}"}, status=502)
+            # 响应头已发出（SSE / NDJSON 流式中途上游读失败或客户端断开）：不能再换成 502，
+            # 直接断开下游连接，让客户端看到不完整的流而不是正常结束
+            log.warning("转发中途出错，断开流", worker=backend.index, request_id=request_id, error=str(e))
+            if request.transport is not None:
+                request.transport.close()
+            return resp
+        finally:
+            backend.outstanding -= 1
+            if request_id is not None:
+                self.owners.pop(request_id, None)
+
+    async def metrics(self, request):
+        """汇总各健康工作进程的 /metrics，样本带 worker 标签（各进程的计数器互相独立，按标签区分）。"""
+        async def fetch(backend):
+            try:
+                async with self.session.get(backend.base_url + "/metrics", timeout=ClientTimeout(total=5)) as resp:
+                    return backend.index, await resp.text()
+            except (ClientError, asyncio.TimeoutError):
+                return backend.index, None
+
+        results = await asyncio.gather(*(fetch(b) for b in self.backends if b.healthy))
+        text = merge_metrics({index: body for index, body in results if body is not None})
+        return web.Response(body=text.encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    def create_app(self) -> "web.Application":
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        app.router.add_get("/farm", self.index)
+        app.router.add_get("/metrics", self.metrics)
+        app.router.add_route("*", "/{tail:.*}", self.proxy)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动多进程 DeepSeek 浏览器农场与前置路由")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="浏览器工作进程数 K")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("DEEPSEEK_API_PORT", "8765")),
+                        help="路由对外端口")
+    parser.add_argument("--base-port", type=int, default=8800, help="工作进程起始端口（依次 +1）")
+    parser.add_argument("--tabs", type=int, default=int(os.environ.get("DEEPSEEK_API_TABS", "1")),
+                        help="每个工作进程的 API 标签页数")
+    parser.add_argument("--batch-worker", type=int, default=0, help="处理 /v1/batches 的工作进程序号")
+    parser.add_argument("--affinity-slack", type=int, default=4,
+                        help="同一对话固定的工作进程最多比最空闲进程多排队几个请求，超过则改发最空闲进程")
+    parser.add_argument("--profile-root", default=os.path.join(os.getcwd(), "farm_profiles"),
+                        help="各工作进程 profile 目录的父目录（首次需在每个窗口中登录）")
+    args = parser.parse_args()
+    setup_logging()
+    if not HAS_AIOHTTP:
+        raise SystemExit("aiohttp is required. Install with: pip install aiohttp")
+
+    backends = [
+        Backend(i, args.base_port + i, os.path.join(args.profile_root, f"worker-{i}"))
+        for i in range(max(1, args.workers))
+    ]
+    for backend in backends:
+        backend.spawn(args.tabs)
+        time.sleep(0.5)  # 错开 Chromium 启动
+    router = FarmRouter(backends, tabs=args.tabs, batch_worker=args.batch_worker,
+                        affinity_slack=args.affinity_slack)
+    log.info("浏览器农场已启动", workers=len(backends), url=f"http://127.0.0.1:{args.port}/")
+    try:
+        web.run_app(router.create_app(), host="127.0.0.1", port=args.port, access_log=None,
+                    handler_cancellation=True)
+    finally:
+        for backend in backends:
+            if backend.process is not None and backend.process.poll() is None:
+                backend.process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,650 @@
+#!/usr/bin/env python3
+"""
+网页回复内容规范化：去掉 UI 标签、无意义行、模板化开场白 / 结尾，补全代码块，标准化空白。
+
+所有正则与匹配表在模块加载时编译一次；正文只做一次按行扫描（无意义行过滤、空行折叠、
+行尾空白清理合并完成），开场白 / 结尾只检查首尾，不再对整段回复反复 replace / split / join。
+输出与 api_server 原先的实现逐字节一致，见 test_normalizer.py 的语料等价性测试与基准。
+
+StreamingNormalizer 是同一规则的增量版本，供流式响应按块喂入网页回复快照的增量。
+"""
+
+import itertools
+import json
+import re
+
+# 保留 Cline/Aline 的文件创建格式：出现任一标签时原样返回
+_FILE_TAGS = ("<create_file>", "<file_path>", "<file_content>")
+
+# UI 标签按原先的替换顺序排列；带方括号的在前，保证与逐个 replace 的结果一致
+_UI_TAGS = ("[系统指令]", "[用户输入]", "[约束]", "[问题]", "系统指令", "用户输入")
+_UI_TAG_RE = re.compile("|".join(re.escape(tag) for tag in _UI_TAGS))
+_UI_TAG_PROBES = ("系统指令", "用户输入", "[约束]", "[问题]")  # 任一标签必含其一；子串查找比正则扫描快得多
+_UI_TAG_PREFIXES = frozenset(tag[:i] for tag in _UI_TAGS for i in range(1, len(tag)))
+
+_PLACEHOLDER_RE = re.compile(r"^(Aline\s*有一个问题|Your\s*question\s*here)[:\s]*$", re.IGNORECASE)
+_PLACEHOLDER_COMPACT = ("aline有一个问题", "yourquestionhere")  # 去掉空白并 casefold 后的占位符
+
+_MEANINGLESS_LINES = frozenset(("复制", "联网搜索", "互联网搜索", "下载"))
+
+# 将 “文件名 + 语言名” 形式的代码转换为标准 markdown 代码块
+_CODE_HEADER_RE = re.compile(
+    r"^([a-zA-Z0-9_\.\-]+\.(?:py|js|ts|java|cpp|go|rs))\s*[)：:]?\s*\n\s*(python|javascript|java|cpp|go|rust)\s*\n",
+    re.MULTILINE | re.IGNORECASE,
+)
+# 与 _CODE_HEADER_RE 等价的逐行形式（行已去掉行尾空白）
+_HEADER_LINE_RE = re.compile(r"([a-zA-Z0-9_\.\-]+\.(?:py|js|ts|java|cpp|go|rs))\s*[)：:]?", re.IGNORECASE)
+_HEADER_PREFIX_RE = re.compile(r"[a-zA-Z0-9_\.\-]*\s*[)：:]?\s*", re.IGNORECASE)
+_LANG_LINE_RE = re.compile(r"\s*(python|javascript|java|cpp|go|rust)", re.IGNORECASE)
+_HEADER_COLONS = (")", "：", ":")
+
+# 只移除非常明确的模板化开场白（按顺序各尝试一次）
+_OPENING_RES = tuple(
+    re.compile(pattern, re.IGNORECASE)
+    for pattern in (r"^好的[，,]?\s*", r"^收到[，,]?\s*", r"^明白[了]?[，,]?\s*")
+)
+_OPENING_FIRST_CHARS = frozenset("好收明")
+
+_CONSTRUCTIVE_ENDINGS = frozenset(("希望可以帮到你。", "希望可以帮到你", "如有疑问欢迎继续提问。", "如有疑问欢迎继续问。"))
+_WHOLE_LINE_TERMS = _MEANINGLESS_LINES | _CONSTRUCTIVE_ENDINGS
+
+# JSON 扫描只关心这些字符，其余字符由正则引擎整段跳过
+_JSON_TOKEN_RE = re.compile(r'[{}\[\]"\\]')
+_JSON_CLOSERS = {"}": "{", "]": "["}
+
+
+def _strip_ui_tags(s: str) -> str:
+    """一次正则扫描去掉所有 UI 标签；去除后拼接出新标签的罕见情况回退到逐个替换。"""
+    if not any(probe in s for probe in _UI_TAG_PROBES):
+        return s
+    out = _UI_TAG_RE.sub("", s).strip()
+    if _UI_TAG_RE.search(out):
+        out = s
+        for tag in _UI_TAGS:
+            out = out.replace(tag, "").strip()
+    return out
+
+
+def _strip_line_tags(line: str) -> str:
+    """单行版本的 _strip_ui_tags（标签不跨行；行首尾空白由调用方按整段规则处理）。"""
+    if not any(probe in line for probe in _UI_TAG_PROBES):
+        return line
+    out = _UI_TAG_RE.sub("", line)
+    if _UI_TAG_RE.search(out):
+        out = line
+        for tag in _UI_TAGS:
+            out = out.replace(tag, "")
+    return out
+
+
+def _tag_prefix_len(s: str) -> int:
+    """s 末尾可能是半个 UI 标签的最长长度（0 表示不是）。"""
+    for k in range(min(5, len(s)), 0, -1):
+        if s[-k:] in _UI_TAG_PREFIXES:
+            return k
+    return 0
+
+
+def _strip_openings(s: str) -> str:
+    """依次去掉模板化开场白（s 开头须已无空白）。"""
+    if s and s[0] in _OPENING_FIRST_CHARS:
+        for pattern in _OPENING_RES:
+            m = pattern.match(s)
+            if m:
+                s = s[m.end():].lstrip()
+    return s
+
+
+def _strip_cline_config(s: str) -> str:
+    """移除回复中复述的 Cline 系统配置（仅当不是代码块时调用）。"""
+    filtered_lines = []
+    skip_cline_config = False
+    for line in s.split("\n"):
+        if "You are Cline" in line:
+            skip_cline_config = True
+            continue
+        elif skip_cline_config and (line.startswith("##") or "MODES" in line or "EXECUTION FLOW" in line):
+            if "<task>" in line:
+                skip_cline_config = False
+                filtered_lines.append(line)
+            continue
+        elif "<task>" in line:
+            skip_cline_config = False
+            filtered_lines.append(line)
+        elif not skip_cline_config:
+            filtered_lines.append(line)
+    return "\n".join(filtered_lines).strip()
+
+
+def _scan_lines(s: str) -> str:
+    """单次按行扫描：过滤无意义行、去掉首尾空白行、折叠连续空行（\\n{3,} -> \\n\\n）、清理行尾空白。"""
+    out = []
+    prev_empty = False
+    for line in s.split("\n"):
+        stripped = line.strip()
+        if stripped in _MEANINGLESS_LINES:
+            continue
+        if not out:
+            if not stripped:
+                continue  # 开头的空白行由 strip() 去掉
+            line = line.lstrip()
+        if not line:
+            if prev_empty:
+                continue
+            prev_empty = True
+        else:
+            prev_empty = False
+        out.append(line.rstrip())
+    while out and not out[-1]:
+        out.pop()
+    return "\n".join(out)
+
+
+class JsonScanner:
+    """增量扫描顶层 JSON 对象 / 数组的边界：正确处理字符串与转义。
+
+    openers 指定哪些括号可以开始一个顶层候选（"{" 只找对象）。候选之外的引号不计入字符串状态，
+    因此正文里的中文引号、英文引号不会干扰。括号不匹配时从该候选起点的下一个字符重新扫描
+    （如 "note {bad ... {"a": 1}" 中的 {"a": 1}），为此保留未闭合候选已扫描过的文本；
+    文本结束时仍未闭合的候选由 finish() 同样从起点之后重新扫描。没有失败候选时每个字符只看一次。
+    """
+
+    def __init__(self, openers: str = "{[", offset: int = 0):
+        self.openers = openers
+        self.offset = offset  # 已扫描的字符数（全局偏移）
+        self.open_start = -1  # 尚未闭合的顶层候选的起点，-1 表示没有
+        self._held = []  # 未闭合候选在之前各块中的文本
+        self._reset()
+
+    def _reset(self):
+        self.open_start = -1
+        self._held = []
+        self._stack = []
+        self._in_string = False
+        self._escape = False  # 上一块以字符串中的反斜杠结尾
+
+    def scan(self, chunk: str):
+        """扫描新的一段文本，逐个产出本段内闭合的顶层候选 (start, end)（全局偏移，end 不含）。"""
+        base = self.offset
+        self.offset += len(chunk)
+        yield from self._run(base, chunk)
+
+    def finish(self):
+        """文本结束：未闭合的候选不是完整 JSON，从其起点之后重新扫描，产出其中闭合的候选。"""
+        while self.open_start >= 0:
+            start, text = self.open_start, "".join(self._held)
+            self._reset()
+            yield from self._run(start + 1, text[1:])
+
+    def _run(self, base, text):
+        while text is not None:
+            base, text = yield from self._scan(base, text)
+
+    def _scan(self, base, chunk):
+        """扫描 chunk（起点为全局偏移 base）；括号不匹配时返回需要重新扫描的 (起点, 文本)，否则返回 (None, None)。"""
+        skip = -1
+        if self._escape and chunk:
+            skip = 0
+            self._escape = False
+        for m in _JSON_TOKEN_RE.finditer(chunk):
+            i = m.start()
+            if i == skip:
+                continue
+            ch = chunk[i]
+            if self._in_string:
+                if ch == "\\":
+                    if i + 1 < len(chunk):
+                        skip = i + 1
+                    else:
+                        self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if not self._stack:
+                if ch in self.openers:
+                    self._stack.append(ch)
+                    self.open_start = base + i
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch == "{" or ch == "[":
+                self._stack.append(ch)
+            elif ch in _JSON_CLOSERS:
+                if self._stack[-1] != _JSON_CLOSERS[ch]:
+                    # 括号不匹配，不是 JSON：候选内部（起点之后）可能还有完整的 JSON，从那里重新扫描
+                    start = self.open_start
+                    text = "".join(self._held) + chunk[max(0, start - base):]
+                    self._reset()
+                    return start + 1, text[1:]
+                self._stack.pop()
+                if not self._stack:
+                    start = self.open_start
+                    self.open_start = -1
+                    self._held = []
+                    yield start, base + i + 1
+        if self._stack:
+            self._held.append(chunk[max(0, self.open_start - base):])
+        return None, None
+
+
+def iter_json(s: str, openers: str = "{[", offset: int = 0):
+    """依次产出 s 中能解析的顶层 JSON：(obj, start, end)，偏移加上 offset。
+    闭合但无法解析的候选（如 {说明 {"a": 1}}）在其内部继续查找。"""
+    scanner = JsonScanner(openers, offset)
+    for start, end in itertools.chain(scanner.scan(s), scanner.finish()):
+        try:
+            obj = json.loads(s[start - offset:end - offset])
+        except ValueError:
+            yield from iter_json(s[start + 1 - offset:end - offset], openers, start + 1)
+            continue
+        yield obj, start, end
+
+
+def find_json(s: str, openers: str = "{["):
+    """找出第一个能解析的顶层 JSON（openers 默认对象与数组）；返回 (obj, start, end)，没有时返回 None。"""
+    return next(iter_json(s, openers), None)
+
+
+def _extract_json(s: str):
+    """从回复中提取第一个完整的 JSON 对象（代码块内外均可），规范为紧凑 JSON；失败返回 None。
+    与原实现一致只取对象，顶层数组不提取。"""
+    found = find_json(s, "{")
+    if found is None:
+        return None
+    return json.dumps(found[0], ensure_ascii=False)
+
+
+def normalize_content(raw: str, want_json_only: bool = False) -> str:
+    """优化的内容规范化处理 - 保留更多有用信息，确保与Claude等智能体兼容"""
+    if not raw or not isinstance(raw, str):
+        return raw or ""
+
+    s = raw.strip()
+    if any(tag in s for tag in _FILE_TAGS):
+        return s  # 文件创建格式，直接返回，不做过多清理
+
+    s = _strip_ui_tags(s)
+    if "You are Cline" in s and "GLOBAL RULES" in s and "```" not in s:
+        s = _strip_cline_config(s)
+    if _PLACEHOLDER_RE.match(s):
+        s = ""
+
+    s = _scan_lines(s)
+
+    s = _CODE_HEADER_RE.sub(r"**\1**\n```\2\n", s)
+    if s.count("```") % 2 == 1:
+        s = s.rstrip() + "\n```"  # 补全未闭合的代码块
+
+    s = _strip_openings(s.strip())
+
+    cut = s.rfind("\n")
+    if s[cut + 1:].strip() in _CONSTRUCTIVE_ENDINGS:
+        s = s[:cut].strip() if cut >= 0 else ""
+
+    if want_json_only:
+        extracted = _extract_json(s)
+        if extracted is not None:
+            return extracted
+    return s
+
+
+class StreamingNormalizer:
+    """normalize_content 的增量版本：按块喂入网页回复，立即产出已经确定的规范化文本。
+
+    只扣留判断所需的最小尾部：可能是半个 UI 标签或整行无意义词 / 结尾客套话的当前行开头、
+    行尾空白、尚未确定的开场白 / 占位符开头、可能在末尾被去掉的空行与结尾客套话，以及等待语言行的
+    “文件名” 行。每个字符只被处理常数次，整次请求的规范化开销与回复长度成线性。
+
+    feed() 产出的各段与 finish() 拼接后与 normalize_content(完整文本) 一致；例外是文件创建标签或
+    Cline 配置复述出现在已产出内容之后（整段规则此时改为原样返回，已发送的内容无法撤回），
+    此时退化为其后原样输出 / 结束时补发。
+    """
+
+    def __init__(self):
+        self._raw = []
+        self._pieces = []
+        self._mode = "normal"  # normal / passthrough（出现文件创建标签）/ hold（出现 Cline 配置复述）
+        # 当前未结束的行
+        self._line_raw = []
+        self._line_live = None  # 本行能否边收边产出（None 表示尚未判断）
+        self._line_tail = ""  # 尚未清理标签的原始尾部（可能是半个标签）
+        self._line_hold = ""  # 已清理、尚未产出的部分
+        self._line_sent = 0  # 本行已产出的字符数
+        self._line_safe = False  # 本行已确定不是无意义行 / 结尾客套话 / 文件名行
+        # 按行扫描
+        self._started = False
+        self._prev_empty = False
+        self._blanks = []
+        # 占位符判断（整段只含占位符时输出为空）
+        self._placeholder = True
+        self._placeholder_compact = ""
+        self._placeholder_lines = []
+        # “文件名 + 语言名” 代码头
+        self._header_state = None  # None / "name" / "lang"
+        self._header_lines = []
+        self._header_name = ""
+        self._header_lang = ""
+        self._header_colon = False
+        self._eat_blank = False
+        self._fences = 0
+        # 开场白
+        self._head = []
+        self._head_done = False
+        # 可能在末尾被去掉的行
+        self._pending = []
+        self._lines_out = 0
+        # 原样输出
+        self._passthrough_hold = ""
+        self._passthrough_started = False
+
+    @property
+    def text(self) -> str:
+        """到目前为止产出的全部文本。"""
+        return "".join(self._pieces)
+
+    def feed(self, chunk: str) -> str:
+        """喂入新到达的一段原始回复，返回可以立即发送的规范化文本。"""
+        if not chunk:
+            return ""
+        self._raw.append(chunk)
+        start = len(self._pieces)
+        if self._mode == "passthrough":
+            self._feed_passthrough(chunk)
+        elif self._mode == "normal":
+            parts = chunk.split("\n")
+            for i in range(len(parts) - 1):
+                self._line_raw.append(parts[i])
+                self._end_line()
+                if self._mode == "passthrough":
+                    self._start_passthrough("\n" + "\n".join(parts[i + 1:]))
+                    break
+                if self._mode == "hold":
+                    break
+            else:
+                self._line_raw.append(parts[-1])
+                self._feed_partial(parts[-1])
+        return "".join(self._pieces[start:])
+
+    def finish(self) -> str:
+        """回复结束：处理最后一行并决定被扣留的尾部，返回剩余的规范化文本。"""
+        start = len(self._pieces)
+        if self._mode == "hold":
+            final = normalize_content("".join(self._raw))
+            sent = self.text
+            self._emit(final[len(sent):] if final.startswith(sent) else "")
+            return "".join(self._pieces[start:])
+        if self._mode == "normal":
+            self._end_line()
+            if self._mode == "passthrough":
+                self._start_passthrough("")
+            elif self._mode == "hold":
+                return self.finish()
+        if self._mode == "passthrough":
+            return "".join(self._pieces[start:])  # 结尾空白不输出
+
+        self._blanks = []  # 结尾的空白行由 strip() 去掉
+        if self._header_state is not None:
+            self._release_header()
+        if not self._head_done:
+            if self._placeholder and _PLACEHOLDER_RE.match("\n".join(self._placeholder_lines).strip()):
+                s = ""
+            else:
+                s = "\n".join(self._head)
+            if s.count("```") % 2 == 1:
+                s = s.rstrip() + "\n```"
+            s = _strip_openings(s.strip())
+            cut = s.rfind("\n")
+            if s[cut + 1:].strip() in _CONSTRUCTIVE_ENDINGS:
+                s = s[:cut].strip() if cut >= 0 else ""
+            self._emit(s)
+            return "".join(self._pieces[start:])
+
+        lead = "\n" if self._lines_out else ""
+        tail = (lead + "\n".join(self._pending)).rstrip() if self._pending else ""
+        if self._fences % 2 == 1:
+            tail = tail + "\n```" if tail or self._lines_out else "```"
+        else:
+            cut = tail.rfind("\n")
+            if tail[cut + 1:].strip() in _CONSTRUCTIVE_ENDINGS:
+                tail = tail[:cut].rstrip() if cut >= 0 else ""
+        self._emit(tail)
+        self._pending = []
+        return "".join(self._pieces[start:])
+
+    def _emit(self, text):
+        if text:
+            self._pieces.append(text)
+
+    # ---- 当前行 ----
+
+    def _feed_partial(self, text):
+        """行未结束时尽早产出已确定的部分。"""
+        if self._line_live is None:
+            self._line_live = self._head_done and self._header_state is None
+        if not self._line_live or not text:
+            return
+        seg = self._line_tail + text
+        cut = len(seg) - _tag_prefix_len(seg)
+        self._line_tail = seg[cut:]
+        buf = self._line_hold + _UI_TAG_RE.sub("", seg[:cut])
+        if _UI_TAG_RE.search(buf):
+            self._line_live = False  # 去掉标签后又拼出了标签：留到整行结束再按逐个替换处理
+            return
+        if not self._line_safe:
+            stripped = buf.strip()
+            if not stripped or any(term.startswith(stripped) for term in _WHOLE_LINE_TERMS):
+                self._line_hold = buf
+                return
+            if _HEADER_PREFIX_RE.fullmatch(buf):
+                self._line_hold = buf
+                return
+            self._line_safe = True
+        ready = buf.rstrip()
+        k = _tag_prefix_len(ready)
+        while k:
+            ready = ready[:-k].rstrip()
+            k = _tag_prefix_len(ready)
+        if ready:
+            if not self._line_sent:
+                self._open_line()
+            self._emit(ready)
+            self._line_sent += len(ready)
+            buf = buf[len(ready):]
+        self._line_hold = buf
+
+    def _open_line(self):
+        """当前行确定是普通内容行：先放行此前扣留的空行 / 结尾行，再开始输出本行。"""
+        blanks, self._blanks = self._blanks, []
+        for blank in blanks:
+            self._stage_header(blank)
+        self._eat_blank = False
+        self._prev_empty = False
+        self._start_line()
+
+    def _end_line(self):
+        raw_line = "".join(self._line_raw)
+        sent = self._line_sent
+        self._line_raw = []
+        self._line_live = None
+        self._line_tail = ""
+        self._line_hold = ""
+        self._line_sent = 0
+        self._line_safe = False
+        if sent:
+            line = _strip_line_tags(raw_line).rstrip()
+            self._fences += line.count("```")
+            self._emit(line[sent:])
+            if any(tag in raw_line for tag in _FILE_TAGS):
+                self._mode = "passthrough"
+            elif "You are Cline" in line:
+                self._mode = "hold"
+            return
+        if any(tag in raw_line for tag in _FILE_TAGS):
+            self._mode = "passthrough"
+            return
+        line = _strip_line_tags(raw_line)
+        if "You are Cline" in line:
+            self._mode = "hold"
+            return
+        if self._placeholder:
+            self._track_placeholder(line)
+        self._stage_scan(line)
+        if not self._head_done:
+            self._try_head()
+
+    def _track_placeholder(self, line):
+        self._placeholder_lines.append(line)
+        compact = self._placeholder_compact + "".join(line.split()).casefold()
+        self._placeholder_compact = compact
+        for phrase in _PLACEHOLDER_COMPACT:
+            if phrase.startswith(compact) or (compact.startswith(phrase) and not compact[len(phrase):].strip(":")):
+                return
+        self._placeholder = False
+        self._placeholder_lines = []
+
+    # ---- 流水线各阶段（与 normalize_content 的顺序一致）----
+
+    def _stage_scan(self, line):
+        """无意义行过滤、开头空白行、空行折叠、行尾空白；空白行扣留到后面出现内容行为止。"""
+        stripped = line.strip()
+        if stripped in _MEANINGLESS_LINES:
+            return
+        if not self._started:
+            if not stripped:
+                return
+            line = line.lstrip()
+            self._started = True
+        if not line:
+            if self._prev_empty:
+                return
+            self._prev_empty = True
+            self._blanks.append("")
+            return
+        self._prev_empty = False
+        line = line.rstrip()
+        if not line:
+            self._blanks.append("")
+            return
+        blanks, self._blanks = self._blanks, []
+        for blank in blanks:
+            self._stage_header(blank)
+        self._stage_header(line)
+
+    def _stage_header(self, line):
+        """“文件名 + 语言名” 转为 **文件名** 与 ```语言：扣留文件名行直到确认其后是语言行且还有内容。"""
+        if self._header_state is None:
+            if not line:
+                if not self._eat_blank:
+                    self._stage_fence(line)
+                return
+            self._eat_blank = False
+            m = _HEADER_LINE_RE.fullmatch(line)
+            if m:
+                self._header_state = "name"
+                self._header_lines = [line]
+                self._header_name = m.group(1)
+                self._header_colon = bool(line[m.end(1):].strip())
+                return
+            self._stage_fence(line)
+        elif self._header_state == "name":
+            if not line:
+                self._header_lines.append(line)
+                return
+            if not self._header_colon and line.strip() in _HEADER_COLONS:
+                self._header_colon = True
+                self._header_lines.append(line)
+                return
+            m = _LANG_LINE_RE.fullmatch(line)
+            if m:
+                self._header_state = "lang"
+                self._header_lines.append(line)
+                self._header_lang = m.group(1)
+                return
+            self._header_lines.append(line)
+            self._release_header()
+        else:
+            self._header_state = None
+            self._header_lines = []
+            self._stage_fence("**" + self._header_name + "**")
+            self._stage_fence("```" + self._header_lang)
+            self._eat_blank = True
+            self._stage_header(line)
+
+    def _release_header(self):
+        """不构成代码头：文件名行原样放行，其后的行重新判断。"""
+        lines = self._header_lines
+        self._header_state = None
+        self._header_lines = []
+        self._stage_fence(lines[0])
+        for line in lines[1:]:
+            self._stage_header(line)
+
+    def _stage_fence(self, line):
+        self._fences += line.count("```")
+        if self._head_done:
+            self._stage_tail(line)
+        else:
+            self._head.append(line)
+
+    def _try_head(self):
+        """开场白：开头去掉模板化表述后出现实际内容（且不可能是占位符）即可确定。"""
+        if self._placeholder or not self._head:
+            return
+        rest = _strip_openings("\n".join(self._head).lstrip())
+        if not rest.strip():
+            return
+        self._head_done = True
+        self._head = []
+        for line in rest.split("\n"):
+            self._stage_tail(line)
+
+    def _stage_tail(self, line):
+        """空行与结尾客套话可能在末尾被去掉，扣留到后面出现普通内容行为止。"""
+        if not line or line.strip() in _CONSTRUCTIVE_ENDINGS:
+            self._pending.append(line)
+            return
+        self._start_line()
+        self._emit(line)
+
+    def _start_line(self):
+        for line in self._pending:
+            self._emit("\n" + line if self._lines_out else line)
+            self._lines_out += 1
+        self._pending = []
+        if self._lines_out:
+            self._emit("\n")
+        self._lines_out += 1
+
+    # ---- 文件创建格式：原样输出 ----
+
+    def _start_passthrough(self, rest):
+        if not any(self._pieces):
+            self._passthrough_hold = ""
+            self._passthrough_started = False
+            self._feed_passthrough("".join(self._raw))
+            return
+        # 已经按规范化规则产出过内容：放行扣留的行，其后原样输出
+        self._blanks = []
+        if self._header_state is not None:
+            self._release_header()
+        self._start_line_flush()
+        self._passthrough_started = True
+        self._passthrough_hold = ""
+        self._feed_passthrough(rest)
+
+    def _start_line_flush(self):
+        for line in self._pending:
+            self._emit("\n" + line if self._lines_out else line)
+            self._lines_out += 1
+        self._pending = []
+
+    def _feed_passthrough(self, chunk):
+        if not self._passthrough_started:
+            chunk = chunk.lstrip()
+            if not chunk:
+                return
+            self._passthrough_started = True
+        buf = self._passthrough_hold + chunk
+        ready = buf.rstrip()
+        self._emit(ready)
+        self._passthrough_hold = buf[len(ready):]
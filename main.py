@@ -6,8 +6,10 @@ DeepSeek Qt浏览器应用
 
 import sys
 import os
-from queue import Queue
-from PyQt6.QtCore import Qt, QUrl, QTimer, pyqtSlot
+import logging
+import time
+from collections import deque
+from PyQt6.QtCore import Qt, QUrl, QTimer, QObject, pyqtSlot
 try:
     from pynput.keyboard import Controller as KeyController, Key
     _HAS_PYNPUT = True
@@ -15,6 +17,7 @@ except ImportError:
     _HAS_PYNPUT = False
 try:
     from api_server import start_api_server
+    from request_scheduler import FairScheduler
     _HAS_API_SERVER = True
 except ImportError:
     _HAS_API_SERVER = False
@@ -23,8 +26,452 @@ from PyQt6.QtWidgets import (
     QTextEdit, QPushButton, QLabel, QSplitter, QMessageBox, QComboBox
 )
 from PyQt6.QtWebEngineWidgets import QWebEngineView
-from PyQt6.QtWebEngineCore import QWebEnginePage, QWebEngineSettings
+from PyQt6.QtWebEngineCore import QWebEnginePage, QWebEngineProfile, QWebEngineSettings
 from PyQt6.QtGui import QFont, QIcon
+import metrics
+from page_helpers import bridge_call, ensure_helpers, install_page_helpers
+from reply_observer import (
+    FLUSH_SCRIPT, STREAM_URL_PATTERN, WORLD_ID, CompletionSignals, DeltaReader, install_reply_observer,
+)
+from session_store import NEW_CONVERSATION
+from structured_log import get_logger, setup_logging
+
+log = get_logger("browser")
+
+DEEPSEEK_HOME = "https://chat.deepseek.com/"
+REPLY_POLL_MS = 200
+REPLY_STABLE_POLLS = 8  # 连续未变化的轮询次数 → 判定回复稳定（页面完成信号缺失时的兜底）
+REPLY_MAX_POLLS = 200
+
+
+class ApiTabWorker(QObject):
+    """API 工作标签页：一个 QWebEnginePage 及其单个请求的注入 / 轮询 / 稳定判断 / 最终抓取状态。
+
+    多个工作者共用同一个 QWebEngineProfile（登录态、Cookie 共享），由 DeepSeekBrowser 的调度器
+    从 request_queue 取任务分配给空闲的标签页，从而并行处理多个 API 请求。
+    """
+
+    def __init__(self, window: "DeepSeekBrowser", page: QWebEnginePage, index: int, visible: bool):
+        super().__init__(window)
+        self.window = window
+        self.page = page
+        self.index = index
+        self.visible = visible  # 是否为左侧可见的浏览器页（可用 pynput 发送真实回车）
+        self.request_id = None
+        self.response_event = None
+        self.stream_channel = None  # api_server.StreamChannel：把生成中的回复快照推给流式响应
+        self.response_dict = None
+        self._last_reply_text = ""
+        self._last_sent_message = ""
+        self._repair_sent = False  # json_schema 校验失败后已在同一对话中追问过一次
+        self._pending_message = None  # 等待对话页加载完成后发送的消息
+        self._stream_unchanged_count = 0
+        self._stream_poll_count = 0
+        self._polls_total = 0  # 本请求（含修复追问）发出的回复轮询次数
+        self._js_pending = deque()  # 在途回复轮询的发出时间，回调按序到达时计算 runJavaScript 往返
+        self._stage = {}  # 当前请求各阶段的起点（time.monotonic），用于 /metrics 的阶段耗时直方图
+        self._reply_stream_timer = QTimer(self)
+        self._reply_stream_timer.timeout.connect(self._poll_reply)
+        self._final_fetch_safety_timer = None  # 防止 runJavaScript 回调不触发导致该标签页永远占用
+        # 推送模式：页面内 MutationObserver 经 QWebChannel 推送回复快照，不再定时 runJavaScript；
+        # 稳定判断与总时长上限改由两个单次定时器完成（与轮询模式的 8 次 / 200 次轮询等价）
+        self._watching = False
+        self._stable_timer = QTimer(self)
+        self._stable_timer.setSingleShot(True)
+        self._stable_timer.setInterval(REPLY_POLL_MS * REPLY_STABLE_POLLS)
+        self._stable_timer.timeout.connect(self._on_push_stable)
+        self._deadline_timer = QTimer(self)
+        self._deadline_timer.setSingleShot(True)
+        self._deadline_timer.setInterval(REPLY_POLL_MS * REPLY_MAX_POLLS)
+        self._deadline_timer.timeout.connect(self._on_push_deadline)
+        # 轮询模式也只取增量：页面侧记住上次返回的文本，按序号返回追加 / 替换片段
+        self._reply_delta = DeltaReader()
+        self._reply_accepted = False  # 最近一次有变化的快照是否通过了 _accept_reply 的过滤
+        install_page_helpers(page, window)  # 注入 / 轮询 / 最终抓取都只调用常驻的 __dsBridge
+        self._signals = CompletionSignals()  # 停止按钮 / 操作栏 → 直接判定生成完成
+        # 网络流旁路：本次发送后页面发起的对话补全 SSE；有流时回复文本以流为准，DOM 只用于完成信号
+        self._sse_text = None  # None：本次请求尚无可用的流
+        self._sse_done = False
+        self.bridge = None
+        if os.environ.get("DEEPSEEK_REPLY_PUSH", "1") != "0":
+            stream_pattern = STREAM_URL_PATTERN if os.environ.get("DEEPSEEK_STREAM_TAP", "1") != "0" else ""
+            self.bridge = install_reply_observer(page, window._get_reply_script(), stream_pattern)
+            if self.bridge is not None:
+                self.bridge.reply_changed.connect(self._on_reply_pushed)
+                self.bridge.generation_changed.connect(self._on_generation_pushed)
+                self.bridge.stream_started.connect(self._on_stream_started)
+                self.bridge.stream_changed.connect(self._on_stream_text)
+                self.bridge.stream_finished.connect(self._on_stream_finished)
+
+    @property
+    def busy(self) -> bool:
+        return self.request_id is not None
+
+    def _status(self, text: str):
+        self.window.statusBar().showMessage(f"[API 标签页 {self.index}] {text}")
+
+    def _trace(self, stage, at=None):
+        """在当前请求的阶段追踪上打点（阶段定义见 request_trace.py）。"""
+        trace = getattr(self.stream_channel, "trace", None)
+        if trace is not None:
+            trace.mark(stage, at)
+
+    def start(self, request_id, message, event, channel, response_dict):
+        """接收一个 API 请求：注入消息并发送到本标签页的网页。"""
+        self.request_id = request_id
+        self.response_event = event
+        self.stream_channel = channel
+        self.response_dict = response_dict
+        now = time.monotonic()
+        if channel is not None:
+            channel.mark_started()
+            metrics.QUEUE_WAIT.observe(now - channel.created_at)
+        self._stage = {"start": now}
+        self._trace("dequeue", now)
+        self._polls_total = 0
+        self._js_pending.clear()
+        self._repair_sent = False
+        self._status("API 请求处理中…")
+        target = getattr(channel, "conversation", None)
+        if target:
+            self._open_conversation(target, message)
+        else:
+            self._send(message)
+
+    def _open_conversation(self, target, message):
+        """会话复用：先切换到要续写的对话（或新开对话），页面加载完成后再发送。"""
+        url = DEEPSEEK_HOME if target == NEW_CONVERSATION else target
+        current = self.page.url().toString()
+        if current.rstrip("/") == url.rstrip("/") or (target == NEW_CONVERSATION and "/chat/s/" not in current):
+            self._send(message)  # 已在目标对话 / 当前就是空白新对话
+            return
+        self._pending_message = message
+        self._status("切换到续写的对话…" if target != NEW_CONVERSATION else "新开对话…")
+        self.page.loadFinished.connect(self._on_conversation_loaded)
+        self.page.setUrl(QUrl(url))
+        request_id = self.request_id
+        # loadFinished 未触发时的兜底（只对本请求生效）
+        QTimer.singleShot(20000, lambda: self._on_conversation_loaded(False) if self.request_id == request_id else None)
+
+    def _on_conversation_loaded(self, ok):
+        message = self._pending_message
+        if message is None:
+            return
+        self._pending_message = None
+        try:
+            self.page.loadFinished.disconnect(self._on_conversation_loaded)
+        except TypeError:
+            pass
+        if not self.busy or self._cancelled():
+            return
+        request_id = self.request_id
+        # 等聊天页渲染出输入框再注入
+        QTimer.singleShot(1500, lambda: self._send(message) if self.request_id == request_id and not self._cancelled() else None)
+
+    def _send(self, message):
+        """把消息注入本标签页当前对话并发送（首条请求与会话内修复追问共用）。"""
+        self._stage.update(inject=time.monotonic(), first=None, changed=None, stable=None)
+        self._trace("inject", self._stage["inject"])
+        self._last_reply_text = ""
+        self._last_sent_message = message
+        self._stream_unchanged_count = 0
+        self._stream_poll_count = 0
+        self._reply_stream_timer.stop()
+        self._stop_watching()
+        self._reply_delta.reset()
+        self._reply_accepted = False
+        self._signals.reset()
+        self._sse_text = None
+        self._sse_done = False
+        # 先确认辅助库仍在（页面可能被重新加载过），再发一条很短的注入调用
+        ensure_helpers(self.page, lambda: self.page.runJavaScript(
+            bridge_call("inject", message, not self.visible), WORLD_ID, self._on_web_send_done))
+
+    def _cancelled(self) -> bool:
+        """API 侧已取消（客户端断开或 DELETE /v1/requests/{id}）时中止本次生成。"""
+        if self.busy and self.stream_channel is not None and self.stream_channel.cancelled:
+            self._abort()
+            return True
+        return False
+
+    def _abort(self):
+        """停止网页生成并释放标签页，不再等待回复稳定。"""
+        self._reply_stream_timer.stop()
+        self._stop_watching()
+        if self._final_fetch_safety_timer is not None:
+            self._final_fetch_safety_timer.stop()
+            self._final_fetch_safety_timer = None
+        self.page.runJavaScript(bridge_call("stop"), WORLD_ID)
+        self._status("API 请求已取消，已停止生成")
+        self._finish(self._last_reply_text, outcome="cancelled")
+
+    def _on_web_send_done(self, success):
+        """网页注入完成后的回调：触发发送并稍后开始轮询回复。"""
+        if not self.busy:
+            return
+        if self._cancelled():
+            return
+        now = time.monotonic()
+        metrics.INJECT.observe(now - self._stage.get("inject", now))
+        self._stage["sent"] = now
+        self._trace("sent", now)
+        if not success:
+            self._status("未能找到网页输入框，请确认已打开 DeepSeek 聊天页")
+            self._finish("", outcome="inject_failed")
+            return
+        self._status("已发送到网页，等待回复…")
+        self._last_reply_text = ""
+        self._stream_unchanged_count = 0
+        self._stream_poll_count = 0
+        if self.visible:
+            QTimer.singleShot(500, self.window._simulate_enter_key)
+        QTimer.singleShot(1500, self._start_reply_stream)
+        self.window._run_debug_probe(self.page)
+
+    def _start_reply_stream(self):
+        if not self.busy or self._cancelled():
+            return
+        self._stream_unchanged_count = 0
+        self._stream_poll_count = 0
+        self._trace("poll_start")
+        if self._sse_done:
+            self._on_reply_complete(time.monotonic(), "stream")  # 等待期间流已结束（短回复）
+            return
+        if self.bridge is not None and self.bridge.attached:
+            self._watching = True
+            self._stable_timer.start()
+            self._deadline_timer.start()
+            self.page.runJavaScript(FLUSH_SCRIPT, WORLD_ID)  # 先取一次当前快照，之后只在 DOM 变化时推送
+        else:
+            self._reply_stream_timer.start(REPLY_POLL_MS)
+
+    def _stop_watching(self):
+        self._watching = False
+        self._stable_timer.stop()
+        self._deadline_timer.stop()
+
+    def _poll_reply(self):
+        self._polls_total += 1
+        self._js_pending.append(time.monotonic())
+        self.page.runJavaScript(bridge_call("poll", self._reply_delta.seq), WORLD_ID, self._on_reply_chunk)
+
+    def _on_reply_chunk(self, result):
+        """轮询模式收到回复增量与页面状态：还原全文后推送给流式通道；判定完成后做一次最终抓取再写回 API 响应。"""
+        now = time.monotonic()
+        if self._js_pending:
+            metrics.JS_RTT.observe(now - self._js_pending.popleft())
+        if not self.busy:
+            self._reply_stream_timer.stop()
+            return
+        if self._cancelled() or not self._reply_stream_timer.isActive():
+            return  # 已取消，或已判定完成后才到达的在途轮询回调
+        self._stream_poll_count += 1
+        if self._stream_poll_count > REPLY_MAX_POLLS:
+            self._reply_stream_timer.stop()
+            metrics.TIMEOUTS.inc("poll_limit")
+            self._finish(self._last_reply_text, outcome="timeout")
+            return
+        if result is None:
+            ensure_helpers(self.page)  # 辅助库不在（页面中途重新加载），补注入后下一轮即恢复
+        result = result if isinstance(result, dict) else {}
+        changed = self._reply_delta.apply(result.get("delta"))
+        if self._sse_text is not None:
+            changed = False  # 文本以网络流为准，流有变化时 _on_stream_text 会清零计数
+        elif changed:
+            changed = self._reply_accepted = self._accept_reply(self._reply_delta.text, now)
+        elif changed is False and self._reply_accepted is None:
+            changed = None  # 页面内容未变，仍是应忽略的快照（如用户消息本身），不计入稳定
+        flags = result.get("flags") or (0, 0)
+        detector = self._signals.update(flags[0], flags[1])
+        if detector:
+            self._on_reply_complete(now, detector)
+        elif changed:
+            self._stream_unchanged_count = 0
+        elif changed is False:
+            self._stream_unchanged_count += 1
+            if self._stream_unchanged_count >= REPLY_STABLE_POLLS:
+                # 稳定后再做一次最终抓取，再写入 API 响应，避免用中间状态
+                self._on_reply_complete(now, "stability")
+
+    def _on_reply_pushed(self, reply_str):
+        """推送模式：观察脚本在 DOM 变化后送来的回复快照；有变化时重新开始稳定计时。"""
+        if not self._watching or not self.busy or self._cancelled() or self._sse_text is not None:
+            return
+        if self._accept_reply(reply_str, time.monotonic()):
+            self._stable_timer.start()
+
+    def _on_stream_started(self):
+        if self.busy and "sent" in self._stage and not self._sse_done:
+            self._sse_text = ""
+
+    def _on_stream_text(self, text):
+        """网络流旁路的正文：发送后（含开始等待回复前）即推给流式通道，并重置稳定计时。"""
+        if self._sse_text is None or not self.busy or self._cancelled():
+            return
+        self._sse_text = text
+        if self._accept_reply(text, time.monotonic()):
+            self._stream_unchanged_count = 0
+            if self._watching:
+                self._stable_timer.start()
+
+    def _on_stream_finished(self, ok):
+        """流结束即生成结束；出错或没有解析出正文时退回 DOM 抓取与页面信号。"""
+        if self._sse_text is None or not self.busy or self._cancelled():
+            return
+        if not ok:
+            self._sse_text = None
+            return
+        self._sse_done = True
+        if self._watching or self._reply_stream_timer.isActive():
+            self._on_reply_complete(time.monotonic(), "stream")
+
+    def _on_generation_pushed(self, generating, actions):
+        """推送模式的页面状态变化；开始等待回复前收到的状态也计入（完成后在首次全量推送时判定）。"""
+        if not self.busy or "sent" not in self._stage:
+            return
+        detector = self._signals.update(generating, actions)
+        if detector and self._watching and not self._cancelled():
+            self._on_reply_complete(time.monotonic(), detector)
+
+    def _on_push_stable(self):
+        if not self._watching or not self.busy or self._cancelled():
+            return
+        self._on_reply_complete(time.monotonic(), "stability")
+
+    def _on_push_deadline(self):
+        if not self._watching or not self.busy or self._cancelled():
+            return
+        self._stop_watching()
+        metrics.TIMEOUTS.inc("poll_limit")
+        self._finish(self._last_reply_text, outcome="timeout")
+
+    def _accept_reply(self, reply_str, now):
+        """过滤并记录一次回复快照：有变化时推送给流式通道并返回 True；未变化返回 False；
+        应忽略的快照（用户消息本身、DOM 短暂切换导致的突然变短）返回 None。"""
+        if reply_str is None:
+            reply_str = ""
+        if not isinstance(reply_str, str):
+            reply_str = str(reply_str) if reply_str else ""
+        reply_str = reply_str.strip()
+        if reply_str and reply_str == (self._last_sent_message or "").strip():
+            return None
+        # 防止 DOM 短暂切到其它节点导致内容突然变短（断断续续）
+        if self._last_reply_text and len(reply_str) < len(self._last_reply_text) - 100:
+            if len(reply_str) < max(100, int(len(self._last_reply_text) * 0.8)):
+                return None
+        if reply_str == self._last_reply_text:
+            return False
+        self._last_reply_text = reply_str
+        self._stage["changed"] = now
+        if reply_str and self._stage.get("first") is None:
+            self._stage["first"] = now
+            self._trace("first_content", now)
+            metrics.FIRST_CONTENT.observe(now - self._stage.get("sent", now))
+        if self.stream_channel is not None:
+            self.stream_channel.publish(reply_str)
+        return True
+
+    def _on_reply_complete(self, now, detector):
+        """判定生成完成：停止轮询 / 监听并做最终抓取。页面信号判定时立即抓取，稳定窗口兜底时多等 600ms。"""
+        self._reply_stream_timer.stop()
+        self._stop_watching()
+        metrics.COMPLETIONS.inc(detector)
+        if self.stream_channel is not None:
+            self.stream_channel.completion = detector
+        if self._stage.get("first") is not None:
+            metrics.STABILIZATION.observe(now - self._stage["first"])
+        self._stage["stable"] = now
+        if self._stage.get("changed") is not None:
+            self._trace("last_change", self._stage["changed"])
+        self._trace("stable", now)
+        # 若 runJavaScript 回调未触发，8s 后强制写回并释放标签页，避免后续请求无法执行
+        if self._final_fetch_safety_timer is not None:
+            self._final_fetch_safety_timer.stop()
+        self._final_fetch_safety_timer = QTimer(self)
+        self._final_fetch_safety_timer.setSingleShot(True)
+        self._final_fetch_safety_timer.timeout.connect(self._safety_flush_and_clear)
+        self._final_fetch_safety_timer.start(8000)
+        # 稳定窗口判定时留时间让代码块渲染完再抓；页面已给出完成信号时无需等待
+        QTimer.singleShot(600 if detector == "stability" else 0, self._final_fetch)
+
+    def _final_fetch(self):
+        """稳定后做一次最终抓取，用此次结果作为 API 的 content；网络流完整结束时直接用流的正文。"""
+        if not self.busy or self._cancelled():
+            return
+        self._trace("final_fetch")
+        if self._sse_done and self._sse_text:
+            self._on_final_fetch_done(self._sse_text)
+            return
+        self.page.runJavaScript(bridge_call("reply"), WORLD_ID, self._on_final_fetch_done)
+
+    def _safety_flush_and_clear(self):
+        """超时兜底：若最终抓取回调未触发，强制写回当前内容并释放标签页。"""
+        if self._final_fetch_safety_timer is not None:
+            self._final_fetch_safety_timer.stop()
+            self._final_fetch_safety_timer = None
+        metrics.TIMEOUTS.inc("safety_flush")
+        self._finish(self._last_reply_text, outcome="timeout")
+
+    def _on_final_fetch_done(self, reply_str):
+        """最终抓取回调"""
+        if self._final_fetch_safety_timer is not None:
+            self._final_fetch_safety_timer.stop()
+            self._final_fetch_safety_timer = None
+        self._reply_stream_timer.stop()
+        self._trace("final_done")
+        if self._stage.get("stable") is not None:
+            metrics.FINAL_FETCH.observe(time.monotonic() - self._stage["stable"])
+        final = (reply_str or "").strip() if isinstance(reply_str, str) else ""
+        if not final:
+            final = self._last_reply_text or ""
+        log.debug("API 最终回复", tab=self.index, length=len(final), preview=final[:100])
+        if self._request_repair(final):
+            return
+        self._finish(final)
+
+    def _request_repair(self, final) -> bool:
+        """response_format=json_schema 时校验回复；不符合时在同一对话中追问一次，比客户端重新请求省一次冷启动。"""
+        channel = self.stream_channel
+        if self._repair_sent or channel is None or channel.repair is None:
+            return False
+        try:
+            follow_up = channel.repair(final)
+        except Exception as e:
+            log.warning("JSON Schema 校验出错", tab=self.index, error=str(e))
+            return False
+        if not follow_up:
+            return False
+        self._repair_sent = True
+        channel.repaired = True
+        self._status("回复不符合 JSON Schema，正在同一对话中追问修复…")
+        self._send(follow_up)
+        return True
+
+    def _finish(self, final, outcome="completed"):
+        """写回结果、唤醒等待方并释放本标签页，通知调度器分配下一个请求。"""
+        if not self.busy:
+            return
+        self._stop_watching()
+        metrics.POLLS.observe(self._polls_total)
+        metrics.REPLY_SIZE.observe(len(final or ""))
+        metrics.BROWSER_REQUESTS.inc(outcome if final or outcome != "completed" else "empty")
+        if self.stream_channel is not None and final:
+            url = self.page.url().toString()
+            if "/chat/s/" in url:
+                self.stream_channel.conversation_url = url  # 供下一轮请求续写本对话
+        if self.response_dict is not None:
+            self.response_dict[self.request_id] = final or ""
+        self._trace("event_set")
+        if self.response_event:
+            self.response_event.set()
+            log.debug("API 事件已设置", request_id=self.request_id)
+        if self.stream_channel is not None:
+            self.stream_channel.close()
+        self.request_id = None
+        self.response_event = None
+        self.stream_channel = None
+        self._status("API 请求已完成")
+        self.window._on_api_worker_idle(self)
 
 
 class DeepSeekBrowser(QMainWindow):
@@ -38,14 +485,13 @@ class DeepSeekBrowser(QMainWindow):
         self._last_sent_message = ""  # 本次发送的用户内容，用于避免把用户消息当回复
         self._stream_unchanged_count = 0
         self._stream_poll_count = 0
-        self._api_request_id = None
-        self._api_response_event = None
         self._api_response_dict = None
         self._api_request_queue = None
-        self._api_final_fetch_safety_timer = None  # 防止 runJavaScript 回调不触发导致第二次请求无法取到
         self._api_poll_timer = None
+        self._api_workers = []  # ApiTabWorker 列表，第 0 个使用左侧可见浏览器页
         self.init_ui()
         self.setup_connections()
+        install_page_helpers(self.browser.page(), self)
         
     def init_ui(self):
         """初始化用户界面"""
@@ -274,6 +720,13 @@ class DeepSeekBrowser(QMainWindow):
         
         # Web浏览器视图
         self.browser = QWebEngineView()
+        # 浏览器农场模式下每个进程使用独立的 profile 目录（Chromium 不允许多进程共用同一目录）
+        profile_dir = os.environ.get("DEEPSEEK_PROFILE_DIR")
+        if profile_dir:
+            profile = QWebEngineProfile(os.path.basename(os.path.normpath(profile_dir)), self)
+            profile.setPersistentStoragePath(os.path.join(profile_dir, "storage"))
+            profile.setCachePath(os.path.join(profile_dir, "cache"))
+            self.browser.setPage(QWebEnginePage(profile, self.browser))
         self.browser.settings().setAttribute(QWebEngineSettings.WebAttribute.JavascriptEnabled, True)
         self.browser.setUrl(QUrl("https://chat.deepseek.com"))
         layout.addWidget(self.browser)
@@ -352,22 +805,13 @@ class DeepSeekBrowser(QMainWindow):
         self.browser.setUrl(QUrl(url_text))
         self.statusBar().showMessage(f"正在导航到: {url_text}")
             
-    def _escape_for_js(self, text):
-        """将文本转义后安全放入 JavaScript 单引号字符串中"""
-        if not text:
-            return ""
-        return (text.replace("\\", "\\\\")
-                    .replace("'", "\\'")
-                    .replace("\r", "\\r")
-                    .replace("\n", "\\n"))
-    
-    def _build_inject_script(self, message: str) -> str:
-        """生成将 message 注入网页并触发发送的 JS。供 UI 与 API 共用。"""
-        message_escaped = self._escape_for_js(message)
-        return f"""
-        (function() {{
-            var msg = '{message_escaped}';
-            setTimeout(function() {{
+    def _get_inject_script(self):
+        """JS 函数 function(msg, click)：将 msg 注入网页输入框并触发发送，返回是否找到输入框。
+        click 为真时在回车事件之后由页面自己调用 __dsBridge.clickSend(msg)，确认输入框已是 msg 再点发送按钮。
+        由 page_helpers 编入常驻辅助库（__dsBridge.inject），供 UI 与 API 共用。"""
+        return """
+        function(msg, click) {
+            setTimeout(function() {
             var selectors = [
                 'textarea[placeholder*="DeepSeek"]',
                 'textarea[placeholder*="发送消息"]',
@@ -381,43 +825,43 @@ class DeepSeekBrowser(QMainWindow):
                 '.ProseMirror'
             ];
             var target = null;
-            for (var i = 0; i < selectors.length; i++) {{
+            for (var i = 0; i < selectors.length; i++) {
                 var list = document.querySelectorAll(selectors[i]);
-                for (var j = 0; j < list.length; j++) {{
+                for (var j = 0; j < list.length; j++) {
                     var el = list[j];
-                    if (el.offsetWidth > 0 && el.offsetHeight > 0) {{
+                    if (el.offsetWidth > 0 && el.offsetHeight > 0) {
                         target = el;
                         break;
-                    }}
-                }}
+                    }
+                }
                 if (target) break;
-            }}
-            if (!target) {{ return false; }}
+            }
+            if (!target) { return false; }
             target.focus();
-            if (target.tagName === 'TEXTAREA' || target.tagName === 'INPUT') {{
+            if (target.tagName === 'TEXTAREA' || target.tagName === 'INPUT') {
                 var proto = target.tagName === 'TEXTAREA' ? HTMLTextAreaElement.prototype : HTMLInputElement.prototype;
                 var desc = Object.getOwnPropertyDescriptor(proto, 'value');
-                if (desc && desc.set) {{
+                if (desc && desc.set) {
                     desc.set.call(target, msg);
-                }} else {{
+                } else {
                     target.value = msg;
-                }}
-                target.dispatchEvent(new InputEvent('input', {{ data: msg, inputType: 'insertText', bubbles: true }}));
-                target.dispatchEvent(new Event('input', {{ bubbles: true }}));
-                target.dispatchEvent(new Event('change', {{ bubbles: true }}));
-            }} else if (target.contentEditable === 'true' || target.getAttribute('role') === 'textbox') {{
+                }
+                target.dispatchEvent(new InputEvent('input', { data: msg, inputType: 'insertText', bubbles: true }));
+                target.dispatchEvent(new Event('input', { bubbles: true }));
+                target.dispatchEvent(new Event('change', { bubbles: true }));
+            } else if (target.contentEditable === 'true' || target.getAttribute('role') === 'textbox') {
                 target.innerText = msg;
                 target.textContent = msg;
-                target.dispatchEvent(new InputEvent('input', {{ data: msg, inputType: 'insertText', bubbles: true }}));
-                target.dispatchEvent(new Event('input', {{ bubbles: true }}));
-            }} else {{
+                target.dispatchEvent(new InputEvent('input', { data: msg, inputType: 'insertText', bubbles: true }));
+                target.dispatchEvent(new Event('input', { bubbles: true }));
+            } else {
                 target.value = msg;
                 target.innerText = msg;
                 target.textContent = msg;
-                target.dispatchEvent(new Event('input', {{ bubbles: true }}));
-                target.dispatchEvent(new Event('change', {{ bubbles: true }}));
-            }}
-            setTimeout(function() {{
+                target.dispatchEvent(new Event('input', { bubbles: true }));
+                target.dispatchEvent(new Event('change', { bubbles: true }));
+            }
+            setTimeout(function() {
                 // 简化方案：直接模拟回车键
                 console.log('直接模拟回车键发送...');
                 
@@ -425,48 +869,52 @@ class DeepSeekBrowser(QMainWindow):
                 target.focus();
                 
                 // 延迟一小段时间确保焦点稳定
-                setTimeout(function() {{
+                setTimeout(function() {
                     // 创建完整的回车键事件序列
                     var events = [
-                        new KeyboardEvent('keydown', {{
+                        new KeyboardEvent('keydown', {
                             key: 'Enter',
                             code: 'Enter',
                             keyCode: 13,
                             which: 13,
                             bubbles: true,
                             cancelable: true
-                        }}),
-                        new KeyboardEvent('keypress', {{
+                        }),
+                        new KeyboardEvent('keypress', {
                             key: 'Enter',
                             code: 'Enter',
                             keyCode: 13,
                             which: 13,
                             bubbles: true,
                             cancelable: true
-                        }}),
-                        new KeyboardEvent('keyup', {{
+                        }),
+                        new KeyboardEvent('keyup', {
                             key: 'Enter',
                             code: 'Enter',
                             keyCode: 13,
                             which: 13,
                             bubbles: true,
                             cancelable: true
-                        }})
+                        })
                     ];
                     
                     // 依次触发所有事件
-                    events.forEach(function(event, index) {{
+                    events.forEach(function(event, index) {
                         console.log('触发事件', index + 1, ':', event.type);
                         target.dispatchEvent(event);
-                    }});
+                    });
                     
                     console.log('✅ 回车键模拟完成');
-                }}, 100);
+                    // 后台标签页：合成的回车可能被页面忽略，在同一时序上补点发送按钮（回车已生效时输入框为空，不会重复发送）
+                    if (click) {
+                        setTimeout(function() { window.__dsBridge.clickSend(msg); }, 50);
+                    }
+                }, 100);
                 
-            }}, 300);
-            }}, 150);
+            }, 300);
+            }, 150);
             return true;
-        }})();
+        }
         """
 
     def send_message(self):
@@ -483,24 +931,8 @@ class DeepSeekBrowser(QMainWindow):
         self.input_text.clear()
         self.statusBar().showMessage("正在发送到网页...")
         self._last_sent_message = message
-        self.browser.page().runJavaScript(
-            self._build_inject_script(message), self._on_web_send_done
-        )
+        self.browser.page().runJavaScript(bridge_call("inject", message), WORLD_ID, self._on_web_send_done)
 
-    def _inject_and_send(self, message: str):
-        """仅注入并发送到网页（供 API 调用，不更新右侧输入/输出）。"""
-        self.statusBar().showMessage("API 请求处理中…")
-        self._stream_history = self.output_text.toPlainText()
-        self._last_reply_text = ""
-        self._last_sent_message = message
-        self._stream_unchanged_count = 0
-        self._stream_poll_count = 0
-        if self._reply_stream_timer is not None:
-            self._reply_stream_timer.stop()
-        self.browser.page().runJavaScript(
-            self._build_inject_script(message), self._on_web_send_done
-        )
-    
     def _on_web_send_done(self, success):
         """网页注入/点击完成后的回调"""
         if success:
@@ -514,42 +946,109 @@ class DeepSeekBrowser(QMainWindow):
             QTimer.singleShot(500, self._simulate_enter_key)
             QTimer.singleShot(1500, self._start_reply_stream)
             
-            # 添加调试信息
-            debug_script = '''
-            console.log("=== 调试信息 ===");
-            console.log("页面标题:", document.title);
-            console.log("当前URL:", window.location.href);
-            console.log("页面状态:", document.readyState);
-            
-            // 检查输入框状态
-            var inputElements = document.querySelectorAll("textarea, input[type='text'], [contenteditable='true']");
-            console.log("找到输入元素数量:", inputElements.length);
-            
-            for(var i = 0; i < inputElements.length; i++) {
-                var el = inputElements[i];
-                console.log("元素" + i + ":", el.tagName, el.className, "可见:", el.offsetWidth > 0 && el.offsetHeight > 0, "值:", el.value || el.innerText);
-            }
-            
-            // 检查按钮
-            var buttons = document.querySelectorAll("button");
-            console.log("找到按钮数量:", buttons.length);
-            
-            return {
-                pageTitle: document.title,
-                pageUrl: window.location.href,
-                inputCount: inputElements.length,
-                buttonCount: buttons.length
-            };
-            '''
-            
-            def debug_callback(result):
-                print(f"调试结果: {result}")
-                
-            self.browser.page().runJavaScript(debug_script, debug_callback)
+            self._run_debug_probe(self.browser.page())
             
         else:
             self.statusBar().showMessage("未能找到网页输入框，请确认左侧已打开 DeepSeek 聊天页")
     
+    def _run_debug_probe(self, page):
+        """发送后在指定页面输出输入框 / 按钮等调试信息（仅 DEBUG 级别开启时执行）。"""
+        if not log.isEnabledFor(logging.DEBUG):
+            return
+        debug_script = '''
+        console.log("=== 调试信息 ===");
+        console.log("页面标题:", document.title);
+        console.log("当前URL:", window.location.href);
+        console.log("页面状态:", document.readyState);
+
+        // 检查输入框状态
+        var inputElements = document.querySelectorAll("textarea, input[type='text'], [contenteditable='true']");
+        console.log("找到输入元素数量:", inputElements.length);
+
+        for(var i = 0; i < inputElements.length; i++) {
+            var el = inputElements[i];
+            console.log("元素" + i + ":", el.tagName, el.className, "可见:", el.offsetWidth > 0 && el.offsetHeight > 0, "值:", el.value || el.innerText);
+        }
+
+        // 检查按钮
+        var buttons = document.querySelectorAll("button");
+        console.log("找到按钮数量:", buttons.length);
+
+        return {
+            pageTitle: document.title,
+            pageUrl: window.location.href,
+            inputCount: inputElements.length,
+            buttonCount: buttons.length
+        };
+        '''
+
+        def debug_callback(result):
+            log.debug("发送后页面探测", result=result)
+
+        page.runJavaScript(debug_script, debug_callback)
+
+    def _get_click_send_script(self):
+        """JS 函数 function(expected)：输入框内容与 expected 一致时，点击其所在区域中最后一个可用按钮（发送按钮）；
+        内容为空或不一致（尚未写入，或回车已经发出）时不点击并返回 false。供无法接收系统按键的后台标签页使用。"""
+        return """
+        function(expected) {
+            var norm = function(s) { return (s || '').replace(/\\s+/g, ' ').trim(); };
+            var input = document.querySelector('textarea') || document.querySelector('[contenteditable="true"]');
+            if (!input) return false;
+            var value = norm(input.value !== undefined ? input.value : (input.innerText || input.textContent));
+            if (!value || value !== norm(expected)) return false;
+            var scope = input;
+            for (var depth = 0; scope && depth < 6; depth++) {
+                var buttons = scope.querySelectorAll('button, [role="button"]');
+                for (var i = buttons.length - 1; i >= 0; i--) {
+                    var b = buttons[i];
+                    if (b.offsetWidth > 0 && !b.disabled && b.getAttribute('aria-disabled') !== 'true') {
+                        b.click();
+                        return true;
+                    }
+                }
+                scope = scope.parentElement;
+            }
+            return false;
+        }
+        """
+
+    def _get_stop_generation_script(self):
+        """点击“停止生成”按钮：只点能确认是停止的按钮（stop / 停止 标签，或输入区域中带停止图标的按钮），否则返回 false。"""
+        return """
+        (function() {
+            function visible(b) {
+                return b.offsetWidth > 0 && !b.disabled && b.getAttribute('aria-disabled') !== 'true';
+            }
+            var all = document.querySelectorAll('button, [role="button"]');
+            for (var i = 0; i < all.length; i++) {
+                var label = (all[i].getAttribute('aria-label') || '') + ' ' + (all[i].getAttribute('title') || '');
+                if (/stop|停止/i.test(label) && visible(all[i])) {
+                    all[i].click();
+                    return true;
+                }
+            }
+            // 无标签时按生成期间的图标识别：class / data-testid 含 stop，或图标为方块（svg rect）而非发送箭头
+            var input = document.querySelector('textarea') || document.querySelector('[contenteditable="true"]');
+            var scope = input;
+            for (var depth = 0; scope && depth < 6; depth++) {
+                var buttons = scope.querySelectorAll('button, [role="button"]');
+                for (var j = buttons.length - 1; j >= 0; j--) {
+                    var b = buttons[j];
+                    var marks = (b.getAttribute('class') || '') + ' ' + (b.getAttribute('data-testid') || '');
+                    var icon = b.querySelector('svg');
+                    var square = icon && icon.querySelector('rect') && !icon.querySelector('path');
+                    if (visible(b) && (/stop/i.test(marks) || square)) {
+                        b.click();
+                        return true;
+                    }
+                }
+                scope = scope.parentElement;
+            }
+            return false;
+        })();
+        """
+
     def _simulate_enter_key(self):
         """用 pynput 模拟按下 Enter（系统级，页面会视为真实按键）"""
         self.activateWindow()
@@ -584,6 +1083,12 @@ class DeepSeekBrowser(QMainWindow):
         # 添加实时显示指示器
         self._add_stream_indicator()
 
+    def _stop_reply_stream(self):
+        """停止回复轮询并移除实时指示器。"""
+        if self._reply_stream_timer is not None:
+            self._reply_stream_timer.stop()
+        self._remove_stream_indicator()
+
     def _add_stream_indicator(self):
         """添加实时流式显示指示器"""
         # 在状态栏添加流式指示器
@@ -732,14 +1237,13 @@ class DeepSeekBrowser(QMainWindow):
 
     def _poll_reply(self):
         """从网页抓取当前「最后一条」助手回复，避免第二次及以后取到第一条数据"""
-        self.browser.page().runJavaScript(self._get_reply_script(), self._on_reply_chunk)
+        self.browser.page().runJavaScript(bridge_call("reply"), WORLD_ID, self._on_reply_chunk)
 
     def _on_reply_chunk(self, reply_str):
-        """收到网页返回的回复片段，流式更新右侧显示；API 请求在稳定后做一次最终抓取再返回。"""
+        """收到网页返回的回复片段，流式更新右侧显示（API 请求由 ApiTabWorker 各自处理）。"""
         self._stream_poll_count += 1
         if self._stream_poll_count > 200:
             self._stop_reply_stream()
-            self._flush_api_response_if_any()
             return
         if reply_str is None:
             reply_str = ""
@@ -755,46 +1259,17 @@ class DeepSeekBrowser(QMainWindow):
         if reply_str == self._last_reply_text:
             self._stream_unchanged_count += 1
             if self._stream_unchanged_count >= 8:
-                # 稳定 8 次（约 4s）后再做一次最终抓取，再写入 API 响应，避免用中间状态
-                if self._api_request_id and self._api_response_dict is not None:
-                    self._reply_stream_timer.stop()
-                    # 若 runJavaScript 回调未触发，8s 后强制写回并清空状态，避免第二次请求永远不执行
-                    if self._api_final_fetch_safety_timer is not None:
-                        self._api_final_fetch_safety_timer.stop()
-                    self._api_final_fetch_safety_timer = QTimer(self)
-                    self._api_final_fetch_safety_timer.setSingleShot(True)
-                    self._api_final_fetch_safety_timer.timeout.connect(self._api_safety_flush_and_clear)
-                    self._api_final_fetch_safety_timer.start(8000)
-                    QTimer.singleShot(600, self._final_fetch_for_api)  # 留时间让代码块渲染完再抓
-                else:
-                    self._stop_reply_stream()
-                    if reply_str:
-                        self._stream_history = self.output_text.toPlainText() + "\n\n"
-                return
+                self._stop_reply_stream()
+                if reply_str:
+                    self._stream_history = self.output_text.toPlainText() + "\n\n"
             return
         self._stream_unchanged_count = 0
         self._last_reply_text = reply_str
-        if self._api_request_id is None:
-            display = self._stream_history + "DeepSeek: " + reply_str
-            self.output_text.setPlainText(display)
-            self.output_text.verticalScrollBar().setValue(
-                self.output_text.verticalScrollBar().maximum()
-            )
-
-    def _flush_api_response_if_any(self):
-        """超时或停止时，若有未完成的 API 请求则用当前 _last_reply_text 写回并 set event。"""
-        if not self._api_request_id or self._api_response_dict is None:
-            return
-        self._api_response_dict[self._api_request_id] = self._last_reply_text or ""
-        if self._api_response_event:
-            self._api_response_event.set()
-        self._api_request_id = None
-        self._api_response_event = None
-        self.statusBar().showMessage("API 请求已完成")
-
-    def _final_fetch_for_api(self):
-        """稳定后做一次最终抓取，用此次结果作为 API 的 content，再停止轮询并写回。"""
-        self.browser.page().runJavaScript(self._get_reply_script(), self._on_final_fetch_done)
+        display = self._stream_history + "DeepSeek: " + reply_str
+        self.output_text.setPlainText(display)
+        self.output_text.verticalScrollBar().setValue(
+            self.output_text.verticalScrollBar().maximum()
+        )
 
     def _get_reply_script(self):
         """从页面抓取最后一条助手回复（含代码块），优先取整条消息根节点再提取全文。"""
@@ -926,76 +1401,45 @@ class DeepSeekBrowser(QMainWindow):
         })();
         """
 
-    def _api_safety_flush_and_clear(self):
-        """超时兜底：若最终抓取回调未触发，强制写回当前内容并清空状态，以便下一次 API 请求能执行。"""
-        if self._api_final_fetch_safety_timer is not None:
-            self._api_final_fetch_safety_timer.stop()
-            self._api_final_fetch_safety_timer = None
-        self._flush_api_response_if_any()
-
-    def _on_final_fetch_done(self, reply_str):
-        """最终抓取回调：增强错误处理和重试机制"""
-        try:
-            # 停止安全定时器
-            if self._api_final_fetch_safety_timer is not None:
-                self._api_final_fetch_safety_timer.stop()
-                self._api_final_fetch_safety_timer = None
-                
-            # 停止回复流
-            self._stop_reply_stream()
-            
-            # 处理回复内容
-            final = (reply_str or "").strip() if isinstance(reply_str, str) else ""
-            if not final:
-                final = self._last_reply_text or ""
-                
-            # 记录调试信息
-            print(f"DEBUG: API最终回复 - 长度: {len(final)}, 内容预览: {final[:100]}")
-            
-            # 确保API响应字典存在
-            if self._api_request_id and self._api_response_dict is not None:
-                self._api_response_dict[self._api_request_id] = final
-                if self._api_response_event:
-                    self._api_response_event.set()
-                    print(f"DEBUG: API事件已设置，请求ID: {self._api_request_id}")
-                self._api_request_id = None
-                self._api_response_event = None
-            else:
-                print("DEBUG: API响应状态异常")
-                # 兜底处理
-                self._flush_api_response_if_any()
-                
-            self.statusBar().showMessage("API 请求已完成")
-            
-        except Exception as e:
-            print(f"DEBUG: 回调处理异常: {e}")
-            # 兜底处理
-            self._api_safety_flush_and_clear()
-
-    def set_api_queues(self, request_queue: Queue, response_dict: dict):
+    def set_api_queues(self, request_queue, response_dict: dict):
         """设置 API 请求队列与响应字典（由 main 在启动 API 服务后调用）。"""
         self._api_request_queue = request_queue
         self._api_response_dict = response_dict  # 与 api_server 共用，主线程写入回复
 
-    def start_api_polling(self):
-        """开始轮询 API 请求队列（需先 set_api_queues）。"""
+    def start_api_polling(self, tab_count: int = 1):
+        """创建 API 工作标签页并开始轮询 API 请求队列（需先 set_api_queues）。
+
+        第 0 个标签页复用左侧可见浏览器页；其余为共用同一 profile 的后台 QWebEnginePage。
+        """
         if self._api_request_queue is None or self._api_poll_timer is not None:
             return
+        self._api_workers = [ApiTabWorker(self, self.browser.page(), 0, visible=True)]
+        profile = self.browser.page().profile()
+        for index in range(1, max(1, tab_count)):
+            page = QWebEnginePage(profile, self)
+            page.settings().setAttribute(QWebEngineSettings.WebAttribute.JavascriptEnabled, True)
+            self._api_workers.append(ApiTabWorker(self, page, index, visible=False))  # 先装好回复观察脚本再加载
+            page.setUrl(QUrl("https://chat.deepseek.com"))
         self._api_poll_timer = QTimer(self)
         self._api_poll_timer.timeout.connect(self._poll_api_request)
         self._api_poll_timer.start(500)
 
     def _poll_api_request(self):
-        """从队列取 API 请求并在主线程执行注入与发送。"""
-        if self._api_request_queue is None or self._api_request_id is not None:
+        """调度器：从队列取 API 请求，分配给空闲的工作标签页，在主线程执行注入与发送。"""
+        if self._api_request_queue is None:
             return
-        try:
-            request_id, message, event = self._api_request_queue.get_nowait()
-        except Exception:
-            return
-        self._api_request_id = request_id
-        self._api_response_event = event
-        self._inject_and_send(message)
+        for worker in self._api_workers:
+            if worker.busy:
+                continue
+            try:
+                request_id, message, event, channel = self._api_request_queue.get_nowait()
+            except Exception:
+                return
+            worker.start(request_id, message, event, channel, self._api_response_dict)
+
+    def _on_api_worker_idle(self, worker: ApiTabWorker):
+        """某个标签页完成请求后立即调度下一个，不必等到下一次定时轮询。"""
+        QTimer.singleShot(0, self._poll_api_request)
 
     def clear_output(self):
         """清空输出框"""
@@ -1093,6 +1537,7 @@ class DeepSeekBrowser(QMainWindow):
 
 def main():
     """主函数"""
+    setup_logging()
     app = QApplication(sys.argv)
     app.setApplicationName("DeepSeek Qt浏览器")
     app.setStyle("Fusion")
@@ -1100,14 +1545,17 @@ def main():
     window = DeepSeekBrowser()
     if _HAS_API_SERVER:
         try:
-            request_queue = Queue()
+            # 按租户加权公平调度，权重可用 DEEPSEEK_CLIENT_WEIGHTS="cline=4,batch=1" 配置；
+            # 租户名只能经 DEEPSEEK_CLIENT_KEYS 的 API Key 获得（见 request_scheduler.ClientPolicy）
+            request_queue = FairScheduler(FairScheduler.parse_weights(os.environ.get("DEEPSEEK_CLIENT_WEIGHTS", "")))
             response_dict = {}
             port = int(os.environ.get("DEEPSEEK_API_PORT", "8765"))
+            tab_count = int(os.environ.get("DEEPSEEK_API_TABS", "1"))
             start_api_server(request_queue, response_dict, port=port)
             window.set_api_queues(request_queue, response_dict)
-            window.start_api_polling()
+            window.start_api_polling(tab_count)
             window.statusBar().showMessage(
-                f"就绪 - 已加载 DeepSeek 官网 | Ollama 兼容 API: http://127.0.0.1:{port}/ (无 API Key)"
+                f"就绪 - 已加载 DeepSeek 官网 | Ollama 兼容 API: http://127.0.0.1:{port}/ (无 API Key，{tab_count} 个工作标签页)"
             )
         except Exception as e:
             window.statusBar().showMessage(f"就绪 - API 未启动: {e}")
@@ -5,6 +5,8 @@ DeepSeek Qt浏览器 - 真实交互版
 """
 
 import sys
+import os
+import logging
 import time
 import random
 from datetime import datetime
@@ -17,6 +19,11 @@ from PyQt6.QtWidgets import (
 from PyQt6.QtWebEngineWidgets import QWebEngineView
 from PyQt6.QtWebEngineCore import QWebEngineSettings, QWebEnginePage
 from PyQt6.QtGui import QFont, QColor, QTextCharFormat, QTextCursor, QPalette
+from structured_log import get_logger, rate_limit, setup_logging
+
+# 网页脚本可能在循环里 console.log，限流后再交给后台日志线程，不在 GUI 线程同步写 stdout
+_JS_LOG = rate_limit(get_logger("js"), per_second=float(os.environ.get("DEEPSEEK_JS_LOG_RATE", "5")))
+_JS_LEVELS = {0: logging.INFO, 1: logging.WARNING, 2: logging.ERROR}  # QWebEnginePage 控制台级别 → logging 级别
 
 
 class WebPage(QWebEnginePage):
@@ -27,7 +34,7 @@ class WebPage(QWebEnginePage):
         
     def javaScriptConsoleMessage(self, level, message, line_number, source_id):
         """处理JavaScript控制台消息"""
-        print(f"JS [{level}]: {message} (line {line_number})")
+        _JS_LOG.log(_JS_LEVELS.get(getattr(level, "value", level), logging.INFO), message, line=line_number, source=source_id)
 
 
 class RealInteractionDeepSeekBrowser(QMainWindow):
@@ -1276,6 +1283,7 @@ class RealInteractionDeepSeekBrowser(QMainWindow):
 
 def main():
     """主函数"""
+    setup_logging()
     app = QApplication(sys.argv)
     app.setApplicationName("DeepSeek Qt浏览器 - 真实交互版")
     
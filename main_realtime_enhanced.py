@@ -17,6 +17,7 @@ from PyQt6.QtWebEngineCore import QWebEnginePage, QWebEngineSettings
 from PyQt6.QtGui import QFont, QIcon, QColor, QTextCharFormat
 from datetime import datetime
 import re
+from reply_observer import FLUSH_SCRIPT, WORLD_ID, install_reply_observer
 
 class EnhancedDeepSeekBrowser(QMainWindow):
     """增强版DeepSeek浏览器，支持实时代码显示"""
@@ -40,6 +41,12 @@ class EnhancedDeepSeekBrowser(QMainWindow):
         self._last_code_block = ""
         self._code_blocks_found = []
         self._realtime_mode = True  # 实时模式开关
+
+        # 推送模式：页面内 MutationObserver 经 QWebChannel 送来回复，代替 100ms 轮询
+        self._reply_bridge = None
+        self._watching = False
+        self._push_stable_timer = None
+        self._push_deadline_timer = None
         
         self.init_ui()
         self.setup_connections()
@@ -125,6 +132,11 @@ class EnhancedDeepSeekBrowser(QMainWindow):
         # Web浏览器
         self.browser = QWebEngineView()
         self.browser.settings().setAttribute(QWebEngineSettings.WebAttribute.JavascriptEnabled, True)
+        # 先装回复观察脚本再加载页面（不支持 QWebChannel 时为 None，退回轮询）；
+        # 这里只用 DOM 推送，不装网络流旁路（stream_pattern 为空），不改写页面的 fetch
+        self._reply_bridge = install_reply_observer(self.browser.page(), self._get_content_script(), stream_pattern="")
+        if self._reply_bridge is not None:
+            self._reply_bridge.reply_changed.connect(self._on_content_pushed)
         self.browser.setUrl(QUrl("https://chat.deepseek.com"))
         layout.addWidget(self.browser)
         
@@ -322,12 +334,26 @@ class EnhancedDeepSeekBrowser(QMainWindow):
         self._current_displayed_text = ""
         self._code_blocks_found = []
         
-        if self._reply_stream_timer is None:
-            self._reply_stream_timer = QTimer(self)
-            self._reply_stream_timer.timeout.connect(self._poll_reply_content)
-            
-        # 高频轮询实现实时效果（100ms）
-        self._reply_stream_timer.start(100)
+        if self._reply_bridge is not None and self._reply_bridge.attached:
+            # 内容变化时由页面推送；2 秒无变化视为完成、最长 100 秒（与轮询模式的 20 次 / 1000 次 × 100ms 相同）
+            if self._push_stable_timer is None:
+                self._push_stable_timer = QTimer(self)
+                self._push_stable_timer.setSingleShot(True)
+                self._push_stable_timer.timeout.connect(self._stop_realtime_stream)
+                self._push_deadline_timer = QTimer(self)
+                self._push_deadline_timer.setSingleShot(True)
+                self._push_deadline_timer.timeout.connect(self._stop_realtime_stream)
+            self._watching = True
+            self._push_stable_timer.start(2000)
+            self._push_deadline_timer.start(100000)
+            self.browser.page().runJavaScript(FLUSH_SCRIPT, WORLD_ID)
+        else:
+            if self._reply_stream_timer is None:
+                self._reply_stream_timer = QTimer(self)
+                self._reply_stream_timer.timeout.connect(self._poll_reply_content)
+
+            # 高频轮询实现实时效果（100ms）
+            self._reply_stream_timer.start(100)
         self.statusBar().showMessage("🟡 正在实时接收回复...")
         
     def _poll_reply_content(self):
@@ -342,6 +368,15 @@ class EnhancedDeepSeekBrowser(QMainWindow):
         # 获取当前网页内容
         self.browser.page().runJavaScript(self._get_content_script(), self._on_content_received)
         
+    def _on_content_pushed(self, content):
+        """推送模式下页面送来的回复；内容有变化时重新开始稳定计时。"""
+        if not self._watching:
+            return
+        previous = self._last_reply_text
+        self._on_content_received(content)
+        if self._watching and self._last_reply_text != previous:
+            self._push_stable_timer.start(2000)
+
     def _on_content_received(self, content):
         """接收到内容的回调"""
         if not content or not isinstance(content, str):
@@ -466,6 +501,10 @@ class EnhancedDeepSeekBrowser(QMainWindow):
         """停止实时流"""
         if self._reply_stream_timer:
             self._reply_stream_timer.stop()
+        self._watching = False
+        if self._push_stable_timer is not None:
+            self._push_stable_timer.stop()
+            self._push_deadline_timer.stop()
         self.statusBar().showMessage("✅ 回复接收完成")
         
     def _build_inject_script(self, message):
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Prometheus 文本格式的指标：进程内注册表 + 计数器 / 直方图 / 回调仪表。
+
+Qt 主线程（ApiTabWorker 的请求生命周期）与 API 事件循环线程都会写入，所有指标各自加锁；
+GET /metrics 时由 render() 输出 text/plain; version=0.0.4 格式，无需额外依赖。
+"""
+
+import threading
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 秒级阶段耗时（网页生成可达数分钟）
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 180, 300)
+# runJavaScript 往返
+RTT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+COUNT_BUCKETS = (1, 5, 10, 20, 50, 100, 150, 200, 400)
+SIZE_BUCKETS = (0, 100, 500, 1000, 5000, 10000, 50000, 100000, 500000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.label_names:
+            items = [((), 0)]
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {_num(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=STAGE_BUCKETS, labels=()):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}  # label_values -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines = self.header()
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="' + _num(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_num(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+
+class Gauge(_Metric):
+    """取值由回调在 render 时给出：返回数值，或 {标签值元组: 数值}。"""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn, labels=(), kind="gauge"):
+        super().__init__(name, help_text, labels)
+        self.fn = fn
+        self.kind = kind  # 回调读取外部累计值时可声明为 counter
+
+    def render(self):
+        value = self.fn()
+        items = sorted(value.items()) if isinstance(value, dict) else [((), value)]
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {_num(v)}" for k, v in items]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        """同名指标只注册一次（重复创建 app 时回调仪表以最后一次为准）。"""
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None and not isinstance(metric, Gauge):
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help_text, labels=()):
+    return REGISTRY.register(Counter(name, help_text, labels))
+
+
+def histogram(name, help_text, buckets=STAGE_BUCKETS, labels=()):
+    return REGISTRY.register(Histogram(name, help_text, buckets, labels))
+
+
+def gauge(name, help_text, fn, labels=(), kind="gauge"):
+    return REGISTRY.register(Gauge(name, help_text, fn, labels, kind))
+
+
+# 浏览器侧请求生命周期（ApiTabWorker 写入）
+QUEUE_WAIT = histogram("deepseek_queue_wait_seconds", "Time from dispatch to a browser tab picking the request up")
+INJECT = histogram("deepseek_inject_seconds", "Time to inject the prompt into the page (runJavaScript callback)")
+FIRST_CONTENT = histogram("deepseek_first_content_seconds", "Time from send to the first non-empty reply snapshot")
+STABILIZATION = histogram("deepseek_stabilization_seconds", "Time from first content until the reply is judged stable")
+FINAL_FETCH = histogram("deepseek_final_fetch_seconds", "Time from stability to the final fetch completing")
+JS_RTT = histogram("deepseek_runjavascript_seconds", "runJavaScript round-trip time of reply polls", RTT_BUCKETS)
+POLLS = histogram("deepseek_polls_per_request", "Reply polls issued per request", COUNT_BUCKETS)
+REPLY_SIZE = histogram("deepseek_reply_chars", "Final reply size in characters", SIZE_BUCKETS)
+TIMEOUTS = counter("deepseek_timeouts_total", "Timeouts and fallbacks by kind", ("kind",))
+COMPLETIONS = counter("deepseek_completion_detector_total", "Which detector declared the reply complete",
+                      ("detector",))
+BROWSER_REQUESTS = counter("deepseek_browser_requests_total", "Browser executions by outcome", ("outcome",))
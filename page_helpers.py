@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+常驻页面的辅助脚本库：回复抓取、增量轮询、注入发送、点击发送 / 停止生成等函数以 QWebEngineScript
+（DocumentCreation、ApplicationWorld）注册一次，页面每次加载都会自动获得 window.__dsBridge。
+热路径上的 runJavaScript 只传 bridge_call("poll", 3) 这样的短调用，页面不必每 200ms 重新解析、编译数 KB 的源码。
+
+库带版本号（源码摘要）。新注册的 DocumentCreation 脚本不会作用于已加载的文档，所以安装时，以及页面
+每次加载完成后，都由 ensure_helpers 检查一次：库缺失或版本不符时补注入。
+"""
+
+import hashlib
+import json
+
+from PyQt6.QtWebEngineCore import QWebEngineScript
+
+from reply_observer import DELTA_LIB, WORLD_ID
+from structured_log import get_logger
+
+log = get_logger("page_helpers")
+
+SCRIPT_NAME = "deepseek-helpers"
+VERSION_PROBE = "window.__dsBridge ? window.__dsBridge.version : ''"
+
+_LIBRARY = """
+(function() {
+    var VERSION = __VERSION__;
+    if (window.__dsBridge && window.__dsBridge.version === VERSION) return;
+""" + DELTA_LIB + """
+    var pollState = {seq: 0, text: ''};
+    function reply() { return __REPLY__; }
+    function stop() { return __STOP__; }
+    window.__dsBridge = {
+        version: VERSION,
+        reply: function() {
+            try { return reply() || ''; } catch (e) { return ''; }
+        },
+        // 增量轮询：known 为 Python 侧已应用到的序号（见 reply_observer.DeltaReader）
+        poll: function(known) {
+            return {delta: __dsDelta(pollState, this.reply(), known), flags: __dsGenFlags()};
+        },
+        inject: __INJECT__,
+        clickSend: __CLICK_SEND__,
+        stop: stop
+    };
+})();
+"""
+
+_source = None
+_version = None
+
+
+def _expression(script: str) -> str:
+    return script.strip().rstrip(";")
+
+
+def library_source(window):
+    """由 DeepSeekBrowser 的各个页面脚本拼出辅助库；返回 (源码, 版本号)，进程内只构建一次。"""
+    global _source, _version
+    if _source is None:
+        source = (_LIBRARY
+                  .replace("__REPLY__", _expression(window._get_reply_script()))
+                  .replace("__CLICK_SEND__", window._get_click_send_script().strip())
+                  .replace("__STOP__", _expression(window._get_stop_generation_script()))
+                  .replace("__INJECT__", window._get_inject_script().strip()))
+        _version = hashlib.sha1(source.encode("utf-8")).hexdigest()[:12]
+        _source = source.replace("__VERSION__", json.dumps(_version))
+    return _source, _version
+
+
+def bridge_call(name: str, *args) -> str:
+    """调用辅助库函数的脚本（在 WORLD_ID 中执行）；库不存在时结果为 null。"""
+    arguments = ", ".join(json.dumps(arg, ensure_ascii=False) for arg in args)
+    return f"window.__dsBridge ? window.__dsBridge.{name}({arguments}) : null"
+
+
+def ensure_helpers(page, then=None):
+    """检查当前文档中的辅助库，缺失或版本不符时补注入；then 在库可用后调用（与后续 runJavaScript 同序）。"""
+    source, version = _source, _version
+    if source is None:
+        if then is not None:
+            then()
+        return
+
+    def checked(current):
+        if current != version:
+            log.info("页面辅助库缺失或版本不符，重新注入", found=current or None, version=version)
+            page.runJavaScript(source, WORLD_ID)
+        if then is not None:
+            then()
+
+    page.runJavaScript(VERSION_PROBE, WORLD_ID, checked)
+
+
+def install_page_helpers(page, window):
+    """在 page 上注册辅助库（同一页面只注册一次），并检查当前已加载的文档；返回版本号。"""
+    source, version = library_source(window)
+    if not page.scripts().find(SCRIPT_NAME):
+        script = QWebEngineScript()
+        script.setName(SCRIPT_NAME)
+        script.setSourceCode(source)
+        script.setInjectionPoint(QWebEngineScript.InjectionPoint.DocumentCreation)
+        script.setWorldId(WORLD_ID)
+        script.setRunsOnSubFrames(False)
+        page.scripts().insert(script)
+        # 重新加载后的启动检查：正常情况下 DocumentCreation 已注入，这里只是一次很短的版本探测
+        page.loadFinished.connect(lambda ok: ensure_helpers(page) if ok else None)
+        ensure_helpers(page)
+    return version
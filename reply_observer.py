@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+事件驱动的回复捕获：页面中常驻一个 MutationObserver 监听助手消息所在的容器，DOM 变化合并到
+下一个动画帧再提取最后一条助手回复，内容有变化才经 QWebChannel 推送给 Python。
+页面空闲时既没有 runJavaScript 轮询也没有 JS 定时器。
+
+推送与轮询（page_helpers 的 __dsBridge.poll）都只传增量：页面侧保存上次发出的文本与序号，返回 [seq]
+（未变化）或 [seq, offset, text]（新文本 = 旧文本[:offset] + text，追加时 offset 即旧长度）；
+Python 侧 DeltaReader（reply_protocol）按序号应用，序号对不上（页面重载、丢失更新）时要求页面重发全文。
+
+同时上报页面级的生成状态 [generating, actions]：是否有可见的“停止生成”按钮、最后一条助手消息
+是否已出现操作栏（复制 / 重新生成），供调用方直接判断生成完成，不必等回复文本稳定。
+
+网络流旁路：文档创建时在页面自身的 MainWorld 注入一段脚本包装 window.fetch，对话补全接口的响应
+clone() 一份读取原始 SSE 字节，经 window.postMessage 转给 ApplicationWorld 中的观察脚本再走 QWebChannel；
+SseReader（reply_protocol）按事件还原正文 token 与结束信号。拿到流时以流为准（保留代码块语言等 DOM 丢失的信息），
+流缺失、出错或解析不出正文时仍以 DOM 抓取为准。
+
+脚本与 QWebChannel 放在 ApplicationWorld（与页面自身脚本隔离，DOM 共享），以 QWebEngineScript 在每次
+文档就绪时注入；安装时对已加载的文档立即执行一次。未安装 QtWebChannel、或页面尚未连上通道时
+（ReplyBridge.attached 为 False）调用方退回定时轮询。
+"""
+
+import json
+
+from PyQt6.QtCore import QFile, QIODevice, QObject, pyqtSignal, pyqtSlot
+from PyQt6.QtWebEngineCore import QWebEngineScript
+
+from reply_protocol import DeltaReader, SseReader
+
+try:
+    from PyQt6.QtWebChannel import QWebChannel
+    HAS_WEBCHANNEL = True
+except ImportError:
+    HAS_WEBCHANNEL = False
+
+WORLD_ID = QWebEngineScript.ScriptWorldId.ApplicationWorld.value
+
+# 对话补全接口（SSE）的 URL 匹配（JS 正则）
+STREAM_URL_PATTERN = r"/chat/completion"
+
+# 立即推送一次当前回复全文（开始等待回复、或增量序号对不上需要重新同步时调用）
+FLUSH_SCRIPT = "window.__dsReplyObserver && window.__dsReplyObserver.flush(true);"
+
+# 增量协议（页面侧）：state = {seq, text}；known 为 Python 侧已应用到的序号，不一致时发全文
+DELTA_LIB = """
+function __dsOffset(old, text) {
+    if (text.length >= old.length && text.lastIndexOf(old, 0) === 0) return old.length;
+    var n = Math.min(old.length, text.length), i = 0, B = 1024;
+    while (i + B <= n && old.substr(i, B) === text.substr(i, B)) i += B;
+    while (i < n && old.charCodeAt(i) === text.charCodeAt(i)) i++;
+    return i;
+}
+var __DS_ROOTS = '[data-message-type="assistant"], [class*="assistant"][class*="message"], [class*="message"][class*="assistant"]';
+function __dsLastRoot() {
+    var roots = document.querySelectorAll(__DS_ROOTS);
+    return roots.length ? roots[roots.length - 1] : null;
+}
+function __dsGenFlags() {
+    var generating = false, actions = false;
+    var all = document.querySelectorAll('button, [role="button"]');
+    for (var i = 0; i < all.length && !generating; i++) {
+        var label = (all[i].getAttribute('aria-label') || '') + ' ' + (all[i].getAttribute('title') || '');
+        generating = /stop|停止/i.test(label) && all[i].offsetWidth > 0;
+    }
+    // 操作栏：最后一条助手消息内部或其后（同一父节点下）的复制 / 重新生成按钮
+    var last = __dsLastRoot();
+    if (last) {
+        var items = (last.parentElement || last).querySelectorAll('button, [role="button"], [class*="copy"]');
+        for (var j = items.length - 1; j >= 0 && !actions; j--) {
+            var el = items[j];
+            if (!last.contains(el) && !(last.compareDocumentPosition(el) & Node.DOCUMENT_POSITION_FOLLOWING)) break;
+            var text = (el.getAttribute('aria-label') || '') + ' ' + (el.getAttribute('title') || '') + ' ' + (el.getAttribute('class') || '');
+            actions = /copy|复制|regenerat|重新生成|重试|retry/i.test(text) && el.offsetWidth > 0;
+        }
+    }
+    return [generating ? 1 : 0, actions ? 1 : 0];
+}
+function __dsDelta(state, text, known) {
+    if (known !== state.seq) {
+        if (text !== state.text) { state.seq++; state.text = text; }
+        return [state.seq, 0, text];
+    }
+    if (text === state.text) return [state.seq];
+    var offset = __dsOffset(state.text, text);
+    state.seq++;
+    state.text = text;
+    return [state.seq, offset, text.substring(offset)];
+}
+"""
+
+_OBSERVER_SCRIPT = """
+(function() {
+    if (window.__dsReplyObserver || typeof QWebChannel === 'undefined'
+        || typeof qt === 'undefined' || !qt.webChannelTransport) return;
+    var state = window.__dsReplyObserver = {bridge: null, target: null, input: null, seq: 0, text: '', flags: '', scheduled: false};
+    function extract() { return __EXTRACT__; }
+    function container() {
+        var last = __dsLastRoot();
+        return (last && last.parentElement) || document.querySelector('main') || document.body;
+    }
+    function inputArea() {
+        // 发送 / 停止按钮所在区域：输入框往上几层
+        var el = document.querySelector('textarea') || document.querySelector('[contenteditable="true"]');
+        for (var depth = 0; el && el.parentElement && depth < 4; depth++) el = el.parentElement;
+        return el;
+    }
+    function observe() {
+        var target = container();
+        if (target && target !== state.target) {
+            state.target = target;
+            state.observer.disconnect();
+            state.observer.observe(target, {childList: true, subtree: true, characterData: true});
+        }
+        var input = inputArea();
+        if (input && input !== state.input) {
+            state.input = input;
+            state.buttons.disconnect();
+            state.buttons.observe(input, {childList: true, subtree: true, attributes: true,
+                                          attributeFilter: ['aria-label', 'title', 'class', 'disabled', 'aria-disabled']});
+        }
+    }
+    function flush(force) {
+        state.scheduled = false;
+        if (!state.bridge) return;
+        // 还没有助手消息时先监听整个 main，出现后收窄到消息容器；容器被替换（切换对话）时重新定位
+        if (force || !state.target || !state.target.isConnected || !state.input || !state.input.isConnected
+            || state.target === document.body || state.target.tagName === 'MAIN') observe();
+        var text = '';
+        try { text = extract() || ''; } catch (e) {}
+        var d = __dsDelta(state, text, force ? -1 : state.seq);
+        if (d.length > 1) state.bridge.push(d[0], d[1], d[2]);
+        var flags = __dsGenFlags();
+        if (force || flags.join() !== state.flags) {
+            state.flags = flags.join();
+            state.bridge.signal(flags[0], flags[1]);
+        }
+    }
+    function schedule() {
+        if (state.scheduled) return;
+        state.scheduled = true;
+        // 可见页面在下一帧送达；后台标签页不渲染、rAF 不触发，由定时器兜底
+        var done = false;
+        var run = function() { if (!done) { done = true; flush(false); } };
+        requestAnimationFrame(run);
+        setTimeout(run, 100);
+    }
+    state.flush = flush;
+    // MainWorld 的网络旁路经 postMessage 送来的 SSE 片段（跨 world 只共享 DOM 与消息事件）
+    window.addEventListener('message', function(e) {
+        var d = e.data;
+        if (e.source !== window || !d || typeof d.__dsStream !== 'number' || !state.bridge) return;
+        state.bridge.stream(d.__dsStream, String(d.kind), String(d.data || ''));
+    });
+    state.observer = new MutationObserver(schedule);
+    state.buttons = new MutationObserver(schedule);
+    new QWebChannel(qt.webChannelTransport, function(channel) {
+        state.bridge = channel.objects.replyBridge;
+        observe();
+        state.bridge.ready();
+    });
+})();
+"""
+
+# MainWorld、DocumentCreation：在页面脚本之前包装 fetch；响应原样返回页面，另读 clone() 的副本
+_STREAM_TAP_SCRIPT = """
+(function() {
+    if (window.__dsStreamTap || typeof window.fetch !== 'function' || typeof TextDecoder === 'undefined') return;
+    window.__dsStreamTap = true;
+    var pattern = new RegExp(__PATTERN__), nativeFetch = window.fetch, next = 0;
+    function post(id, kind, data) { window.postMessage({__dsStream: id, kind: kind, data: data}, '*'); }
+    function tap(res) {
+        var copy = res.clone(), id = ++next, reader = copy.body.getReader(), decoder = new TextDecoder();
+        post(id, 'start', res.url || '');
+        (function pump() {
+            reader.read().then(function(r) {
+                if (r.done) {
+                    var tail = decoder.decode();
+                    if (tail) post(id, 'chunk', tail);
+                    post(id, 'end', '');
+                    return;
+                }
+                post(id, 'chunk', decoder.decode(r.value, {stream: true}));
+                pump();
+            }, function(e) { post(id, 'error', String(e)); });
+        })();
+    }
+    window.fetch = function(input) {
+        var promise = nativeFetch.apply(this, arguments);
+        var url = typeof input === 'string' ? input : (input && input.url) || String(input);
+        if (!pattern.test(url)) return promise;
+        return promise.then(function(res) {
+            try { if (res.ok && res.body) tap(res); } catch (e) {}
+            return res;
+        });
+    };
+})();
+"""
+
+_webchannel_js = None
+
+
+def _load_webchannel_js() -> str:
+    """Qt 资源中的 qwebchannel.js（页面侧 QWebChannel 客户端）。"""
+    global _webchannel_js
+    if _webchannel_js is None:
+        f = QFile(":/qtwebchannel/qwebchannel.js")
+        if f.open(QIODevice.OpenModeFlag.ReadOnly):
+            _webchannel_js = bytes(f.readAll()).decode("utf-8")
+            f.close()
+        else:
+            _webchannel_js = ""
+    return _webchannel_js
+
+
+class CompletionSignals:
+    """按页面级信号判断生成完成：停止按钮出现过又消失（stop_button），或最后一条消息的操作栏
+    在本次请求中先没有、后出现（action_bar）。都未发生时返回 None，由调用方的稳定窗口兜底。"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.saw_generating = False
+        self.saw_no_actions = False
+
+    def update(self, generating, actions):
+        if generating:
+            self.saw_generating = True
+            return None
+        if self.saw_generating:
+            return "stop_button"
+        if not actions:
+            self.saw_no_actions = True
+            return None
+        return "action_bar" if self.saw_no_actions else None
+
+
+class ReplyBridge(QObject):
+    """页面经 QWebChannel 调用的对象：push(seq, offset, text) 增量还原为全文后发出 reply_changed（Qt 主线程）。"""
+
+    reply_changed = pyqtSignal(str)
+    generation_changed = pyqtSignal(bool, bool)  # (有停止按钮, 最后一条消息已出现操作栏)
+    stream_started = pyqtSignal()  # 页面发起了一次对话补全请求
+    stream_changed = pyqtSignal(str)  # SSE 累积的正文
+    stream_finished = pyqtSignal(bool)  # 流结束；False 表示出错或未解析出正文，应以 DOM 抓取为准
+
+    def __init__(self, page):
+        super().__init__(page)
+        self.page = page
+        self.attached = False  # 当前文档的观察脚本已连上通道
+        self.reader = DeltaReader()
+        self.sse = None
+        self._stream_id = None  # 正在读取的流；结束（或已上报结束信号）后为 None
+
+    @pyqtSlot()
+    def ready(self):
+        self.attached = True
+        self.reader.reset()
+        self._stream_id = None
+
+    @pyqtSlot(int, int, str)
+    def push(self, seq, offset, text):
+        if self.reader.apply([seq, offset, text]) is None:
+            self.page.runJavaScript(FLUSH_SCRIPT, WORLD_ID)  # 丢失了中间的增量：请求全文
+            return
+        self.reply_changed.emit(self.reader.text)
+
+    @pyqtSlot(int, int)
+    def signal(self, generating, actions):
+        self.generation_changed.emit(bool(generating), bool(actions))
+
+    @pyqtSlot(int, str, str)
+    def stream(self, stream_id, kind, data):
+        if kind == "start":
+            self._stream_id = stream_id
+            self.sse = SseReader()
+            self.stream_started.emit()
+            return
+        if stream_id != self._stream_id:
+            return
+        if kind == "chunk":
+            if self.sse.feed(data):
+                self.stream_changed.emit(self.sse.text)
+            if not self.sse.finished:
+                return
+        self._stream_id = None
+        self.stream_finished.emit(kind != "error" and bool(self.sse.text))
+
+    def detach(self):
+        """页面开始加载新文档：旧文档的观察脚本随之失效，等新文档注入后再次 ready。"""
+        self.attached = False
+
+
+def install_reply_observer(page, extract_script: str, stream_pattern: str = STREAM_URL_PATTERN):
+    """在 page 上安装回复观察脚本与 QWebChannel；返回 ReplyBridge，不支持时返回 None。
+
+    extract_script 为返回回复文本的 JS 表达式（与轮询时 runJavaScript 的抓取脚本相同）；
+    stream_pattern 为对话补全接口 URL 的 JS 正则，为空时不安装网络流旁路。
+    """
+    if not HAS_WEBCHANNEL:
+        return None
+    bridge = ReplyBridge(page)
+    channel = QWebChannel(page)
+    channel.registerObject("replyBridge", bridge)
+    page.setWebChannel(channel, WORLD_ID)
+    source = _load_webchannel_js() + DELTA_LIB + _OBSERVER_SCRIPT.replace("__EXTRACT__", extract_script.strip().rstrip(";"))
+    script = QWebEngineScript()
+    script.setName("deepseek-reply-observer")
+    script.setSourceCode(source)
+    script.setInjectionPoint(QWebEngineScript.InjectionPoint.DocumentReady)
+    script.setWorldId(WORLD_ID)
+    script.setRunsOnSubFrames(False)
+    page.scripts().insert(script)
+    if stream_pattern:
+        # 只能在文档创建时生效（须早于页面保存 fetch 的引用），当前已加载的文档在下次加载后才有旁路
+        tap = QWebEngineScript()
+        tap.setName("deepseek-stream-tap")
+        tap.setSourceCode(_STREAM_TAP_SCRIPT.replace("__PATTERN__", json.dumps(stream_pattern)))
+        tap.setInjectionPoint(QWebEngineScript.InjectionPoint.DocumentCreation)
+        tap.setWorldId(QWebEngineScript.ScriptWorldId.MainWorld.value)
+        tap.setRunsOnSubFrames(False)
+        page.scripts().insert(tap)
+    page.loadStarted.connect(bridge.detach)
+    page.runJavaScript(source, WORLD_ID)  # 已加载的当前文档
+    return bridge
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+回复增量协议的 Python 端（不依赖 Qt，reply_observer 与测试共用）。
+
+页面侧（reply_observer.DELTA_LIB 的 __dsDelta）保存上次发出的文本与序号，返回 [seq]（未变化）
+或 [seq, offset, text]（新文本 = 旧文本[:offset] + text，追加时 offset 即旧长度）；
+DeltaReader 按序号应用，序号对不上（页面重载、丢失更新）时重置并要求页面重发全文。
+
+网络流旁路送来的是对话补全接口的原始 SSE 片段（任意位置切分）；SseReader 缓冲不完整的行，
+按事件还原正文 token 与结束信号。
+"""
+
+import json
+
+
+class DeltaReader:
+    """增量协议的 Python 端：按序号应用 [seq] / [seq, offset, text]，维护完整回复文本。"""
+
+    def __init__(self):
+        self.seq = -1  # -1：尚未同步，下一次请求页面发送全文
+        self.text = ""
+
+    def reset(self):
+        self.seq = -1
+        self.text = ""
+
+    def apply(self, result):
+        """返回 True（文本有变化）/ False（未变化）/ None（结果无效或序号不连续，已重置待重新同步）。"""
+        try:
+            seq = int(result[0])
+            if len(result) < 3:
+                return False if seq == self.seq else self.reset()
+            offset = int(result[1])
+            chunk = result[2] if isinstance(result[2], str) else ""
+        except (TypeError, ValueError, IndexError, KeyError):
+            return self.reset()
+        if offset > 0 and (seq != self.seq + 1 or offset > len(self.text)):
+            return self.reset()
+        self.text = self.text[:offset] + chunk
+        self.seq = seq
+        return True
+
+
+class SseReader:
+    """对话补全接口的 SSE 流：累积正文 token（不含深度思考），识别结束信号。
+
+    兼容两种事件格式：OpenAI 式 {"choices": [{"delta": {"content"}, "finish_reason"}]}，
+    以及 JSON Patch 式 {"p": 路径, "o": APPEND / SET / BATCH, "v": 值}（省略 p、o 时沿用上一条）。
+    """
+
+    def __init__(self):
+        self.finished = False
+        self._parts = []
+        self._buffer = ""
+        self._path = ""
+        self._op = "APPEND"
+        self._fragment_is_response = True  # response/fragments/-1/content 当前追加到的片段是否为正文
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts).strip()
+
+    def feed(self, chunk: str) -> bool:
+        """输入一段原始字节解码后的文本；返回正文是否有变化。"""
+        lines = (self._buffer + chunk).split("\n")
+        self._buffer = lines.pop()
+        changed = False
+        for line in lines:
+            line = line.rstrip("\r")
+            if line.startswith("event:"):
+                if line[6:].strip() in ("finish", "close", "done"):
+                    self.finished = True
+                continue
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                self.finished = True
+                continue
+            try:
+                event = json.loads(data)
+            except ValueError:
+                continue
+            if isinstance(event, dict):
+                changed = self._event(event) or changed
+        return changed
+
+    def _append(self, value) -> bool:
+        if isinstance(value, str) and value:
+            self._parts.append(value)
+            return True
+        return False
+
+    def _event(self, event) -> bool:
+        choices = event.get("choices")
+        if isinstance(choices, list):
+            choice = choices[0] if choices and isinstance(choices[0], dict) else {}
+            if choice.get("finish_reason"):
+                self.finished = True
+            delta = choice.get("delta") or {}
+            if delta.get("type") in ("thinking", "reasoning"):
+                return False
+            return self._append(delta.get("content"))
+        if "v" not in event:
+            return False
+        if "p" in event:
+            self._path = str(event["p"])
+            self._op = event.get("o") or "APPEND"
+        elif "o" in event:
+            self._op = event["o"]
+        return self._patch(self._path, self._op, event["v"])
+
+    def _patch(self, path, op, value) -> bool:
+        if op == "BATCH" and isinstance(value, list):
+            changed = False
+            for item in value:
+                if isinstance(item, dict):
+                    sub = f"{path}/{item.get('p', '')}".strip("/")
+                    changed = self._patch(sub, item.get("o") or "SET", item.get("v")) or changed
+            return changed
+        if isinstance(value, dict) and isinstance(value.get("response"), dict):
+            return self._response(value["response"])  # 首个事件：整个 response 对象
+        leaf = path.rsplit("/", 1)[-1]
+        if leaf in ("status", "quasi_status"):
+            if value == "FINISHED":
+                self.finished = True
+            return False
+        if path == "response/fragments" and isinstance(value, list):
+            return self._fragments(value)
+        if leaf != "content" or "thinking" in path:
+            return False
+        if path.startswith("response/fragments") and not self._fragment_is_response:
+            return False
+        if op == "SET" and path == "response/content":
+            self._parts = []
+        return self._append(value)
+
+    def _response(self, response) -> bool:
+        changed = self._append(response.get("content"))
+        if isinstance(response.get("fragments"), list):
+            changed = self._fragments(response["fragments"]) or changed
+        if response.get("status") == "FINISHED":
+            self.finished = True
+        return changed
+
+    def _fragments(self, fragments) -> bool:
+        changed = False
+        for fragment in fragments:
+            if isinstance(fragment, dict):
+                self._fragment_is_response = fragment.get("type", "RESPONSE") == "RESPONSE"
+                if self._fragment_is_response:
+                    changed = self._append(fragment.get("content")) or changed
+        return changed
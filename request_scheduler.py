@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+按客户端公平分配的请求调度器，替代 api_server 与 Qt 主线程之间的 FIFO request_queue。
+
+- 每个客户端（请求头 X-Client-Id 或远端地址）一个独立队列；
+- 客户端之间按加权虚拟时间（start-time fair queueing）轮转，批量客户端无法饿死交互式会话；
+- 显式 priority 越高越先被调度（跨客户端生效）；
+- 同一客户端内部按 priority、截止时间（客户端给出 timeout 时）、到达顺序排序；
+- 租户与可用的优先级由 ClientPolicy 按 API Key 决定，客户端自报的名称拿不到配置的权重，也不能自抬优先级。
+
+接口与 queue.Queue 的 put / get_nowait / qsize / empty 兼容，Qt 侧调度器无需修改即可使用。
+AdmissionController 根据实测服务时间估算排队等待，超出请求预算时返回 429 / 503 与 Retry-After。
+"""
+
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from queue import Empty
+
+
+class _ClientQueue:
+    __slots__ = ("name", "weight", "vtime", "heap")
+
+    def __init__(self, name: str, weight: float):
+        self.name = name
+        self.weight = weight
+        self.vtime = 0.0
+        self.heap = []
+
+
+class FairScheduler:
+    """加权公平 + 优先级 + 截止时间的多队列调度器（线程安全）。"""
+
+    def __init__(self, weights: dict = None, default_weight: float = 1.0):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._weights = dict(weights or {})
+        self._default_weight = default_weight
+        self._vclock = 0.0
+        self._seq = itertools.count()
+        self._size = 0
+
+    @staticmethod
+    def parse_weights(spec: str) -> dict:
+        """解析 "cline=4,batch=0.5" 形式的权重配置。"""
+        weights = {}
+        for part in (spec or "").split(","):
+            name, sep, value = part.partition("=")
+            if sep and name.strip():
+                try:
+                    weights[name.strip()] = max(0.01, float(value))
+                except ValueError:
+                    pass
+        return weights
+
+    def put(self, item, block=True, timeout=None, client: str = "default", priority: int = 0,
+            deadline: float = None, weight: float = None):
+        """入队。block / timeout 仅为兼容 queue.Queue.put 的签名，调度器不设容量上限。"""
+        with self._lock:
+            cq = self._clients.get(client)
+            if cq is None:
+                cq = _ClientQueue(client, self._weights.get(client, self._default_weight))
+                self._clients[client] = cq
+            if weight is not None:
+                cq.weight = max(0.01, float(weight))
+            if not cq.heap:
+                # 重新变为活跃的客户端从当前虚拟时钟开始，不能用空闲期攒下的额度插队
+                cq.vtime = max(cq.vtime, self._vclock)
+            order = (-int(priority), deadline if deadline is not None else float("inf"), next(self._seq))
+            heapq.heappush(cq.heap, (order, item))
+            self._size += 1
+
+    def get_nowait(self):
+        with self._lock:
+            best = None
+            best_key = None
+            idle = []
+            for cq in self._clients.values():
+                if not cq.heap:
+                    if cq.vtime <= self._vclock:
+                        idle.append(cq.name)  # 既无排队也无累计额度，可以回收
+                    continue
+                order = cq.heap[0][0]
+                key = (order[0], cq.vtime, order[1], order[2])
+                if best_key is None or key < best_key:
+                    best, best_key = cq, key
+            for name in idle:
+                del self._clients[name]
+            if best is None:
+                raise Empty
+            _, item = heapq.heappop(best.heap)
+            self._vclock = best.vtime
+            best.vtime += 1.0 / best.weight
+            self._size -= 1
+            return item
+
+    def get(self, block=True, timeout=None):
+        """兼容 queue.Queue.get；阻塞模式以短间隔轮询。"""
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                return self.get_nowait()
+            except Empty:
+                if not block or (end is not None and time.monotonic() >= end):
+                    raise
+                time.sleep(0.05)
+
+    def remove(self, request_id) -> bool:
+        """移除仍在排队的请求（条目首元素为 request_id）；已被取走执行时返回 False。"""
+        with self._lock:
+            for cq in self._clients.values():
+                for i, (_, item) in enumerate(cq.heap):
+                    if item[0] == request_id:
+                        cq.heap[i] = cq.heap[-1]
+                        cq.heap.pop()
+                        heapq.heapify(cq.heap)
+                        self._size -= 1
+                        return True
+            return False
+
+    def qsize(self) -> int:
+        with self._lock:
+            return self._size
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def depth_by_client(self) -> dict:
+        with self._lock:
+            return {name: len(cq.heap) for name, cq in self._clients.items() if cq.heap}
+
+
+class ClientPolicy:
+    """请求 → (调度租户, 生效优先级)。
+
+    DEEPSEEK_CLIENT_KEYS="sk-a=cline:5,sk-b=batch" 把 API Key（Authorization: Bearer 或 X-Api-Key）映射到
+    租户与允许的最高优先级（省略时为 0）；租户名与 DEEPSEEK_CLIENT_WEIGHTS 中的权重对应。
+    未携带已配置 Key 的请求归入 "anon:<客户端标识>"，不会命中任何配置的权重，优先级只能降低不能提高。
+    """
+
+    MIN_PRIORITY = -10
+
+    def __init__(self, keys: dict = None):
+        self.keys = dict(keys or {})  # key -> (tenant, max_priority)
+
+    @staticmethod
+    def parse_keys(spec: str) -> dict:
+        """解析 "sk-a=cline:5,sk-b=batch" 形式的 Key 配置。"""
+        keys = {}
+        for part in (spec or "").split(","):
+            key, sep, value = part.partition("=")
+            tenant, _, limit = value.partition(":")
+            if not sep or not key.strip() or not tenant.strip():
+                continue
+            try:
+                max_priority = int(limit) if limit.strip() else 0
+            except ValueError:
+                max_priority = 0
+            keys[key.strip()] = (tenant.strip(), max_priority)
+        return keys
+
+    def resolve(self, key: str, client: str, priority) -> tuple:
+        """key 为请求携带的 API Key（可为空），client 为自报标识或远端地址；返回 (tenant, priority)。"""
+        try:
+            priority = int(priority)
+        except (TypeError, ValueError):
+            priority = 0
+        entry = self.keys.get(key) if key else None
+        if entry is None:
+            tenant, max_priority = "anon:" + (client or "default"), 0
+        else:
+            tenant, max_priority = entry
+        return tenant, min(max(priority, self.MIN_PRIORITY), max(max_priority, self.MIN_PRIORITY))
+
+
+class AdmissionController:
+    """准入控制：根据滚动的单请求服务时间与队列深度估算等待时间，超出请求预算时提前拒绝。"""
+
+    def __init__(self, workers: int = 1, window: int = 50, default_service: float = 30.0, min_samples: int = 3):
+        self.workers = max(1, int(workers))
+        self.default_service = float(default_service)
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=max(1, window))
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def record(self, seconds: float):
+        """记录一次浏览器执行（出队到完成）的耗时。"""
+        with self._lock:
+            self._samples.append(max(0.0, seconds))
+
+    def mean_service(self) -> float:
+        with self._lock:
+            if not self._samples:
+                return self.default_service
+            return sum(self._samples) / len(self._samples)
+
+    def estimate(self, queued: int, running: int):
+        """新请求的 (排队位置, 预计完成秒数)：等前面的队列按 workers 并行消化，再加自身一次服务时间。"""
+        service = self.mean_service()
+        position = queued + 1
+        busy = min(self.workers, max(0, running))
+        wait = (queued / self.workers) * service
+        if busy >= self.workers:
+            wait += service / 2  # 正在执行的请求平均还剩一半
+        return position, wait + service
+
+    def decide(self, queued: int, running: int, client_queued: int, budget: float):
+        """返回 (status, retry_after, position, eta)；status 为 None 表示接受，否则为 429 / 503。
+
+        样本不足时只估算不拒绝；拒绝时该客户端自身占了队列一半以上返回 429（请该客户端放慢），否则 503。
+        """
+        position, eta = self.estimate(queued, running)
+        with self._lock:
+            warm = len(self._samples) >= self.min_samples
+        if not warm or eta <= budget:
+            return None, 0, position, eta
+        with self._lock:
+            self.rejected += 1
+        retry_after = max(1, int(math.ceil(eta - budget)))
+        status = 429 if queued and client_queued * 2 >= queued else 503
+        return status, retry_after, position, eta
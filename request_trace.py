@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+单个浏览器执行的阶段追踪：API 侧投递时创建（挂在 StreamChannel.trace 上），Qt 主线程在请求生命周期的
+各个节点打点，完成后输出 Server-Timing 响应头，并把完整记录追加到按大小轮转的 JSONL 文件。
+
+阶段按发生顺序：
+    enqueue        _dispatch 投递到队列
+    dequeue        标签页取到请求（ApiTabWorker.start）
+    inject         注入脚本开始执行（切换对话后的 1500ms 渲染等待计入 navigate）
+    sent           注入回调返回（_on_web_send_done）
+    poll_start     固定延迟（回车 / 点击发送 500ms、开始轮询 1500ms）之后开始轮询
+    first_content  第一次抓到非空回复
+    last_change    回复最后一次变化（之后进入稳定窗口）
+    stable         判定生成完成（页面信号，或兜底的稳定窗口：连续未变化达到阈值）
+    final_fetch    发起最终抓取（稳定窗口判定时先等待 600ms）
+    final_done     最终抓取回调返回
+    event_set      写回结果并唤醒事件循环
+    collected      事件循环侧取到结果
+同一阶段多次发生（如 json_schema 修复追问再发送一次）时 Server-Timing 按首次计算，JSONL 中保留全部打点。
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+STAGES = (
+    "enqueue", "dequeue", "inject", "sent", "poll_start", "first_content",
+    "last_change", "stable", "final_fetch", "final_done", "event_set", "collected",
+)
+
+# Server-Timing 中的区间：(名称, 起点阶段, 终点阶段)
+SPANS = (
+    ("queue", "enqueue", "dequeue"),
+    ("navigate", "dequeue", "inject"),
+    ("inject", "inject", "sent"),
+    ("send_delay", "sent", "poll_start"),
+    ("first_content", "poll_start", "first_content"),
+    ("generation", "first_content", "last_change"),
+    ("stability", "last_change", "stable"),
+    ("settle", "stable", "final_fetch"),
+    ("final_fetch", "final_fetch", "final_done"),
+    ("finish", "final_done", "event_set"),
+    ("wakeup", "event_set", "collected"),
+    ("total", "enqueue", "collected"),
+)
+
+
+class RequestTrace:
+    """阶段打点（time.monotonic）；Qt 主线程写、事件循环线程读，加锁。"""
+
+    def __init__(self, started_at: float = None):
+        self._lock = threading.Lock()
+        self._first = {}
+        self._events = []  # [(stage, t)]，按发生顺序
+        self.wall_start = time.time()
+        self.mark("enqueue", started_at)
+
+    def mark(self, stage: str, at: float = None):
+        at = time.monotonic() if at is None else at
+        with self._lock:
+            self._first.setdefault(stage, at)
+            self._events.append((stage, at))
+
+    def spans(self) -> dict:
+        """各区间耗时（毫秒）；缺少端点的区间（如取消、注入失败）不输出。"""
+        with self._lock:
+            first = dict(self._first)
+        out = {}
+        for name, start, end in SPANS:
+            if start in first and end in first:
+                out[name] = round((first[end] - first[start]) * 1000, 1)
+        return out
+
+    def elapsed_ns(self, start: str, end: str):
+        """两个阶段首次打点之间的纳秒数（Ollama 的 *_duration 字段）；缺少任一端点时返回 None。"""
+        with self._lock:
+            if start not in self._first or end not in self._first:
+                return None
+            return max(0, int((self._first[end] - self._first[start]) * 1e9))
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={dur}" for name, dur in self.spans().items())
+
+    def record(self, **fields) -> dict:
+        """写入 JSONL 的完整记录：区间耗时 + 相对 enqueue 的全部打点（毫秒）。"""
+        with self._lock:
+            origin = self._first["enqueue"]
+            events = [[stage, round((at - origin) * 1000, 1)] for stage, at in self._events]
+        return {"ts": round(self.wall_start, 3), **fields, "spans": self.spans(), "events": events}
+
+
+class TraceLog:
+    """按大小轮转的 JSONL 追踪日志（traces.jsonl → traces.jsonl.1 …）。"""
+
+    def __init__(self, path: str, max_bytes: int = 16 * 1024 * 1024, backups: int = 5):
+        if os.path.dirname(os.path.abspath(path)):
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+        # 独立的 Logger 实例（不进入全局 logger 树），重复创建 app 时不会叠加 handler
+        self._logger = logging.Logger("deepseek.trace")
+        self._logger.addHandler(self._handler)
+
+    def write(self, record: dict):
+        self._logger.info(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+
+    def close(self):
+        self._handler.close()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+精确匹配的回复缓存：内存 LRU 层 + 可选的磁盘层（SQLite），均带 TTL。
+
+键由 api_server._prepare_chat 根据实际参与生成的字段（model、最后一条用户消息，以及由 system、
+开启 function call 时的 tools / tool_choice、response_format 决定的指令块哈希）计算规范化哈希得到；
+命中时无需再走一次浏览器往返。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(fields: dict) -> str:
+    """对参与生成的字段做规范化 JSON 序列化后取 SHA-256。"""
+    canonical = json.dumps(fields, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LRU + TTL 回复缓存；disk_path 非空时启用 SQLite 磁盘层（内存未命中时回填）。"""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 3600.0, disk_path: str = None):
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = float(ttl)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, content)
+        self._db = None
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "bypasses": 0, "evictions": 0}
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, content TEXT, expires_at REAL)"
+            )
+            self._db.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+    def get(self, key: str):
+        """返回缓存内容；未命中或已过期返回 None。"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] >= now:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry[1]
+                del self._entries[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT content, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] >= now:
+                    self._remember(key, row[1], row[0])
+                    self.stats["disk_hits"] += 1
+                    return row[0]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, content: str):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, content)
+            self.stats["stores"] += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, content, expires_at) VALUES (?, ?, ?)",
+                    (key, content, expires_at),
+                )
+                self._db.commit()
+
+    def note_bypass(self):
+        with self._lock:
+            self.stats["bypasses"] += 1
+
+    def snapshot(self) -> dict:
+        """统计信息（供 /api/cache 与监控使用）。"""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["disk_hits"] + self.stats["misses"]
+            hit_rate = (self.stats["hits"] + self.stats["disk_hits"]) / lookups if lookups else 0.0
+            return dict(self.stats, entries=len(self._entries), max_entries=self.max_entries,
+                        ttl=self.ttl, disk=self._db is not None, hit_rate=round(hit_rate, 4))
+
+    def _remember(self, key, expires_at, content):
+        if self.max_entries == 0:
+            return
+        self._entries[key] = (expires_at, content)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+
+class MemoCache:
+    """有界 LRU 记忆化缓存（无 TTL）：缓存由请求参数决定、构造开销较大的中间结果，如拼装好的指令块。"""
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max(1, int(max_entries))
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: str):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return value
+
+    def put(self, key: str, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), max_entries=self.max_entries)
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+response_format=json_schema 的服务端校验：按 schema 哈希缓存编译好的校验器，并生成会话内修复追问。
+
+- 安装了 jsonschema 时用其 Draft 校验器（check_schema 只在编译时做一次）；
+  未安装时退回内置编译器，把常用关键字（type / properties / required / items / enum / const /
+  additionalProperties / 长度与数值范围 / pattern / anyOf / oneOf / allOf）预先编译为闭包；
+- SchemaCache 以规范化 JSON 的 SHA-256 为键做 LRU，相同 schema 的请求只编译一次；
+- 校验失败时 make_repair 生成的回调返回一条追问，由 Qt 侧在同一标签页、同一对话中发送一次，
+  比客户端冷启动重试（新的一次完整网页生成）便宜得多。
+"""
+
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+
+from content_normalizer import find_json, normalize_content
+
+try:
+    import jsonschema
+    HAS_JSONSCHEMA = True
+except ImportError:
+    HAS_JSONSCHEMA = False
+
+MAX_ERRORS = 5  # 追问中最多列出的错误条数
+
+
+class SchemaError(ValueError):
+    """schema 本身不合法（请求直接 400，无需走浏览器）。"""
+
+
+def schema_hash(schema) -> str:
+    canonical = json.dumps(schema, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+_TYPE_CHECKS = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool) or isinstance(v, float) and v.is_integer(),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+
+
+def _compile(schema, path="$"):
+    """把 schema 编译为 check(value, where, errors) 闭包列表的组合；不支持的关键字忽略。"""
+    if schema is True or schema == {}:
+        return lambda value, where, errors: None
+    if schema is False:
+        return lambda value, where, errors: errors.append(f"{where}: 不允许出现")
+    if not isinstance(schema, dict):
+        raise SchemaError(f"{path}: schema 必须是对象或布尔值")
+    checks = []
+
+    types = schema.get("type")
+    if types is not None:
+        names = [types] if isinstance(types, str) else types
+        if not isinstance(names, list) or any(name not in _TYPE_CHECKS for name in names):
+            raise SchemaError(f"{path}.type: 未知类型 {types!r}")
+        tests = [_TYPE_CHECKS[name] for name in names]
+        expected = "/".join(names)
+
+        def check_type(value, where, errors):
+            if not any(test(value) for test in tests):
+                errors.append(f"{where}: 应为 {expected}，实际为 {type(value).__name__}")
+                return False
+        checks.append(check_type)
+
+    if "enum" in schema:
+        options = schema["enum"]
+        if not isinstance(options, list):
+            raise SchemaError(f"{path}.enum: 必须是数组")
+        checks.append(lambda value, where, errors: None if value in options else errors.append(f"{where}: 取值须为 {options}"))
+    if "const" in schema:
+        const = schema["const"]
+        checks.append(lambda value, where, errors: None if value == const else errors.append(f"{where}: 取值须为 {const!r}"))
+
+    properties = schema.get("properties") or {}
+    if not isinstance(properties, dict):
+        raise SchemaError(f"{path}.properties: 必须是对象")
+    compiled_props = {name: _compile(sub, f"{path}.{name}") for name, sub in properties.items()}
+    required = schema.get("required") or []
+    additional = schema.get("additionalProperties", True)
+    compiled_additional = _compile(additional, f"{path}.additionalProperties") if isinstance(additional, dict) else None
+    if compiled_props or required or additional is not True:
+        def check_object(value, where, errors):
+            if not isinstance(value, dict):
+                return
+            for name in required:
+                if name not in value:
+                    errors.append(f"{where}: 缺少必填字段 {name!r}")
+            for name, item in value.items():
+                sub = compiled_props.get(name)
+                if sub is not None:
+                    sub(item, f"{where}.{name}", errors)
+                elif additional is False:
+                    errors.append(f"{where}: 不允许的字段 {name!r}")
+                elif compiled_additional is not None:
+                    compiled_additional(item, f"{where}.{name}", errors)
+        checks.append(check_object)
+
+    if "items" in schema:
+        compiled_items = _compile(schema["items"], f"{path}[]")
+
+        def check_items(value, where, errors):
+            if isinstance(value, list):
+                for i, item in enumerate(value):
+                    compiled_items(item, f"{where}[{i}]", errors)
+        checks.append(check_items)
+
+    for key, test, message in (
+        ("minLength", lambda v, n: not isinstance(v, str) or len(v) >= n, "长度不能小于"),
+        ("maxLength", lambda v, n: not isinstance(v, str) or len(v) <= n, "长度不能大于"),
+        ("minItems", lambda v, n: not isinstance(v, list) or len(v) >= n, "元素个数不能小于"),
+        ("maxItems", lambda v, n: not isinstance(v, list) or len(v) <= n, "元素个数不能大于"),
+        ("minimum", lambda v, n: not _TYPE_CHECKS["number"](v) or v >= n, "不能小于"),
+        ("maximum", lambda v, n: not _TYPE_CHECKS["number"](v) or v <= n, "不能大于"),
+    ):
+        if key in schema:
+            bound = schema[key]
+            checks.append(lambda value, where, errors, test=test, bound=bound, message=message:
+                          None if test(value, bound) else errors.append(f"{where}: {message} {bound}"))
+
+    if "pattern" in schema:
+        try:
+            pattern = re.compile(schema["pattern"])
+        except (re.error, TypeError) as e:
+            raise SchemaError(f"{path}.pattern: {e}")
+        checks.append(lambda value, where, errors: None if not isinstance(value, str) or pattern.search(value)
+                      else errors.append(f"{where}: 不匹配 {pattern.pattern!r}"))
+
+    for key in ("allOf", "anyOf", "oneOf"):
+        if key in schema:
+            if not isinstance(schema[key], list):
+                raise SchemaError(f"{path}.{key}: 必须是数组")
+            branches = [_compile(sub, f"{path}.{key}[{i}]") for i, sub in enumerate(schema[key])]
+            checks.append(_combinator(key, branches))
+
+    def check(value, where, errors):
+        for fn in checks:
+            if fn(value, where, errors) is False:
+                return  # 类型不符时不再报告更细的错误
+    return check
+
+
+def _combinator(key, branches):
+    def check(value, where, errors):
+        results = []
+        for branch in branches:
+            branch_errors = []
+            branch(value, where, branch_errors)
+            results.append(branch_errors)
+        passed = sum(1 for r in results if not r)
+        if key == "allOf":
+            for r in results:
+                errors.extend(r)
+        elif key == "anyOf" and passed == 0:
+            errors.append(f"{where}: 不满足 anyOf 中任一分支（{results[0][0] if results and results[0] else ''}）")
+        elif key == "oneOf" and passed != 1:
+            errors.append(f"{where}: 须恰好满足 oneOf 中一个分支，实际满足 {passed} 个")
+    return check
+
+
+class CompiledSchema:
+    """编译后的校验器：errors(instance) 返回错误描述列表，空列表表示通过。"""
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.digest = schema_hash(schema)
+        if HAS_JSONSCHEMA:
+            cls = jsonschema.validators.validator_for(schema)
+            try:
+                cls.check_schema(schema)
+            except jsonschema.SchemaError as e:
+                raise SchemaError(e.message)
+            self._validator = cls(schema)
+            self._check = None
+        else:
+            self._validator = None
+            self._check = _compile(schema)
+
+    def errors(self, instance, limit: int = MAX_ERRORS):
+        if self._validator is not None:
+            out = []
+            for error in self._validator.iter_errors(instance):
+                where = "$" + "".join(f"[{p}]" if isinstance(p, int) else f".{p}" for p in error.absolute_path)
+                out.append(f"{where}: {error.message}")
+                if len(out) >= limit:
+                    break
+            return out
+        out = []
+        self._check(instance, "$", out)
+        return out[:limit]
+
+    def validate_reply(self, raw: str):
+        """校验网页回复：先按 JSON 模式规范化并提取第一个 JSON（对象或数组，schema 可以是 array），再按 schema 校验；
+        返回错误列表。"""
+        found = find_json(normalize_content(raw or ""))
+        if found is None:
+            return ["回复中没有可解析的 JSON"]
+        return self.errors(found[0])
+
+
+class SchemaCache:
+    """按 schema 哈希缓存 CompiledSchema 的 LRU（线程安全：Qt 主线程也会调用校验）。"""
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max(1, int(max_entries))
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.stats = {"hits": 0, "compiles": 0, "evictions": 0, "invalid_schemas": 0}
+
+    def get(self, schema) -> CompiledSchema:
+        """取得编译好的校验器；schema 不合法时抛出 SchemaError。"""
+        digest = schema_hash(schema)
+        with self._lock:
+            compiled = self._entries.get(digest)
+            if compiled is not None:
+                self._entries.move_to_end(digest)
+                self.stats["hits"] += 1
+                return compiled
+        try:
+            compiled = CompiledSchema(schema)
+        except SchemaError:
+            with self._lock:
+                self.stats["invalid_schemas"] += 1
+            raise
+        with self._lock:
+            self._entries[digest] = compiled
+            self.stats["compiles"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        return compiled
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries,
+                    "backend": "jsonschema" if HAS_JSONSCHEMA else "builtin", **self.stats}
+
+
+def repair_message(errors) -> str:
+    """同一对话中的修复追问：列出校验错误，要求只输出修正后的完整 JSON。"""
+    lines = "\n".join(f"- {e}" for e in errors[:MAX_ERRORS])
+    return (
+        "[约束]\n上一条回复不符合要求的 JSON Schema，校验错误如下：\n" + lines
+        + "\n请只输出修正后的完整 JSON，不要任何说明或 markdown 代码块。"
+    )
+
+
+def make_repair(compiled: CompiledSchema):
+    """Qt 侧在最终抓取后调用的回调：回复通过校验返回 None，否则返回修复追问。"""
+    def repair(raw):
+        errors = compiled.validate_reply(raw)
+        return repair_message(errors) if errors else None
+    return repair
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+会话复用：把消息前缀的指纹映射到网页上仍然存活的 DeepSeek 对话 URL。
+
+智能体的多轮循环每一轮都会带上完整的 messages（system + 历史 + 新的一轮）。一轮完成后记录
+指纹(指令块 + 到本轮回复为止的全部消息) → 对话 URL；下一轮请求的历史部分与之相同时，
+Qt 侧切换到该对话，只输入新一轮的用户消息 / 工具结果，不再重复发送 [约束] + system + tools。
+
+指纹只看消息内容（role、去掉首尾空白的文本、工具调用的名称与参数），工具调用 id、
+参数 JSON 的键顺序与空白差异都不影响匹配。一个对话 URL 只能被续写一次（claim 后即移除），
+客户端从同一前缀分叉重试时另开新对话，避免把另一分支的历史带进来。
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from response_cache import cache_key
+
+NEW_CONVERSATION = "new"  # StreamChannel.conversation 取此值时 Qt 侧先新开对话再发送
+
+
+def _text(content) -> str:
+    if isinstance(content, str):
+        return content.strip()
+    if isinstance(content, list):
+        return "\n".join(
+            (part.get("text") or "").strip() for part in content
+            if isinstance(part, dict) and part.get("type") == "text"
+        ).strip()
+    return ""
+
+
+def _arguments(args) -> str:
+    """参数规范化为排序键的紧凑 JSON（OpenAI 为字符串、Ollama 为对象）。"""
+    if isinstance(args, str):
+        try:
+            args = json.loads(args or "{}")
+        except ValueError:
+            return args.strip()
+    return json.dumps(args, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def canonical_message(message) -> list:
+    """单条消息的指纹形式：[role, 文本, [[工具名, 参数], ...]]。"""
+    calls = []
+    for call in message.get("tool_calls") or []:
+        if isinstance(call, dict):
+            fn = call.get("function") if isinstance(call.get("function"), dict) else call
+            calls.append([fn.get("name") or "", _arguments(fn.get("arguments"))])
+    return [(message.get("role") or "").strip().lower(), _text(message.get("content")), calls]
+
+
+def split_turn(messages):
+    """拆分为 (历史, 新一轮)：新一轮是最后一条 assistant 消息之后的全部消息；system 不计入。"""
+    turns = [canonical_message(m) for m in messages if isinstance(m, dict)]
+    turns = [t for t in turns if t[0] != "system"]
+    last = max((i for i, t in enumerate(turns) if t[0] == "assistant"), default=-1)
+    return turns[:last + 1], turns[last + 1:]
+
+
+def fingerprint(block_key: str, turns) -> str:
+    return cache_key({"instruction": block_key, "turns": turns})
+
+
+def affinity_key(messages):
+    """对话的路由亲和键：第一条非 system 消息的指纹；没有可用消息时为 None。
+
+    历史前缀的指纹每一轮都会变长，这个键在整个对话中保持不变（相同的单轮请求也得到相同的键），
+    浏览器农场据此把同一对话的各轮与相同请求转发到同一工作进程，命中那里的会话 URL、回复缓存与在途执行。
+    """
+    history, turn = split_turn(messages if isinstance(messages, list) else [])
+    first = (history + turn)[:1]
+    return cache_key({"root": first}) if first else None
+
+
+def turn_text(turns) -> str:
+    """新一轮在已有对话中需要输入的文本：用户消息原文，工具结果加上标注。"""
+    parts = []
+    for role, text, _ in turns:
+        if role == "tool":
+            parts.append("[工具结果]\n" + text)
+        elif text:
+            parts.append(text)
+    return "\n\n".join(parts)
+
+
+class SessionStore:
+    """指纹 → 对话 URL 的 LRU + TTL 映射（网页对话可能被删除或过期，长时间未续写的条目丢弃）。"""
+
+    def __init__(self, max_entries: int = 512, ttl: float = 6 * 3600.0):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # fingerprint -> (expires_at, url)
+        self.stats = {"reused": 0, "new": 0, "remembered": 0, "evictions": 0}
+
+    def claim(self, key: str):
+        """取出并移除与前缀匹配的对话 URL；没有（或 key 为空，即首轮）时返回 None。"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None) if key else None
+            if entry is not None and entry[0] >= now:
+                self.stats["reused"] += 1
+                return entry[1]
+            self.stats["new"] += 1
+            return None
+
+    def remember(self, key: str, url: str):
+        with self._lock:
+            # 同一对话只保留最新一轮的前缀：旧前缀已被续写，不能再作为另一分支的起点
+            for old in [k for k, (_, u) in self._entries.items() if u == url]:
+                del self._entries[old]
+            self._entries[key] = (time.time() + self.ttl, url)
+            self.stats["remembered"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), max_entries=self.max_entries, ttl=self.ttl)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+结构化日志：调用方（Qt 主线程）只把日志记录放进有界队列，由后台线程的 QueueListener 负责格式化与写出。
+
+- get_logger(name) 返回的适配器接受关键字字段：log.debug("最终回复", tab=1, length=120)；
+  控制台输出为 "消息 key=value ..."，DEEPSEEK_LOG_FILE 指定时另写一份按大小轮转的 JSONL；
+- 队列满时直接丢弃并计数，日志永远不会阻塞驱动所有网页 I/O 的 GUI 线程；
+- DEEPSEEK_LOG_SAMPLE（0~1）对 INFO 及以下的记录抽样，WARNING 及以上总是保留；
+- rate_limit(logger) 给高频来源（网页 JS 控制台转发）加令牌桶，被限流的条数记在下一条放行记录的 suppressed 字段。
+
+环境变量：DEEPSEEK_LOG_LEVEL（默认 INFO）、DEEPSEEK_LOG_FILE、DEEPSEEK_LOG_FILE_MB（16）、
+DEEPSEEK_LOG_SAMPLE（1.0）、DEEPSEEK_LOG_QUEUE（10000）。
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+ROOT = "deepseek"
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_lock = threading.Lock()
+_listener = None
+_handler = None
+
+
+class StructuredAdapter(logging.LoggerAdapter):
+    """把调用时的关键字参数收进 record.fields（exc_info / stack_info 等 logging 自带参数照常传递）。"""
+
+    def process(self, msg, kwargs):
+        fields = {k: kwargs.pop(k) for k in list(kwargs) if k not in ("exc_info", "stack_info", "stacklevel", "extra")}
+        extra = dict(kwargs.get("extra") or {})
+        extra["fields"] = {**extra.get("fields", {}), **fields}
+        kwargs["extra"] = extra
+        return msg, kwargs
+
+
+class DroppingQueueHandler(QueueHandler):
+    """队列满时丢弃记录（计数）而不是阻塞或抛错。"""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 只在调用线程上合并 msg % args，字段原样交给后台线程格式化
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_text = logging.Formatter().formatException(record.exc_info) if record.exc_info else None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class SamplingFilter(logging.Filter):
+    """按比例保留 INFO 及以下的记录；WARNING 及以上不抽样。"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = max(0.0, min(1.0, rate))
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1.0 or random.random() < self.rate
+
+
+class RateLimitFilter(logging.Filter):
+    """令牌桶限流：每秒 rate 条、突发 burst 条；被丢弃的条数附在下一条放行记录上。"""
+
+    def __init__(self, rate: float, burst: int):
+        super().__init__()
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._suppressed = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens < 1:
+                self._suppressed += 1
+                return False
+            self._tokens -= 1
+            suppressed, self._suppressed = self._suppressed, 0
+        if suppressed:
+            fields = getattr(record, "fields", None) or {}
+            record.fields = {**fields, "suppressed": suppressed}
+        return True
+
+
+def _fields(record) -> dict:
+    fields = getattr(record, "fields", None) or {}
+    extra = {k: v for k, v in vars(record).items() if k not in _RESERVED and k != "fields"}
+    return {**extra, **fields}
+
+
+class ConsoleFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s", "%H:%M:%S")
+
+    def format(self, record):
+        line = self.formatMessage(self._with_time(record))
+        fields = _fields(record)
+        if fields:
+            line += " " + " ".join(f"{k}={v!r}" if isinstance(v, str) and " " in v else f"{k}={v}" for k, v in fields.items())
+        if record.exc_text:  # 异常文本已在调用线程的 prepare 中生成
+            line += "\n" + record.exc_text
+        return line
+
+    def _with_time(self, record):
+        record.message = record.getMessage()
+        record.asctime = self.formatTime(record, self.datefmt)
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        obj = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **_fields(record),
+        }
+        if record.exc_text:
+            obj["exc"] = record.exc_text
+        return json.dumps(obj, ensure_ascii=False, default=str)
+
+
+def setup_logging(level=None, path=None, sample=None):
+    """配置 deepseek.* 日志的异步管线（只生效一次，重复调用返回已有的 listener）。"""
+    global _listener, _handler
+    with _lock:
+        if _listener is not None:
+            return _listener
+        level = level or os.environ.get("DEEPSEEK_LOG_LEVEL", "INFO")
+        path = path if path is not None else os.environ.get("DEEPSEEK_LOG_FILE", "")
+        sample = float(sample if sample is not None else os.environ.get("DEEPSEEK_LOG_SAMPLE", "1"))
+
+        outputs = []
+        console = logging.StreamHandler(sys.stderr)
+        console.setFormatter(ConsoleFormatter())
+        outputs.append(console)
+        if path:
+            if os.path.dirname(os.path.abspath(path)):
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            mb = int(os.environ.get("DEEPSEEK_LOG_FILE_MB", "16"))
+            file_handler = RotatingFileHandler(path, maxBytes=mb * 1024 * 1024, backupCount=5, encoding="utf-8")
+            file_handler.setFormatter(JsonFormatter())
+            outputs.append(file_handler)
+
+        _handler = DroppingQueueHandler(queue.Queue(int(os.environ.get("DEEPSEEK_LOG_QUEUE", "10000"))))
+        if sample < 1.0:
+            _handler.addFilter(SamplingFilter(sample))
+        root = logging.getLogger(ROOT)
+        root.setLevel(level.upper() if isinstance(level, str) else level)
+        root.addHandler(_handler)
+        root.propagate = False
+        _listener = QueueListener(_handler.queue, *outputs, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+        return _listener
+
+
+def shutdown_logging():
+    """停止后台线程并写出队列中剩余的记录。"""
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+def dropped_count() -> int:
+    return _handler.dropped if _handler is not None else 0
+
+
+def get_logger(name: str) -> StructuredAdapter:
+    """deepseek.<name> 的结构化日志适配器。"""
+    return StructuredAdapter(logging.getLogger(f"{ROOT}.{name}"), {})
+
+
+def rate_limit(adapter: StructuredAdapter, per_second: float, burst: int = 20) -> StructuredAdapter:
+    """给该 logger 加令牌桶限流（在调用线程过滤，被限流的记录不进队列）。"""
+    adapter.logger.addFilter(RateLimitFilter(per_second, burst))
+    return adapter
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量任务测试：JSONL 解析，BatchStore 的条目状态流转、结果 seq 续传、取消，以及服务重启后的恢复
+（running 退回 queued，api_server 启动时继续执行未完成的 batch）。
+
+用法：
+    python test_batch_jobs.py
+    python -m pytest -q test_batch_jobs.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from queue import Queue
+
+from batch_jobs import BatchFormatError, BatchStore, parse_jsonl
+
+
+def _items(n):
+    return [(f"c{i}", "/v1/chat/completions", {"model": "m", "messages": [{"role": "user", "content": f"q{i}"}]})
+            for i in range(n)]
+
+
+def test_parse_jsonl():
+    data = "\n".join([
+        json.dumps({"custom_id": "a", "method": "POST", "url": "/v1/chat/completions", "body": {"messages": []}}),
+        "",
+        json.dumps({"custom_id": 7, "messages": []}),
+        json.dumps({"messages": []}),
+    ]).encode("utf-8")
+    items = parse_jsonl(b"\xef\xbb\xbf" + data)
+    assert [(cid, url) for cid, url, _ in items] == [
+        ("a", "/v1/chat/completions"), ("7", "/v1/chat/completions"), ("item-2", "/v1/chat/completions")]
+    assert "custom_id" not in items[1][2]
+    for bad in (b"", b"\n\n", b"{oops", b"[1, 2]"):
+        try:
+            parse_jsonl(bad)
+        except BatchFormatError:
+            continue
+        raise AssertionError(f"{bad!r} 应被拒绝")
+    print("✓ JSONL 解析测试通过")
+
+
+def test_resume_after_restart():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "batches.db")
+        store = BatchStore(path)
+        batch = store.create(_items(4), {"run": "eval"})
+        batch_id = batch["id"]
+        assert batch["request_counts"]["queued"] == 4 and batch["metadata"] == {"run": "eval"}
+        store.mark_running(batch_id, 0)
+        store.finish_item(batch_id, 0, result={"status_code": 200})
+        store.mark_running(batch_id, 1)
+        store.mark_running(batch_id, 2)
+        store.finish_item(batch_id, 2, error={"code": "invalid_request"})
+        counts = store.get(batch_id)["request_counts"]
+        assert (counts["completed"], counts["failed"], counts["running"], counts["queued"]) == (1, 1, 1, 1)
+        store._db.close()
+
+        # 模拟进程重启：中断时 running 的条目退回 queued，已完成的保持不变
+        store = BatchStore(path)
+        assert store.unfinished() == [batch_id]
+        assert [idx for idx, *_ in store.queued(batch_id)] == [1, 3]
+        rows = store.results_after(batch_id, 0)
+        assert [(seq, line["custom_id"]) for seq, line in rows] == [(1, "c0"), (2, "c2")]
+        assert rows[1][1]["error"] == {"code": "invalid_request"} and rows[1][1]["response"] is None
+
+        store.mark_running(batch_id, 1)
+        store.finish_item(batch_id, 1, result={"status_code": 200})
+        store.finish_item(batch_id, 1, result={"status_code": 500})  # 已完成的条目不会被覆盖
+        assert [seq for seq, _ in store.results_after(batch_id, 2)] == [3], "续传只返回 after 之后的结果"
+        assert store.results_after(batch_id, 1)[1][1]["response"] == {"status_code": 200}
+
+        store.cancel(batch_id)
+        batch = store.get(batch_id)
+        assert batch["status"] == "cancelled" and batch["request_counts"]["cancelled"] == 1
+        assert store.results_after(batch_id, 3)[0][1]["error"]["code"] == "batch_cancelled"
+        assert store.unfinished() == [], "已取消的 batch 不再恢复"
+        store.complete(batch_id)
+        assert store.get(batch_id)["status"] == "cancelled"
+        store._db.close()
+    print("✓ 重启恢复 / 续传 / 取消测试通过")
+
+
+def test_server_resumes_batches():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "batches.db")
+        store = BatchStore(path)
+        batch_id = store.create(_items(3))["id"]
+        store.mark_running(batch_id, 0)
+        store.finish_item(batch_id, 0, result={"status_code": 200})
+        store.mark_running(batch_id, 1)  # 上次退出时正在执行
+        store._db.close()
+
+        os.environ["DEEPSEEK_BATCH_DB"] = path
+        os.environ["DEEPSEEK_TRACE_LOG"] = ""
+        try:
+            from aiohttp.test_utils import TestClient, TestServer
+            from api_server import create_app
+
+            async def run():
+                queue, responses, executed = Queue(), {}, []
+
+                async def fake_tab():
+                    while True:
+                        while queue.empty():
+                            await asyncio.sleep(0.01)
+                        request_id, payload, event, _channel = queue.get()
+                        executed.append(payload)
+                        responses[request_id] = "ok"
+                        event.set()
+
+                async with TestClient(TestServer(create_app(queue, responses))) as client:
+                    tab = asyncio.create_task(fake_tab())
+                    try:
+                        resp = await client.get(f"/v1/batches/{batch_id}/results?after=1")
+                        lines = [json.loads(line) for line in (await resp.text()).splitlines()]
+                        assert sorted(line["custom_id"] for line in lines) == ["c1", "c2"], lines
+                        assert len(executed) == 2, "只重新执行未完成的条目"
+                        batch = await (await client.get(f"/v1/batches/{batch_id}")).json()
+                        assert batch["status"] == "completed" and batch["request_counts"]["completed"] == 3
+                    finally:
+                        tab.cancel()
+
+            asyncio.run(run())
+        finally:
+            os.environ["DEEPSEEK_BATCH_DB"] = ""
+    print("✓ 服务启动继续执行未完成 batch 测试通过")
+
+
+def main():
+    try:
+        test_parse_jsonl()
+        test_resume_after_restart()
+        test_server_resumes_batches()
+    except AssertionError as e:
+        print("✗ 批量任务测试失败:", e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
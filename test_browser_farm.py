@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+浏览器农场路由测试：同一对话各轮的亲和路由及其退回按负载选择；再用两个模拟的工作进程（aiohttp 测试服务）
+驱动 FarmRouter，验证非流式请求在转发前登记 X-Request-Id（DELETE 可定向取消）、流式响应中途出错时断开下游连接、
+/v1/batches 固定转发到同一进程、/metrics 合并各进程指标并加 worker 标签。
+
+用法：
+    python test_browser_farm.py
+    python -m pytest -q test_browser_farm.py
+"""
+
+import asyncio
+import json
+import sys
+import tempfile
+
+from browser_farm import Backend, FarmRouter, merge_metrics
+
+METRICS = (
+    "# HELP deepseek_requests_total Requests\n"
+    "# TYPE deepseek_requests_total counter\n"
+    'deepseek_requests_total{outcome="completed"} 3\n'
+    "# HELP deepseek_queue_depth Queue depth\n"
+    "# TYPE deepseek_queue_depth gauge\n"
+    "deepseek_queue_depth 1\n"
+)
+
+
+def test_merge_metrics():
+    text = merge_metrics({0: METRICS, 1: METRICS.replace(" 3\n", " 5\n")})
+    lines = text.splitlines()
+    assert lines.count("# TYPE deepseek_requests_total counter") == 1, "HELP / TYPE 只保留一份"
+    assert 'deepseek_requests_total{worker="0",outcome="completed"} 3' in lines
+    assert 'deepseek_requests_total{worker="1",outcome="completed"} 5' in lines
+    assert 'deepseek_queue_depth{worker="1"} 1' in lines
+    # 同一指标族的样本紧跟在其 HELP / TYPE 之后
+    assert lines.index('deepseek_requests_total{worker="1",outcome="completed"} 5') < lines.index("# HELP deepseek_queue_depth Queue depth")
+    print("✓ /metrics 合并测试通过")
+
+
+def test_affinity_pick():
+    backends = [Backend(i, 9000 + i, "") for i in range(4)]
+    for b in backends:
+        b.healthy = True
+    router = FarmRouter(backends, affinity_slack=2)
+    turn1 = [{"role": "system", "content": "s"}, {"role": "user", "content": "写一个排序函数"}]
+    turn2 = turn1 + [{"role": "assistant", "content": "def sort(): ..."}, {"role": "user", "content": "加上测试"}]
+    key1 = router._affinity(json.dumps({"messages": turn1}).encode("utf-8"))
+    key2 = router._affinity(json.dumps({"model": "x", "messages": turn2}).encode("utf-8"))
+    assert key1 and key1 == key2, "同一对话的各轮亲和键相同"
+    assert router._affinity(b"{oops") is None and router._affinity(b"[]") is None and router._affinity(b"") is None
+    home = router.pick(key1)
+    assert router.pick(key2) is home
+    # 不同对话大体均匀分布到各进程
+    spread = {router.pick(router._affinity(json.dumps({"messages": [{"role": "user", "content": f"q{i}"}]}).encode())).index
+              for i in range(40)}
+    assert len(spread) == 4, spread
+    # 亲和进程排队未超出 slack 时仍然固定；超出后改发最空闲的
+    home.outstanding = 2
+    assert router.pick(key1) is home
+    home.outstanding = 3
+    assert router.pick(key1) is not home and router.pick(key1).load == 0
+    home.outstanding = 0
+    # 亲和进程不可用时改发其他进程，恢复后回到原进程
+    home.healthy = False
+    assert router.pick(key1) not in (home, None)
+    home.healthy = True
+    assert router.pick(key1) is home
+    assert router.pick() is backends[0], "没有亲和键时按负载（同负载取序号小的）"
+    print("✓ 亲和路由测试通过")
+
+
+def _fake_worker(index, seen):
+    from aiohttp import web
+
+    pending = {}
+
+    async def status(request):
+        return web.json_response({"queue_depth": 0, "inflight": len(pending)})
+
+    async def chat(request):
+        request_id = request.headers.get("X-Request-Id", "")
+        seen.append((index, request_id))
+        event = pending[request_id] = asyncio.Event()
+        try:
+            await asyncio.wait_for(event.wait(), timeout=5)
+        finally:
+            pending.pop(request_id, None)
+        return web.json_response({"worker": index, "cancelled": True}, headers={"X-Request-Id": request_id})
+
+    async def cancel(request):
+        event = pending.get(request.match_info["request_id"])
+        if event is None:
+            return web.json_response({"error": "not found"}, status=404)
+        event.set()
+        return web.json_response({"worker": index})
+
+    async def broken_stream(request):
+        # 先发出响应头和一块数据，再在流中途断开连接
+        resp = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await resp.prepare(request)
+        await resp.write(b'{"done": false}\n')
+        await asyncio.sleep(0.05)
+        request.transport.close()
+        return resp
+
+    async def batches(request):
+        return web.json_response({"worker": index})
+
+    async def metrics(request):
+        return web.Response(text=METRICS)
+
+    app = web.Application()
+    app.router.add_get("/api/status", status)
+    app.router.add_post("/v1/chat/completions", chat)
+    app.router.add_delete("/v1/requests/{request_id}", cancel)
+    app.router.add_post("/api/chat", broken_stream)
+    app.router.add_route("*", "/v1/batches", batches)
+    app.router.add_route("*", "/v1/batches/{tail:.*}", batches)
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+def test_router():
+    from aiohttp import ClientPayloadError
+    from aiohttp.test_utils import TestClient, TestServer
+
+    async def run():
+        seen = []
+        workers = [TestServer(_fake_worker(i, seen)) for i in range(2)]
+        for server in workers:
+            await server.start_server()
+        with tempfile.TemporaryDirectory() as tmp:
+            backends = [Backend(i, server.port, tmp) for i, server in enumerate(workers)]
+            router = FarmRouter(backends, status_interval=0.05, batch_worker=1)
+            try:
+                async with TestClient(TestServer(router.create_app())) as client:
+                    while not all(b.healthy for b in backends):
+                        await asyncio.sleep(0.02)
+
+                    # 非流式请求：响应头返回之前就能按客户端给的 ID 定向取消
+                    pending = asyncio.ensure_future(client.post("/v1/chat/completions", json={}, headers={"X-Request-Id": "req-1"}))
+                    while not seen:
+                        await asyncio.sleep(0.01)
+                    assert seen[-1][1] == "req-1", "X-Request-Id 应原样转发"
+                    resp = await client.delete("/v1/requests/req-1")
+                    assert resp.status == 200 and (await resp.json())["worker"] == seen[-1][0]
+                    resp = await pending
+                    assert resp.status == 200 and resp.headers["X-Farm-Worker"] == str(seen[-1][0])
+                    assert (await client.delete("/v1/requests/req-1")).status == 404, "完成后不再登记"
+
+                    # 客户端未给 ID 时由路由生成并转发，同样可以取消
+                    pending = asyncio.ensure_future(client.post("/v1/chat/completions", json={}))
+                    while len(seen) < 2:
+                        await asyncio.sleep(0.01)
+                    generated = seen[-1][1]
+                    assert generated and generated != "req-1"
+                    assert (await client.delete(f"/v1/requests/{generated}")).status == 200
+                    assert (await pending).headers["X-Request-Id"] == generated
+
+                    # 流式响应中途上游断开：下游连接被断开（不是正常结束的流，也不是第二个 502 响应），
+                    # 工作进程不因此被标记为不可用
+                    resp = await client.post("/api/chat", json={})
+                    assert resp.status == 200
+                    try:
+                        await asyncio.wait_for(resp.read(), timeout=5)
+                    except ClientPayloadError:
+                        pass
+                    else:
+                        raise AssertionError("上游中途断开时下游应收到不完整的流")
+                    assert all(b.healthy for b in backends), "流中途出错不应标记后端不可用"
+
+                    for path in ("/v1/batches", "/v1/batches/batch_x/results"):
+                        resp = await client.get(path)
+                        assert (await resp.json())["worker"] == 1, f"{path} 应固定转发到 batch 工作进程"
+
+                    text = await (await client.get("/metrics")).text()
+                    assert 'deepseek_queue_depth{worker="0"} 1' in text and 'deepseek_queue_depth{worker="1"} 1' in text
+            finally:
+                for server in workers:
+                    await server.close()
+
+    asyncio.run(run())
+    print("✓ 路由转发 / 取消 / batch 固定 / 指标合并测试通过")
+
+
+def main():
+    try:
+        test_merge_metrics()
+        test_affinity_pick()
+        test_router()
+    except AssertionError as e:
+        print("✗ 农场路由测试失败:", e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
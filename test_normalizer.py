@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回复规范化的语料等价性测试与基准
+
+将 content_normalizer.normalize_content 与原先 api_server 中逐步 replace / split / re.sub 的实现
+（下方 legacy_normalize_content，逐字保留）在同一语料上逐条比对，并比较两者耗时；
+同时验证 StreamingNormalizer 按任意分块喂入时的输出与整段规范化一致。
+JSON 提取改为线性扫描（不再优先取代码块、能跳过无法解析的候选并在其内部继续查找；与原实现一致只取对象），
+单独用 test_json_extraction 覆盖（find_json 默认还接受顶层数组，供 json_schema 校验）；
+test_tool_calls 验证 ToolCallStream 任意分块喂入时与整段提取一致。
+
+用法：
+    python test_normalizer.py            # 等价性测试 + 基准
+    python test_normalizer.py --cases 20000 --repeat 5
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import time
+
+from content_normalizer import JsonScanner, StreamingNormalizer, find_json, normalize_content
+from tool_calls import ToolCallStream, extract_tool_calls
+
+
+def legacy_normalize_content(raw: str, want_json_only: bool = False) -> str:
+    """原 api_server._normalize_content 的实现（作为等价性基准，勿修改）"""
+    if not raw or not isinstance(raw, str):
+        return raw or ""
+
+    s = raw.strip()
+
+    if "<create_file>" in s or "<file_path>" in s or "<file_content>" in s:
+        return s
+
+    ui_tags = ["[系统指令]", "[用户输入]", "[约束]", "[问题]", "系统指令", "用户输入"]
+    for tag in ui_tags:
+        s = s.replace(tag, "").strip()
+
+    if "You are Cline" in s and "GLOBAL RULES" in s and "```" not in s:
+        lines = s.split("\n")
+        filtered_lines = []
+        skip_cline_config = False
+
+        for line in lines:
+            if "You are Cline" in line:
+                skip_cline_config = True
+                continue
+            elif skip_cline_config and (line.startswith("##") or "MODES" in line or "EXECUTION FLOW" in line):
+                if "<task>" in line:
+                    skip_cline_config = False
+                    filtered_lines.append(line)
+                continue
+            elif "<task>" in line:
+                skip_cline_config = False
+                filtered_lines.append(line)
+            elif not skip_cline_config:
+                filtered_lines.append(line)
+
+        s = "\n".join(filtered_lines).strip()
+
+    if re.search(r"^(Aline\s*有一个问题|Your\s*question\s*here)[:\s]*$", s.strip(), re.IGNORECASE):
+        s = ""
+
+    meaningless_lines = ["复制", "联网搜索", "互联网搜索", "下载"]
+    lines = s.split("\n")
+    filtered_lines = []
+    for line in lines:
+        stripped = line.strip()
+        if stripped not in meaningless_lines:
+            filtered_lines.append(line)
+    s = "\n".join(filtered_lines).strip()
+
+    s = re.sub(
+        r"^([a-zA-Z0-9_\.\-]+\.(?:py|js|ts|java|cpp|go|rs))\s*[)：:]?\s*\n\s*(python|javascript|java|cpp|go|rust)\s*\n",
+        r"**\1**\n```\2\n",
+        s,
+        flags=re.MULTILINE | re.IGNORECASE,
+    )
+
+    code_blocks = re.findall(r"```\w*", s)
+    if len(code_blocks) % 2 == 1:
+        s = s.rstrip() + "\n```"
+
+    redundant_openings = [
+        r"^好的[，,]?\s*",
+        r"^收到[，,]?\s*",
+        r"^明白[了]?[，,]?\s*",
+    ]
+
+    for pattern in redundant_openings:
+        s = re.sub(pattern, "", s, flags=re.IGNORECASE).strip()
+
+    constructive_endings = [
+        "希望可以帮到你。", "希望可以帮到你",
+        "如有疑问欢迎继续提问。", "如有疑问欢迎继续问。"
+    ]
+
+    lines = s.split("\n")
+    if lines and lines[-1].strip() in constructive_endings:
+        lines.pop()
+        s = "\n".join(lines).strip()
+
+    s = re.sub(r"\n{3,}", "\n\n", s)
+    lines = [line.rstrip() for line in s.split("\n")]
+    s = "\n".join(lines).strip()
+
+    if want_json_only:
+        for pattern in (r"```(?:json)?\s*([\s\S]*?)\s*```", r"```\s*([\s\S]*?)\s*```"):
+            m = re.search(pattern, s)
+            if m:
+                try:
+                    obj = json.loads(m.group(1).strip())
+                    return json.dumps(obj, ensure_ascii=False)
+                except Exception:
+                    pass
+        start = s.find("{")
+        if start >= 0:
+            depth = 0
+            for i in range(start, len(s)):
+                if s[i] == "{":
+                    depth += 1
+                elif s[i] == "}":
+                    depth -= 1
+                    if depth == 0:
+                        try:
+                            obj = json.loads(s[start : i + 1])
+                            return json.dumps(obj, ensure_ascii=False)
+                        except Exception:
+                            pass
+                        break
+
+    return s
+
+
+# 手写的典型 / 边界回复
+FIXED_CASES = [
+    "",
+    "   ",
+    "好的，这是代码：\n\n```python\nprint(1)\n```\n\n希望可以帮到你。",
+    "收到，明白了，\n\n\n\n结果如下  \n  \n  \n\n完成",
+    "明白，好的，先说结论",
+    "[系统指令] 你好 [用户输入] 世界\n复制\n下载\n  联网搜索  \n内容",
+    "系统[约束]指令 残留",
+    "[约[问题]束] 嵌套",
+    "Your question here:",
+    "Aline 有一个问题",
+    "main.py：\npython\nimport os\nprint(os.getcwd())",
+    "app.js\n\n  javascript  \n\nconsole.log(1)\n```",
+    "```json\n{\"a\": 1}\n```",
+    "前缀 {\"tool_calls\": [{\"name\": \"x\"}]} 后缀",
+    "<create_file>\n<file_path>a.py</file_path>\n<file_content>\nx\n</file_content>\n</create_file>",
+    "You are Cline, GLOBAL RULES\n## MODES\nsomething\n<task>do it</task>\n结果",
+    "行尾空白\t \r\n第二行\r\n\r\n\r\n\r\n第三行",
+    "复制\n  \n  缩进开头\n如有疑问欢迎继续问。",
+    "只有结尾\n希望可以帮到你",
+    "希望可以帮到你。",
+    "````\n四个反引号\n```",
+    "a\n \n\n\nb\n\n\n \n\nc",
+]
+
+_FRAGMENTS = [
+    "好的，", "收到,", "明白了，", "明白", "[系统指令]", "[用户输入]", "[约束]", "[问题]", "系统指令", "用户输入",
+    "复制", "联网搜索", "互联网搜索", "下载", "希望可以帮到你。", "希望可以帮到你", "如有疑问欢迎继续提问。",
+    "```", "```python", "```json", "main.py", "utils.ts：", "python", "javascript", "rust", "{", "}", "[", "]",
+    "\"key\"", ":", "1", "\\\"", "这是一段说明", "def f(x):", "    return x", "  ", "\t", "\r", "", "Your question here",
+    "You are Cline", "GLOBAL RULES", "## MODES", "<task>", "EXECUTION FLOW", "代码如下", "x" * 40, "\u3000", "\x0c",
+]
+
+
+def build_corpus(cases: int, seed: int = 20240601):
+    """固定用例 + 随机拼接的片段（覆盖标签、空白行、代码块、开场白 / 结尾的各种组合）+ 大段代码回复。"""
+    rng = random.Random(seed)
+    corpus = list(FIXED_CASES)
+    for _ in range(cases):
+        parts = []
+        for _ in range(rng.randint(1, 24)):
+            parts.append(rng.choice(_FRAGMENTS))
+            parts.append(rng.choice(["\n", "\n", "\n\n", "\n\n\n", " ", "", "  \n", "\n \n"]))
+        corpus.append("".join(parts))
+    code = "\n".join(f"    value_{i} = compute({i})  # 第 {i} 行" for i in range(5000))
+    corpus.append("好的，这是完整实现：\n\nbig.py\npython\n" + code + "\n\n\n\n复制\n希望可以帮到你。")
+    corpus.append("收到\n\n```python\n" + code + "\n")
+    return corpus
+
+
+def test_equivalence(cases: int = 5000):
+    corpus = build_corpus(cases)
+    mismatches = 0
+    for text in corpus:
+        expected = legacy_normalize_content(text)
+        actual = normalize_content(text)
+        if actual != expected:
+            mismatches += 1
+            if mismatches <= 5:
+                print("✗ 不一致:", repr(text[:200]))
+                print("  legacy:", repr(expected[:200]))
+                print("  new:   ", repr(actual[:200]))
+    assert mismatches == 0, f"{mismatches} mismatches"
+    print(f"✓ 等价性测试通过：{len(corpus)} 条语料")
+
+
+JSON_CASES = [
+    ('```json\n{"a": 1}\n```', '{"a": 1}'),
+    ('结果：{"s": "含 } 与 \\" 的字符串", "n": [1, {"b": 2}]} 完毕', '{"s": "含 } 与 \\" 的字符串", "n": [1, {"b": 2}]}'),
+    ('先是 {无效} 然后 {"ok": true}', '{"ok": true}'),
+    ('数组 [1, 2, "]"] 不提取', '数组 [1, 2, "]"] 不提取'),  # 与原实现一致只取对象
+    ('对象中的数组 {"n": [1, 2]}', '{"n": [1, 2]}'),
+    ('“中文引号” 不影响 {"k": "v"}', '{"k": "v"}'),
+    ('不匹配 {"a": [1} 再来 {"b": null}', '{"b": null}'),
+    ('note {bad ... {"tool_calls": []}', '{"tool_calls": []}'),  # 未闭合候选内部
+    ('说明 {见 {"a": 1} 与 [2]}', '{"a": 1}'),  # 闭合但无法解析的候选内部
+    ('没有 JSON', '没有 JSON'),
+]
+
+
+FIND_JSON_CASES = [
+    ('数组 [1, 2, "]"]', [1, 2, "]"]),
+    ('note {bad ... [{"a": 1}]', [{"a": 1}]),
+    ('{"a": [1} {"b": 2}', {"b": 2}),
+    ('{坏 [1, 2]}', [1, 2]),
+    ('{"a": 1', None),
+]
+
+
+def test_json_extraction():
+    for text, expected in JSON_CASES:
+        actual = normalize_content(text, want_json_only=True)
+        assert actual == expected, f"{text!r}: {actual!r} != {expected!r}"
+    # 增量扫描：逐字符喂入与整段扫描得到同样的候选边界
+    text = "".join(case for case, _ in JSON_CASES)
+    scanner = JsonScanner()
+    spans = [span for ch in text for span in scanner.scan(ch)] + list(scanner.finish())
+    whole = JsonScanner()
+    assert spans == list(whole.scan(text)) + list(whole.finish()), "逐字符扫描结果不一致"
+    # find_json 默认也接受顶层数组（json_schema 校验用，schema 可以是 array）
+    for text, expected in FIND_JSON_CASES:
+        found = find_json(text)
+        assert (found and found[0]) == expected, f"{text!r}: {found!r}"
+    print(f"✓ JSON 提取测试通过：{len(JSON_CASES) + len(FIND_JSON_CASES)} 条")
+
+
+TOOL_CALL_CASES = [
+    ('{"tool_calls":[{"function":{"name":"get","arguments":{"q":"北京"}}}]}', None, ["get"]),
+    ('好的，我来调用：\n```json\n{"tool_calls":[{"name":"get","arguments":"{\\"q\\": \\"}\\"}"}]}\n```\n', "好的，我来调用：", ["get"]),
+    ('```json\n{"tool_calls":[{"name":"a"}]}\n```\n```json\n{"tool_calls":[{"name":"b"}]}\n```', None, ["a", "b"]),
+    ('普通回复\n```python\nprint({1: 2})\n```', '普通回复\n```python\nprint({1: 2})\n```', []),
+    ('配置 {"a": 1} 如上', '配置 {"a": 1} 如上', []),
+    ('{"tool_calls": [{"name": "x"}', '{"tool_calls": [{"name": "x"}', []),
+    ('{"tool_calls": []} 空列表', '{"tool_calls": []} 空列表', []),
+    ('note {bad ... {"tool_calls":[{"name":"a"}]}', 'note {bad ...', ["a"]),
+    ('x {说明 {"tool_calls":[{"name":"b"}]}}', 'x {说明}', ["b"]),
+    ('不匹配 {"x": [1} {"tool_calls":[{"name":"c"}]}', '不匹配 {"x": [1}', ["c"]),
+]
+
+
+def test_tool_calls():
+    rng = random.Random(13)
+    for text, content, names in TOOL_CALL_CASES:
+        actual, calls = extract_tool_calls(text)
+        assert actual == content, f"{text!r}: {actual!r} != {content!r}"
+        assert [c["function"]["name"] for c in calls or []] == names, text
+        for _ in range(200):
+            stream = ToolCallStream()
+            out = []
+            i = 0
+            while i < len(text):
+                size = rng.randint(1, 8)
+                out.append(stream.feed(text[i:i + size])[0])
+                i += size
+            out.append(stream.finish()[0])
+            assert ("".join(out).strip() or None) == content, f"分块结果不一致: {text!r}"
+            assert [c["function"]["name"] for c in stream.calls] == names, text
+    print(f"✓ tool_calls 测试通过：{len(TOOL_CALL_CASES)} 条 × 200 种分块")
+
+
+def _stream(text, chunk_sizes):
+    normalizer = StreamingNormalizer()
+    out = []
+    i = 0
+    for size in chunk_sizes:
+        if i >= len(text):
+            break
+        out.append(normalizer.feed(text[i:i + size]))
+        i += size
+    out.append(normalizer.feed(text[i:]))
+    out.append(normalizer.finish())
+    return "".join(out)
+
+
+def test_streaming_equivalence(cases: int = 2000):
+    """逐字符与随机分块喂入的增量结果须与整段规范化一致（文件创建标签 / Cline 配置复述除外）。"""
+    rng = random.Random(7)
+    corpus = [
+        text for text in build_corpus(cases)
+        if "You are Cline" not in text and not any(tag in text for tag in ("<create_file>", "<file_path>", "<file_content>"))
+    ]
+    mismatches = 0
+    for text in corpus:
+        expected = normalize_content(text)
+        for sizes in ([1] * len(text), [rng.randint(1, 12) for _ in range(len(text))], [rng.randint(1, 300) for _ in range(64)]):
+            actual = _stream(text, sizes)
+            if actual != expected:
+                mismatches += 1
+                if mismatches <= 5:
+                    print("✗ 增量结果不一致:", repr(text[:200]))
+                    print("  expected:", repr(expected[:200]))
+                    print("  actual:  ", repr(actual[:200]))
+    assert mismatches == 0, f"{mismatches} streaming mismatches"
+    print(f"✓ 增量规范化测试通过：{len(corpus)} 条语料 × 3 种分块")
+
+
+def run_benchmark(cases: int, repeat: int):
+    corpus = build_corpus(cases)
+    size = sum(len(t) for t in corpus)
+    print(f"\n=== 基准：{len(corpus)} 条，共 {size / 1024:.0f} KB，重复 {repeat} 次 ===")
+    results = {}
+    for name, fn in (("legacy", legacy_normalize_content), ("compiled", normalize_content)):
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            for text in corpus:
+                fn(text)
+            best = min(best, time.perf_counter() - t0)
+        results[name] = best
+        print(f"{name:>9}: {best * 1000:8.1f} ms")
+    big = corpus[-2]
+    for name, fn in (("legacy", legacy_normalize_content), ("compiled", normalize_content)):
+        t0 = time.perf_counter()
+        for _ in range(repeat * 10):
+            fn(big)
+        print(f"{name:>9}: {(time.perf_counter() - t0) / (repeat * 10) * 1000:8.2f} ms / {len(big) / 1024:.0f} KB 代码回复")
+    # 流式：旧做法每次快照都对累计全文重新规范化（O(n²)），增量规范化只处理新增后缀
+    snapshots = list(range(2000, len(big), 2000)) + [len(big)]
+    t0 = time.perf_counter()
+    for end in snapshots:
+        normalize_content(big[:end])
+    print(f"{'resnap':>9}: {(time.perf_counter() - t0) * 1000:8.1f} ms / {len(snapshots)} 次快照全文重算")
+    t0 = time.perf_counter()
+    _stream(big, [2000] * len(snapshots))
+    print(f"{'stream':>9}: {(time.perf_counter() - t0) * 1000:8.1f} ms / 增量喂入")
+    print(f"加速比: {results['legacy'] / results['compiled']:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回复规范化等价性测试与基准")
+    parser.add_argument("--cases", type=int, default=5000, help="随机语料条数")
+    parser.add_argument("--repeat", type=int, default=3, help="基准重复次数（取最快一次）")
+    args = parser.parse_args()
+    try:
+        test_equivalence(args.cases)
+        test_json_extraction()
+        test_tool_calls()
+        test_streaming_equivalence(min(args.cases, 2000))
+    except AssertionError as e:
+        print("✗ 等价性测试失败:", e)
+        sys.exit(1)
+    run_benchmark(args.cases, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
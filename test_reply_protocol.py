@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回复增量协议测试：DeltaReader 按序号应用页面发来的 [seq] / [seq, offset, text]；
+SseReader 按任意位置切分的原始 SSE 片段还原正文与结束信号。
+
+页面侧的 __dsDelta / __dsOffset（reply_observer.DELTA_LIB）在下方按原逻辑移植为 Python，
+用随机的追加、改写、截断序列验证两端配合后 Python 侧始终还原出页面的完整文本，
+以及丢失更新、页面重载时能重置并经全文重新同步。
+
+用法：
+    python test_reply_protocol.py
+    python -m pytest -q test_reply_protocol.py
+"""
+
+import json
+import random
+import sys
+
+from reply_protocol import DeltaReader, SseReader
+
+
+def _offset(old, text):
+    """__dsOffset：新旧文本的公共前缀长度。"""
+    if text.startswith(old):
+        return len(old)
+    n = min(len(old), len(text))
+    i = 0
+    while i < n and old[i] == text[i]:
+        i += 1
+    return i
+
+
+class PageState:
+    """__dsDelta 的页面侧状态 {seq, text}。"""
+
+    def __init__(self):
+        self.seq = 0
+        self.text = ""
+
+    def delta(self, text, known):
+        if known != self.seq:
+            if text != self.text:
+                self.seq += 1
+                self.text = text
+            return [self.seq, 0, text]
+        if text == self.text:
+            return [self.seq]
+        offset = _offset(self.text, text)
+        self.seq += 1
+        self.text = text
+        return [self.seq, offset, text[offset:]]
+
+
+def _edit(rng, text):
+    r = rng.random()
+    if r < 0.6 or not text:
+        return text + "".join(rng.choice("ab中文 \n`{}") for _ in range(rng.randint(0, 12)))  # 追加（含无变化）
+    if r < 0.85:
+        cut = rng.randint(0, len(text))
+        return text[:cut] + "改写" + text[cut:][:rng.randint(0, 3)]  # 改写中段（如 markdown 重新渲染）
+    return text[:rng.randint(0, len(text))]  # 截断
+
+
+def test_delta_round_trip():
+    rng = random.Random(22)
+    for _ in range(200):
+        page, reader, text = PageState(), DeltaReader(), ""
+        for _ in range(40):
+            text = _edit(rng, text)
+            result = page.delta(text, reader.seq)
+            changed = reader.apply(result)
+            assert changed is not None, f"连续的增量不应要求重新同步: {result!r}"
+            assert reader.text == text, (reader.text, text, result)
+            assert changed == (len(result) == 3), "只有带文本的结果才算有变化"
+    print("✓ 增量往返测试通过：200 组随机编辑序列")
+
+
+def test_delta_offsets():
+    reader = DeltaReader()
+    assert reader.apply([3, 0, "你好"]) is True and (reader.seq, reader.text) == (3, "你好")  # 首次同步：全文
+    assert reader.apply([4, 2, "，世界"]) is True and reader.text == "你好，世界"  # 追加：offset 为旧长度
+    assert reader.apply([5, 1, "们"]) is True and reader.text == "你们"  # 改写：保留 offset 之前的部分
+    assert reader.apply([5]) is False and reader.text == "你们"  # 未变化
+    assert reader.apply([6, 0, "重写"]) is True and reader.text == "重写"  # offset 为 0 时总是接受全文
+    print("✓ 增量偏移测试通过")
+
+
+def test_delta_resync():
+    reader = DeltaReader()
+    reader.apply([1, 0, "abc"])
+    assert reader.apply([3, 3, "d"]) is None, "跳过了序号 2（丢失更新）"
+    assert (reader.seq, reader.text) == (-1, ""), "重置后等待全文"
+    reader.apply([1, 0, "abc"])
+    assert reader.apply([2, 9, "d"]) is None, "offset 超出已知文本"
+    reader.apply([1, 0, "abc"])
+    assert reader.apply([7]) is None, "页面序号与本地不一致（页面已重载）"
+    for bad in (None, [], ["x"], [1, "y", "z"], 5):
+        reader.apply([1, 0, "abc"])
+        assert reader.apply(bad) is None and reader.seq == -1, bad
+    reader.apply([1, 0, "abc"])
+    assert reader.apply([2, 0, None]) is True and reader.text == "", "非字符串文本按空串处理"
+
+    # 页面重载后序号从头开始：Python 侧已知序号对不上，页面发全文
+    page, reader = PageState(), DeltaReader()
+    reader.apply(page.delta("旧文档的回复", reader.seq))
+    page = PageState()
+    result = page.delta("新文档", reader.seq)
+    assert result == [1, 0, "新文档"] and reader.apply(result) is True and reader.text == "新文档"
+    print("✓ 重新同步测试通过")
+
+
+# JSON Patch 式事件流：先是深度思考片段（不计入正文），再是正文片段，最后 BATCH 中的结束状态
+PATCH_STREAM = "".join(line + "\n" for line in [
+    'data: ' + json.dumps({"v": {"response": {"message_id": 2, "status": "WIP",
+                                               "fragments": [{"type": "THINK", "content": "想"}]}}}),
+    'data: ' + json.dumps({"p": "response/fragments/-1/content", "o": "APPEND", "v": "一想"}),
+    'data: ' + json.dumps({"v": "再想"}),
+    '',
+    'data: ' + json.dumps({"p": "response/fragments", "o": "APPEND", "v": [{"type": "RESPONSE", "content": "你"}]}),
+    'data: ' + json.dumps({"p": "response/fragments/-1/content", "v": "好"}),
+    'data: ' + json.dumps({"v": "，世界\n```python\nprint(1)\n```"}, ensure_ascii=False),
+    ': keep-alive',
+    'data: ' + json.dumps({"p": "response", "o": "BATCH", "v": [
+        {"p": "accumulated_token_usage", "v": 12}, {"p": "quasi_status", "v": "FINISHED"}]}),
+    'event: close',
+])
+PATCH_TEXT = "你好，世界\n```python\nprint(1)\n```"
+
+OPENAI_STREAM = "".join(line + "\r\n" for line in [
+    'data: ' + json.dumps({"choices": [{"delta": {"type": "thinking", "content": "思考"}}]}),
+    'data: ' + json.dumps({"choices": [{"delta": {"content": "Hello"}}]}),
+    'data: not json',
+    'data: ' + json.dumps({"choices": [{"delta": {"content": " 世界"}, "finish_reason": None}]}),
+    'data: ' + json.dumps({"choices": [{"delta": {}, "finish_reason": "stop"}]}),
+    'data: [DONE]',
+])
+
+
+def _feed_chunks(stream, sizes):
+    reader = SseReader()
+    changes = []
+    i = 0
+    for size in sizes:
+        if i >= len(stream):
+            break
+        changes.append(reader.feed(stream[i:i + size]))
+        i += size
+    if i < len(stream):
+        changes.append(reader.feed(stream[i:]))
+    return reader, changes
+
+
+def test_sse_chunking():
+    rng = random.Random(24)
+    for stream, text in ((PATCH_STREAM, PATCH_TEXT), (OPENAI_STREAM, "Hello 世界")):
+        whole, _ = _feed_chunks(stream, [len(stream)])
+        assert whole.text == text and whole.finished, (whole.text, whole.finished)
+        for _ in range(300):
+            reader, _ = _feed_chunks(stream, [rng.randint(1, 16) for _ in range(len(stream))])
+            assert reader.text == text and reader.finished, "任意切分的结果应与整段一致"
+    print("✓ SSE 任意切分测试通过：2 种格式 × 300 种切分")
+
+
+def test_sse_partial_lines():
+    reader = SseReader()
+    line = 'data: {"choices": [{"delta": {"content": "半行"}}]}'
+    assert reader.feed(line[:20]) is False and reader.text == ""
+    assert reader.feed(line[20:]) is False and reader.text == "", "行未结束前不解析"
+    assert reader.feed("\n") is True and reader.text == "半行"
+    assert reader.feed("\n") is False, "空行不改变正文"
+    assert not reader.finished
+    assert reader.feed("event: done\n") is False and reader.finished
+
+    # response/content 的 SET 重置正文；status FINISHED 为结束信号
+    reader = SseReader()
+    reader.feed('data: {"p": "response/content", "o": "APPEND", "v": "旧"}\n')
+    assert reader.feed('data: {"p": "response/content", "o": "SET", "v": "新"}\n') is True
+    assert reader.text == "新"
+    assert reader.feed('data: {"v": "的"}\n') is True and reader.text == "的", "省略 p、o 时沿用上一条的 SET"
+    reader.feed('data: {"p": "response/status", "v": "FINISHED"}\n')
+    assert reader.finished
+    print("✓ SSE 半行缓冲 / 结束信号测试通过")
+
+
+def main():
+    try:
+        test_delta_round_trip()
+        test_delta_offsets()
+        test_delta_resync()
+        test_sse_chunking()
+        test_sse_partial_lines()
+    except AssertionError as e:
+        print("✗ 增量协议测试失败:", e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+在途请求合并测试：相同请求并发到达时只占用一次浏览器执行，后到者 X-Cache 为 COALESCED；
+cache=bypass 的请求总是独立执行；等待超时时的提示与实际等待时间一致。用 aiohttp 测试客户端驱动 api_server，队列另一端由协程模拟 Qt 侧。
+
+用法：
+    python test_request_coalescing.py
+    python -m pytest -q test_request_coalescing.py
+"""
+
+import asyncio
+import os
+import sys
+from queue import Queue
+
+
+def _body(text, **extra):
+    return {"model": "deepseek-chat", "stream": False, "messages": [{"role": "user", "content": text}], **extra}
+
+
+async def _fake_tab(queue, responses, executed, delay=0.2):
+    """模拟标签页：取出请求，稍等后写回回复并唤醒事件循环。"""
+    while True:
+        while queue.empty():
+            await asyncio.sleep(0.01)
+        request_id, payload, event, _channel = queue.get()
+        executed.append(payload)
+        await asyncio.sleep(delay)
+        responses[request_id] = f"回复 {len(executed)}"
+        event.set()
+
+
+def test_coalescing():
+    os.environ["DEEPSEEK_BATCH_DB"] = ""
+    os.environ["DEEPSEEK_TRACE_LOG"] = ""
+    from aiohttp.test_utils import TestClient, TestServer
+    from api_server import create_app
+
+    async def run():
+        queue, responses, executed = Queue(), {}, []
+        async with TestClient(TestServer(create_app(queue, responses))) as client:
+            tab = asyncio.create_task(_fake_tab(queue, responses, executed))
+            try:
+                first, second = await asyncio.gather(
+                    client.post("/v1/chat/completions", json=_body("同一个问题")),
+                    client.post("/v1/chat/completions", json=_body("同一个问题")),
+                )
+                contents = [(await r.json())["choices"][0]["message"]["content"] for r in (first, second)]
+                assert len(executed) == 1, f"相同请求应只执行一次，实际 {len(executed)} 次"
+                assert contents[0] == contents[1]
+                assert sorted(r.headers["X-Cache"] for r in (first, second)) == ["COALESCED", "MISS"]
+
+                await asyncio.gather(
+                    client.post("/v1/chat/completions", json=_body("不合并", cache="bypass")),
+                    client.post("/v1/chat/completions", json=_body("不合并", cache="bypass")),
+                )
+                assert len(executed) == 3, "cache=bypass 的请求应各自执行"
+            finally:
+                tab.cancel()
+
+    asyncio.run(run())
+    print("✓ 在途请求合并测试通过")
+
+
+def test_timeout_message():
+    os.environ["DEEPSEEK_BATCH_DB"] = ""
+    os.environ["DEEPSEEK_TRACE_LOG"] = ""
+    from aiohttp.test_utils import TestClient, TestServer
+    import api_server
+
+    async def run():
+        queue = Queue()  # 没有标签页取请求：等待超时
+        async with TestClient(TestServer(api_server.create_app(queue, {}))) as client:
+            resp = await client.post("/v1/chat/completions", json=_body("没人回答"))
+            content = (await resp.json())["choices"][0]["message"]["content"]
+            assert content == "Request timeout (no reply within 1s).", content
+
+    saved = api_server.REPLY_TIMEOUT
+    api_server.REPLY_TIMEOUT = 1.0
+    try:
+        asyncio.run(run())
+    finally:
+        api_server.REPLY_TIMEOUT = saved
+    print("✓ 超时提示与等待时间一致测试通过")
+
+
+def main():
+    try:
+        test_coalescing()
+        test_timeout_message()
+    except AssertionError as e:
+        print("✗ 合并测试失败:", e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
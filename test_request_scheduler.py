@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求调度测试：FairScheduler 的跨租户加权公平顺序，ClientPolicy 的租户 / 优先级判定，
+AdmissionController 的 429 / 503 判定与 Retry-After（含 API 层的响应头）。
+
+用法：
+    python test_request_scheduler.py
+    python -m pytest -q test_request_scheduler.py
+"""
+
+import asyncio
+import os
+import sys
+from queue import Empty, Queue
+
+from request_scheduler import AdmissionController, ClientPolicy, FairScheduler
+
+
+def _drain(scheduler):
+    out = []
+    while True:
+        try:
+            out.append(scheduler.get_nowait())
+        except Empty:
+            return out
+
+
+def _item(name):
+    return (name, "payload", None, None)
+
+
+def test_weighted_fair_order():
+    scheduler = FairScheduler({"a": 3, "b": 1})
+    for i in range(8):
+        scheduler.put(_item(f"a{i}"), client="a")
+    for i in range(8):
+        scheduler.put(_item(f"b{i}"), client="b")
+    order = [item[0] for item in _drain(scheduler)]
+    assert order[:8] == ["a0", "b0", "a1", "a2", "a3", "b1", "a4", "a5"], order
+    assert [n for n in order if n[0] == "b"] == [f"b{i}" for i in range(8)], "同一租户内保持到达顺序"
+    assert scheduler.empty() and scheduler.qsize() == 0
+    print("✓ 加权公平顺序测试通过")
+
+
+def test_priority_and_deadline():
+    scheduler = FairScheduler()
+    for i in range(3):
+        scheduler.put(_item(f"bulk{i}"), client="bulk", priority=-1)
+    scheduler.put(_item("late"), client="chat", deadline=200.0)
+    scheduler.put(_item("soon"), client="chat", deadline=100.0)
+    scheduler.put(_item("urgent"), client="other", priority=5)
+    order = [item[0] for item in _drain(scheduler)]
+    assert order[0] == "urgent", "显式优先级跨租户生效"
+    assert order.index("soon") < order.index("late"), "同一租户内截止时间早的先执行"
+    assert order[-3:] == ["bulk0", "bulk1", "bulk2"], order
+    print("✓ 优先级 / 截止时间测试通过")
+
+
+def test_idle_tenant_no_credit():
+    scheduler = FairScheduler()
+    for i in range(4):
+        scheduler.put(_item(f"busy{i}"), client="busy")
+    _drain(scheduler)
+    for i in range(4):
+        scheduler.put(_item(f"busy{i}"), client="busy")
+        scheduler.put(_item(f"idle{i}"), client="idle")
+    order = [item[0][:4] for item in _drain(scheduler)]
+    # 空闲后回来的租户从当前虚拟时钟开始，不能用空闲期攒下的额度连续插队
+    assert order[:4].count("idle") == 2, order
+    assert scheduler.remove("missing") is False
+    scheduler.put(_item("x"), client="c")
+    assert scheduler.remove("x") is True and scheduler.empty()
+    print("✓ 空闲租户不攒额度测试通过")
+
+
+def test_client_policy():
+    keys = ClientPolicy.parse_keys("sk-a=cline:5, sk-b=batch,bad,=x,sk-c=,sk-d=eval:oops")
+    assert keys == {"sk-a": ("cline", 5), "sk-b": ("batch", 0), "sk-d": ("eval", 0)}, keys
+    policy = ClientPolicy(keys)
+    # 配置的 Key：租户来自配置，优先级限制在 [MIN_PRIORITY, 上限]
+    assert policy.resolve("sk-a", "whoever", 3) == ("cline", 3)
+    assert policy.resolve("sk-a", "whoever", 99) == ("cline", 5)
+    assert policy.resolve("sk-a", "whoever", -99) == ("cline", ClientPolicy.MIN_PRIORITY)
+    assert policy.resolve("sk-b", "x", "7") == ("batch", 0)
+    # 未配置的 Key / 没有 Key：自报名称拿不到配置的租户，优先级不能高于 0
+    assert policy.resolve("", "cline", 10) == ("anon:cline", 0)
+    assert policy.resolve("sk-unknown", "10.0.0.1", -3) == ("anon:10.0.0.1", -3)
+    assert policy.resolve(None, "", "high") == ("anon:default", 0)
+    print("✓ ClientPolicy 测试通过")
+
+
+def test_admission_decide():
+    admission = AdmissionController(workers=2, default_service=10.0, min_samples=3)
+    # 样本不足时只估算不拒绝
+    assert admission.decide(queued=50, running=2, client_queued=0, budget=1.0)[0] is None
+    for _ in range(3):
+        admission.record(10.0)
+    status, retry_after, position, eta = admission.decide(queued=4, running=2, client_queued=0, budget=60.0)
+    assert (status, retry_after, position, eta) == (None, 0, 5, 35.0)  # 4/2×10 + 10/2 + 10
+    status, retry_after, _, eta = admission.decide(queued=4, running=2, client_queued=1, budget=20.0)
+    assert (status, retry_after) == (503, 15), "其他客户端占满队列时返回 503"
+    status, retry_after, _, _ = admission.decide(queued=4, running=2, client_queued=2, budget=20.0)
+    assert (status, retry_after) == (429, 15), "自身占队列一半以上时返回 429"
+    assert admission.decide(queued=0, running=0, client_queued=0, budget=0.5)[:2] == (503, 10)
+    assert admission.rejected == 3
+    print("✓ 准入判定测试通过")
+
+
+def test_admission_http():
+    os.environ["DEEPSEEK_BATCH_DB"] = ""
+    os.environ["DEEPSEEK_TRACE_LOG"] = ""
+    from aiohttp.test_utils import TestClient, TestServer
+    from api_server import create_app
+
+    async def run():
+        queue, responses = Queue(), {}
+
+        async def fake_tab():
+            while True:
+                while queue.empty():
+                    await asyncio.sleep(0.01)
+                request_id, _payload, event, channel = queue.get()
+                channel.mark_started()
+                await asyncio.sleep(1.2)
+                responses[request_id] = "ok"
+                event.set()
+
+        def body(i, **extra):
+            return {"model": "m", "stream": False, "cache": "bypass",
+                    "messages": [{"role": "user", "content": f"q{i}"}], **extra}
+
+        async with TestClient(TestServer(create_app(queue, responses))) as client:
+            tab = asyncio.create_task(fake_tab())
+            try:
+                # 积累 min_samples 个服务时间样本（约 1.2s / 次）
+                for i in range(3):
+                    resp = await client.post("/v1/chat/completions", json=body(i))
+                    assert resp.status == 200 and "X-Queue-ETA" in resp.headers
+                resp = await client.post("/v1/chat/completions", json=body(9, timeout=0.5))
+                data = await resp.json()
+                assert resp.status == 503, (resp.status, data)
+                assert int(resp.headers["Retry-After"]) >= 1 and data["error"]["type"] == "server_overloaded"
+                assert queue.empty(), "被拒绝的请求不应进入队列"
+            finally:
+                tab.cancel()
+
+    asyncio.run(run())
+    print("✓ API 准入 503 / Retry-After 测试通过")
+
+
+def main():
+    try:
+        test_weighted_fair_order()
+        test_priority_and_deadline()
+        test_idle_tenant_no_credit()
+        test_client_policy()
+        test_admission_decide()
+        test_admission_http()
+    except AssertionError as e:
+        print("✗ 调度测试失败:", e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回复缓存测试：ResponseCache 的 LRU 淘汰、TTL 过期与磁盘层回填，MemoCache 的 LRU 淘汰。
+
+用法：
+    python test_response_cache.py
+    python -m pytest -q test_response_cache.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from response_cache import MemoCache, ResponseCache, cache_key
+
+
+def test_lru_eviction():
+    cache = ResponseCache(max_entries=2, ttl=60)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"  # a 变为最近使用
+    cache.put("c", "C")  # 淘汰最久未用的 b
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+    stats = cache.snapshot()
+    assert (stats["evictions"], stats["entries"], stats["hits"], stats["misses"]) == (1, 2, 3, 1), stats
+    disabled = ResponseCache(max_entries=0)
+    disabled.put("a", "A")
+    assert disabled.get("a") is None, "max_entries=0 时不缓存"
+
+    memo = MemoCache(max_entries=2)
+    memo.put("x", 1)
+    memo.put("y", 2)
+    assert memo.get("x") == 1
+    memo.put("z", 3)
+    assert memo.get("y") is None and memo.get("x") == 1 and memo.get("z") == 3
+    assert memo.snapshot()["evictions"] == 1
+    print("✓ LRU 淘汰测试通过")
+
+
+def test_ttl_expiry():
+    cache = ResponseCache(max_entries=8, ttl=0.05)
+    cache.put("k", "v")
+    assert cache.get("k") == "v"
+    time.sleep(0.1)
+    assert cache.get("k") is None, "过期条目应视为未命中"
+    assert cache.snapshot()["entries"] == 0, "过期条目应在查找时移除"
+    print("✓ TTL 过期测试通过")
+
+
+def test_disk_layer():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache", "responses.db")
+        ResponseCache(max_entries=1, ttl=60, disk_path=path).put("k", "持久化")
+        cache = ResponseCache(max_entries=1, ttl=60, disk_path=path)  # 模拟重启：内存层为空
+        assert cache.get("k") == "持久化"
+        assert cache.get("k") == "持久化"
+        stats = cache.snapshot()
+        assert (stats["disk_hits"], stats["hits"]) == (1, 1), "磁盘命中后应回填内存层"
+        cache._db.close()
+        expired = ResponseCache(ttl=0.05, disk_path=path)
+        expired.put("old", "x")
+        expired._db.close()
+        time.sleep(0.1)
+        reopened = ResponseCache(ttl=0.05, disk_path=path)
+        assert reopened.get("old") is None, "过期的磁盘条目应视为未命中"
+        reopened._db.close()
+    print("✓ 磁盘层测试通过")
+
+
+def test_cache_key():
+    assert cache_key({"a": 1, "b": [1, 2]}) == cache_key({"b": [1, 2], "a": 1})
+    assert cache_key({"a": "中文"}) != cache_key({"a": "中"})
+    print("✓ 缓存键测试通过")
+
+
+def main():
+    try:
+        test_lru_eviction()
+        test_ttl_expiry()
+        test_disk_layer()
+        test_cache_key()
+    except AssertionError as e:
+        print("✗ 缓存测试失败:", e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
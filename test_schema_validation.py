@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+response_format=json_schema 校验测试
+
+覆盖内置编译器的各个关键字、SchemaCache 的命中与淘汰统计、不合法 schema 在 API 层直接返回 400，
+以及 make_repair / repair_message 生成的会话内修复追问。
+
+用法：
+    python test_schema_validation.py
+    python -m pytest -q test_schema_validation.py
+"""
+
+import asyncio
+import os
+import sys
+from queue import Queue
+
+from schema_validation import SchemaCache, SchemaError, _compile, make_repair, repair_message
+
+
+def _errors(schema, value):
+    errors = []
+    _compile(schema)(value, "$", errors)
+    return errors
+
+
+# (schema, 通过的取值, 不通过的取值)
+KEYWORD_CASES = [
+    ({"type": "integer"}, [1, 2.0], [1.5, "1", True]),
+    ({"type": ["string", "null"]}, ["a", None], [1, []]),
+    ({"enum": ["a", 1]}, ["a", 1], ["b", 2]),
+    ({"const": {"k": 1}}, [{"k": 1}], [{"k": 2}]),
+    ({"type": "object", "properties": {"a": {"type": "string"}}, "required": ["a"]},
+     [{"a": "x"}, {"a": "x", "b": 1}], [{}, {"a": 1}]),
+    ({"type": "object", "additionalProperties": False, "properties": {"a": {}}}, [{"a": 1}], [{"a": 1, "b": 2}]),
+    ({"type": "object", "additionalProperties": {"type": "number"}}, [{"x": 1.5}], [{"x": "1"}]),
+    ({"type": "array", "items": {"type": "number"}, "minItems": 1, "maxItems": 2}, [[1], [1, 2]], [[], [1, 2, 3], ["a"]]),
+    ({"type": "string", "minLength": 2, "maxLength": 3, "pattern": "^[a-z]+$"}, ["ab", "abc"], ["a", "abcd", "AB"]),
+    ({"type": "number", "minimum": 0, "maximum": 10}, [0, 10, 5.5], [-1, 10.5]),
+    ({"anyOf": [{"type": "string"}, {"type": "integer"}]}, ["a", 1], [1.5, None]),
+    ({"oneOf": [{"type": "number"}, {"type": "integer"}]}, [1.5], [1, "a"]),
+    ({"allOf": [{"type": "string"}, {"minLength": 2}]}, ["ab"], ["a", 1]),
+    (True, [1, None], []),
+    (False, [], [1, None]),
+]
+
+
+def test_builtin_keywords():
+    for schema, good, bad in KEYWORD_CASES:
+        for value in good:
+            assert not _errors(schema, value), f"{schema!r} 应接受 {value!r}: {_errors(schema, value)}"
+        for value in bad:
+            assert _errors(schema, value), f"{schema!r} 应拒绝 {value!r}"
+    # 类型不符时不再报告更细的错误；嵌套路径出现在错误描述中
+    assert len(_errors({"type": "string", "minLength": 5}, 1)) == 1
+    assert _errors({"properties": {"a": {"items": {"type": "string"}}}}, {"a": ["x", 2]})[0].startswith("$.a[1]:")
+    for schema in ({"type": "text"}, {"enum": "a"}, {"properties": ["a"]}, {"pattern": "("}, {"anyOf": {}}, []):
+        try:
+            _compile(schema)
+        except SchemaError:
+            continue
+        raise AssertionError(f"{schema!r} 应被判为不合法 schema")
+    print(f"✓ 内置编译器关键字测试通过：{len(KEYWORD_CASES)} 组")
+
+
+def test_schema_cache():
+    cache = SchemaCache(max_entries=2)
+    a = cache.get({"type": "object", "required": ["a"]})
+    assert cache.get({"required": ["a"], "type": "object"}) is a, "键顺序不同的同一 schema 应命中缓存"
+    cache.get({"type": "string"})
+    cache.get({"type": "array"})  # 淘汰最久未用的 a
+    assert cache.get({"type": "object", "required": ["a"]}) is not a
+    try:
+        cache.get({"type": "nope"})
+    except SchemaError:
+        pass
+    else:
+        raise AssertionError("不合法 schema 应抛出 SchemaError")
+    stats = cache.snapshot()
+    assert (stats["hits"], stats["compiles"], stats["evictions"], stats["invalid_schemas"]) == (1, 4, 2, 1), stats
+    assert stats["entries"] == 2
+    print("✓ SchemaCache 命中 / 淘汰测试通过")
+
+
+def test_repair():
+    compiled = SchemaCache().get({"type": "object", "properties": {"n": {"type": "integer"}}, "required": ["n"]})
+    repair = make_repair(compiled)
+    assert repair('```json\n{"n": 3}\n```') is None
+    message = repair('结果：{"n": "3"}')
+    assert message.startswith("[约束]") and "$.n" in message, message
+    assert "没有可解析的 JSON" in repair("无法回答")
+    lines = repair_message([f"$.f{i}: 错误" for i in range(10)]).splitlines()
+    assert sum(1 for line in lines if line.startswith("- ")) == 5, "追问最多列出 MAX_ERRORS 条错误"
+    print("✓ 修复追问测试通过")
+
+
+def test_invalid_schema_400():
+    os.environ["DEEPSEEK_BATCH_DB"] = ""
+    os.environ["DEEPSEEK_TRACE_LOG"] = ""
+    from aiohttp.test_utils import TestClient, TestServer
+    from api_server import create_app
+
+    async def run():
+        queue = Queue()
+        async with TestClient(TestServer(create_app(queue, {}))) as client:
+            resp = await client.post("/v1/chat/completions", json={
+                "model": "deepseek-chat",
+                "stream": False,
+                "messages": [{"role": "user", "content": "hi"}],
+                "response_format": {"type": "json_schema", "json_schema": {"name": "x", "schema": {"type": "nope"}}},
+            })
+            body = await resp.json()
+            assert resp.status == 400, (resp.status, body)
+            assert "json_schema" in body["error"]["message"]
+            assert queue.empty(), "不合法 schema 的请求不应进入浏览器队列"
+
+    asyncio.run(run())
+    print("✓ 不合法 schema 返回 400 测试通过")
+
+
+def test_repaired_header():
+    os.environ["DEEPSEEK_BATCH_DB"] = ""
+    os.environ["DEEPSEEK_TRACE_LOG"] = ""
+    from aiohttp.test_utils import TestClient, TestServer
+    from api_server import create_app
+
+    body = {
+        "model": "deepseek-chat",
+        "stream": False,
+        "messages": [{"role": "user", "content": "给出 n"}],
+        "response_format": {"type": "json_schema", "json_schema": {
+            "name": "n", "schema": {"type": "object", "properties": {"n": {"type": "integer"}}, "required": ["n"]}}},
+    }
+
+    async def run():
+        queue, responses = Queue(), {}
+
+        async def fake_tab():
+            # 模拟 Qt 侧：经过一次会话内修复追问后写回符合 schema 的回复
+            while queue.empty():
+                await asyncio.sleep(0.01)
+            request_id, _payload, event, channel = queue.get()
+            channel.repaired = True
+            responses[request_id] = '{"n": 3}'
+            event.set()
+
+        async with TestClient(TestServer(create_app(queue, responses))) as client:
+            tab = asyncio.create_task(fake_tab())
+            resp = await client.post("/v1/chat/completions", json=body)
+            await tab
+            assert resp.status == 200, await resp.text()
+            assert resp.headers["X-Schema-Validation"] == "repaired", resp.headers.get("X-Schema-Validation")
+            resp = await client.post("/v1/chat/completions", json=body)  # 缓存命中：重新校验
+            assert resp.headers["X-Cache"] == "HIT" and resp.headers["X-Schema-Validation"] == "valid"
+
+    asyncio.run(run())
+    print("✓ X-Schema-Validation 修复状态测试通过")
+
+
+def main():
+    try:
+        test_builtin_keywords()
+        test_schema_cache()
+        test_repair()
+        test_invalid_schema_400()
+        test_repaired_header()
+    except AssertionError as e:
+        print("✗ schema 校验测试失败:", e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+会话复用测试：消息规范化与指纹（与 api_server 记录 / 查找的方式一致），SessionStore 的查找、TTL 与淘汰，
+以及 api_server 投递时首轮 / 未命中新开对话、命中续写原对话。
+
+用法：
+    python test_session_store.py
+    python -m pytest -q test_session_store.py
+"""
+
+import asyncio
+import os
+import sys
+import time
+from queue import Queue
+
+from session_store import NEW_CONVERSATION, SessionStore, canonical_message, fingerprint, split_turn, turn_text
+
+BLOCK = "instruction-block-key"
+
+
+def _remembered_key(messages, reply):
+    """api_server._remember_session 记录的键：历史 + 新一轮 + 本次回复。"""
+    history, turn = split_turn(messages)
+    return fingerprint(BLOCK, history + turn + [canonical_message(reply)])
+
+
+def _lookup_key(messages):
+    """api_server._prepare_chat 查找时的键：最后一条 assistant 之前（含）的历史；首轮为 None。"""
+    history, _ = split_turn(messages)
+    return fingerprint(BLOCK, history) if history else None
+
+
+def test_fingerprint_lookup():
+    first = [{"role": "system", "content": "sys"}, {"role": "user", "content": "你好"}]
+    reply = {"role": "assistant", "content": "你好！"}
+    store = SessionStore()
+    assert store.claim(_lookup_key(first)) is None, "首轮没有可续写的对话"
+    store.remember(_remembered_key(first, reply), "https://chat.deepseek.com/a/chat/s/1")
+
+    # 客户端下一轮带回完整历史：system 变化不影响、空白与内容分片形式不影响
+    second = [
+        {"role": "system", "content": "另一个系统提示"},
+        {"role": "user", "content": [{"type": "text", "text": " 你好 "}]},
+        {"role": "assistant", "content": "你好！\n"},
+        {"role": "user", "content": "继续"},
+    ]
+    history, turn = split_turn(second)
+    assert turn_text(turn) == "继续"
+    assert store.claim(_lookup_key(second)) == "https://chat.deepseek.com/a/chat/s/1"
+    assert store.claim(_lookup_key(second)) is None, "claim 后条目被取走，并发分支不会续写同一对话"
+
+    # 历史被改写（不同的助手回复）不命中
+    store.remember(_remembered_key(first, reply), "https://chat.deepseek.com/a/chat/s/1")
+    edited = second[:2] + [{"role": "assistant", "content": "别的回复"}] + second[3:]
+    assert store.claim(_lookup_key(edited)) is None
+    stats = store.snapshot()
+    assert (stats["reused"], stats["new"], stats["remembered"]) == (1, 3, 2), stats
+    print("✓ 指纹查找测试通过")
+
+
+def test_tool_call_fingerprint():
+    # OpenAI 的 arguments 为字符串、Ollama 为对象，键顺序不同也视为同一调用
+    a = canonical_message({"role": "assistant", "content": None, "tool_calls": [
+        {"id": "1", "function": {"name": "read", "arguments": '{"b": 2, "a": 1}'}}]})
+    b = canonical_message({"role": "assistant", "tool_calls": [
+        {"function": {"name": "read", "arguments": {"a": 1, "b": 2}}}]})
+    assert a == b == ["assistant", "", [["read", '{"a":1,"b":2}']]]
+    _, turn = split_turn([{"role": "assistant", "content": "x"}, {"role": "tool", "content": "结果"},
+                          {"role": "user", "content": "然后"}])
+    assert turn_text(turn) == "[工具结果]\n结果\n\n然后"
+    print("✓ 工具调用指纹测试通过")
+
+
+def test_store_expiry_and_eviction():
+    store = SessionStore(max_entries=2, ttl=0.05)
+    store.remember("k1", "u1")
+    time.sleep(0.1)
+    assert store.claim("k1") is None, "过期的对话不再续写"
+    store = SessionStore(max_entries=2)
+    store.remember("k1", "u1")
+    store.remember("k2", "u2")
+    store.remember("k3", "u3")
+    assert store.claim("k1") is None and store.snapshot()["evictions"] == 1
+    store.remember("k4", "u2")  # 同一对话续写后只保留最新前缀
+    assert store.claim("k2") is None and store.claim("k4") == "u2"
+    assert store.claim("") is None and store.claim(None) is None
+    print("✓ SessionStore 过期 / 淘汰测试通过")
+
+
+def test_dispatch_conversation():
+    os.environ["DEEPSEEK_BATCH_DB"] = ""
+    os.environ["DEEPSEEK_TRACE_LOG"] = ""
+    from aiohttp.test_utils import TestClient, TestServer
+    from api_server import create_app
+
+    def body(messages):
+        return {"model": "deepseek-chat", "stream": False, "cache": "bypass", "messages": messages}
+
+    async def run():
+        queue, responses, seen = Queue(), {}, []
+
+        async def fake_tab():
+            # 模拟 Qt 侧：新开对话时分配新的对话 URL，续写时沿用目标 URL
+            while True:
+                while queue.empty():
+                    await asyncio.sleep(0.01)
+                request_id, payload, event, channel = queue.get()
+                seen.append((channel.conversation, payload))
+                url = channel.conversation
+                if url == NEW_CONVERSATION:
+                    url = f"https://chat.deepseek.com/a/chat/s/{len(seen)}"
+                channel.conversation_url = url
+                responses[request_id] = f"回复{len(seen)}"
+                event.set()
+
+        async with TestClient(TestServer(create_app(queue, responses))) as client:
+            tab = asyncio.create_task(fake_tab())
+            try:
+                a = [{"role": "user", "content": "会话 A"}]
+                b = [{"role": "user", "content": "会话 B"}]
+                await client.post("/v1/chat/completions", json=body(a))
+                await client.post("/v1/chat/completions", json=body(b))
+                assert [c for c, _ in seen] == [NEW_CONVERSATION] * 2, "首轮不能发到页面当前显示的对话"
+                a += [{"role": "assistant", "content": "回复1"}, {"role": "user", "content": "A 继续"}]
+                await client.post("/v1/chat/completions", json=body(a))
+                assert seen[-1] == ("https://chat.deepseek.com/a/chat/s/1", "A 继续"), seen[-1]
+                miss = [{"role": "user", "content": "会话 C"}, {"role": "assistant", "content": "别的"},
+                        {"role": "user", "content": "继续"}]
+                await client.post("/v1/chat/completions", json=body(miss))
+                assert seen[-1][0] == NEW_CONVERSATION and seen[-1][1] != "继续", "未命中时新开对话发送完整指令"
+            finally:
+                tab.cancel()
+
+    asyncio.run(run())
+    print("✓ 首轮 / 未命中新开对话、命中续写测试通过")
+
+
+def main():
+    try:
+        test_fingerprint_lookup()
+        test_tool_call_fingerprint()
+        test_store_expiry_and_eviction()
+        test_dispatch_conversation()
+    except AssertionError as e:
+        print("✗ 会话复用测试失败:", e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
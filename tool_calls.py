@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+函数调用（tool_calls）解析：把网页回复中的 {"tool_calls": [...]} 转为 OpenAI / Ollama 的结构化字段。
+
+开启 function call 时系统提示要求模型只输出 {"tool_calls":[...]} JSON；模型常常还会包一层
+```json 代码块或在前面加一句说明。ToolCallStream 用 JsonScanner 线性扫描规范化后的回复：
+普通文本照常作为 content 输出，疑似 JSON 开始后扣留，闭合后若是工具调用则转为 tool_calls
+（连同包裹的代码块一起从 content 中去掉），否则原样作为 content 放行。
+"""
+
+import itertools
+import json
+import re
+import uuid
+
+from content_normalizer import JsonScanner
+
+# 工具调用 JSON 前的 ```json 代码块开头（与候选一起扣留，确认是工具调用后一并去掉）
+_FENCE_OPEN_RE = re.compile(r"(?:^|\n)[ \t]*```[a-zA-Z]*[ \t]*\n?[ \t]*$")
+# 末尾以反引号开头、尚未写完的行（可能是代码块开头，暂缓放行）
+_FENCE_TAIL_RE = re.compile(r"(?:^|\n)[ \t]*`[^\n]*$")
+# 工具调用 JSON 之后的代码块结尾
+_FENCE_CLOSE_RE = re.compile(r"\s*```[ \t]*(?:\n|$)")
+
+ARGUMENT_CHUNK = 512  # 流式输出时每个 delta.tool_calls 携带的 arguments 片段长度
+
+
+def _normalize_call(item):
+    """单个工具调用规范为 OpenAI 结构；arguments 统一为 JSON 字符串。无法识别时返回 None。"""
+    if not isinstance(item, dict):
+        return None
+    fn = item["function"] if isinstance(item.get("function"), dict) else item
+    name = fn.get("name")
+    if not name or not isinstance(name, str):
+        return None
+    args = fn.get("arguments", fn.get("parameters"))
+    if not isinstance(args, str):
+        args = json.dumps(args if args is not None else {}, ensure_ascii=False)
+    call_id = item.get("id")
+    return {
+        "id": call_id if isinstance(call_id, str) and call_id else "call_" + uuid.uuid4().hex[:24],
+        "type": "function",
+        "function": {"name": name, "arguments": args},
+    }
+
+
+def tool_calls_from_json(obj):
+    """{"tool_calls": [...]} 转为规范化的调用列表；不是工具调用时返回 None。"""
+    if not isinstance(obj, dict) or not isinstance(obj.get("tool_calls"), list):
+        return None
+    calls = [c for c in map(_normalize_call, obj["tool_calls"]) if c is not None]
+    return calls or None
+
+
+class ToolCallStream:
+    """函数调用模式下的流式闸门：feed() / finish() 返回 (content 增量, 新出现的 tool_calls 列表)。
+
+    扣留候选期间新文本只追加到列表，闭合时才拼接解析；括号不匹配、无法解析或到结尾仍未闭合的候选
+    在其内部继续查找工具调用（如 "note {bad ... {"tool_calls": [...]}"）。
+    """
+
+    def __init__(self):
+        self._scanner = JsonScanner("{")
+        self._parts = []  # 尚未放行的文本
+        self._base = 0  # _parts 开头在全文中的偏移
+        self._held_at = -1  # 已确定扣留的候选起点，扣留期间无需重新拼接
+        self._after_call = False  # 刚转换过一个工具调用，紧随其后的代码块结尾要去掉
+        self.calls = []
+
+    def feed(self, delta: str):
+        if not delta:
+            return "", []
+        self._parts.append(delta)
+        out = []
+        new_calls = []
+        self._convert(self._scanner.scan(delta), out, new_calls)
+        out.append(self._release())
+        self.calls.extend(new_calls)
+        return "".join(out), new_calls
+
+    def finish(self):
+        """回复结束：先在未闭合的候选内部找工具调用，其余文本与暂缓的反引号行都按正文放行。"""
+        out = []
+        new_calls = []
+        self._convert(self._scanner.finish(), out, new_calls)
+        self.calls.extend(new_calls)
+        out.append(self._skip_fence_close("".join(self._parts)))
+        self._parts = []
+        self._held_at = -1
+        text = "".join(out)
+        return (text if text.strip() or not self.calls else ""), new_calls
+
+    def _convert(self, spans, out, new_calls):
+        """处理闭合的候选：工具调用转为 tool_calls 并把之前的正文放入 out，普通 JSON 留作正文。"""
+        for start, end in spans:
+            self._held_at = -1
+            text = "".join(self._parts)
+            try:
+                obj = json.loads(text[start - self._base:end - self._base])
+            except ValueError:
+                # 无法解析的候选（如 {说明 {"tool_calls": ...}}）：在其内部继续找
+                inner = JsonScanner("{", start + 1)
+                self._parts = [text]
+                self._convert(list(itertools.chain(inner.scan(text[start + 1 - self._base:end - self._base]),
+                                                   inner.finish())), out, new_calls)
+                continue
+            calls = tool_calls_from_json(obj)
+            if calls is None:
+                self._parts = [text]  # 普通 JSON 按正文放行
+                continue
+            before = text[:start - self._base]
+            m = _FENCE_OPEN_RE.search(before)
+            out.append(self._skip_fence_close(before[:m.start()] if m else before).rstrip())
+            new_calls.extend(calls)
+            self._parts = [text[end - self._base:]]
+            self._base = end
+            self._after_call = True
+
+    def _skip_fence_close(self, text):
+        if self._after_call:
+            m = _FENCE_CLOSE_RE.match(text)
+            if m:
+                text = text[m.end():]
+            self._after_call = False
+        return text
+
+    def _release(self):
+        """放行确定是正文的部分，返回放行的文本。"""
+        open_start = self._scanner.open_start
+        if open_start >= 0 and open_start == self._held_at:
+            return ""
+        text = "".join(self._parts)
+        if self._after_call:
+            stripped = text.lstrip()
+            if not stripped or (stripped.startswith("`") and "\n" not in stripped):
+                self._parts = [text]
+                return ""  # 还看不出后面是不是代码块结尾
+            skipped = len(text) - len(self._skip_fence_close(text))
+            text = text[skipped:]
+            self._base += skipped
+        if open_start >= 0:
+            cut = open_start - self._base
+            m = _FENCE_OPEN_RE.search(text, 0, cut)
+            if m:
+                cut = m.start()
+            self._held_at = open_start
+        else:
+            m = _FENCE_TAIL_RE.search(text)
+            cut = m.start() if m else len(text)
+        self._parts = [text[cut:]]
+        self._base += cut
+        return text[:cut]
+
+
+def extract_tool_calls(content: str):
+    """非流式：返回 (去掉工具调用 JSON 后的 content, tool_calls 列表或 None)。"""
+    stream = ToolCallStream()
+    text, _ = stream.feed(content or "")
+    rest, _ = stream.finish()
+    text = (text + rest).strip()
+    return (text or None), (stream.calls or None)
+
+
+def iter_argument_fragments(call, chunk: int = ARGUMENT_CHUNK):
+    """流式 delta.tool_calls：先发 id / 名称，再把 arguments 分段发送。"""
+    args = call["function"]["arguments"]
+    yield {"id": call["id"], "type": "function", "function": {"name": call["function"]["name"], "arguments": ""}}
+    for i in range(0, len(args), chunk):
+        yield {"function": {"arguments": args[i:i + chunk]}}
+
+
+def ollama_tool_calls(calls):
+    """Ollama 格式：arguments 为对象。"""
+    out = []
+    for call in calls:
+        try:
+            args = json.loads(call["function"]["arguments"] or "{}")
+        except ValueError:
+            args = {}
+        out.append({"function": {"name": call["function"]["name"], "arguments": args}})
+    return out